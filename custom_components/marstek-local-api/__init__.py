@@ -1,30 +1,172 @@
 import logging
 
-from homeassistant.const import CONF_HOST, CONF_PORT
+from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SCAN_INTERVAL
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.storage import Store
+
+from .api import MarstekDevice, acquire_socket, release_socket
+from .const import (
+    CONF_DEVICE_NAME,
+    CONF_DOMAINS,
+    CONF_HOSTS,
+    CONF_MAX_IN_FLIGHT,
+    CONF_TIMEOUT_MAX,
+    CONF_TIMEOUT_MIN,
+    OPTIONS,
+    SIGNAL_METHODS_CHANGED,
+    STORAGE_VERSION,
+)
+from .coordinator import MarstekCoordinator
+from .descriptions import METHOD_KEYS
+from .scheduler import FleetScheduler
 
 DOMAIN = "marstek_local_api"
 _LOGGER = logging.getLogger(__name__)
 
 
+def _hosts(entry):
+    """Return the hosts polled by entry, several for a hub."""
+    return entry.data.get(CONF_HOSTS) or [entry.data[CONF_HOST]]
+
+
+def _settings(entry):
+    """Return entry's settings, the options overriding the initial data."""
+    return {**entry.data, **entry.options}
+
+
+def _methods(entry):
+    return list(_settings(entry).get(CONF_DOMAINS, list(OPTIONS.keys())))
+
+
+def _store(hass, entry, host=None):
+    """Return the store of the last known readings of a device of entry.
+
+    Devices of a hub each have their own, keyed by host.
+    """
+    key = f"{DOMAIN}.{entry.entry_id}"
+    if host is not None:
+        key = f"{key}.{host}"
+    return Store(hass, STORAGE_VERSION, key)
+
+
 async def async_setup(hass, config):
     return True
 
 
 async def async_setup_entry(hass, entry):
+    port = entry.data[CONF_PORT]
+    hosts = _hosts(entry)
+    settings = _settings(entry)
+    device_name = entry.data.get(CONF_DEVICE_NAME, "Marstek Battery")
+    # The devices of a hub poll on their own phase and share a request limit
+    fleet = FleetScheduler(len(hosts)) if len(hosts) > 1 else None
+    coordinators = []
+    for index, host in enumerate(hosts):
+        device = MarstekDevice(
+            host,
+            port,
+            _methods(entry),
+            f"{device_name} {index + 1}" if fleet else device_name,
+            settings.get(CONF_MAX_IN_FLIGHT),
+            udp_socket=acquire_socket(hass, port),
+            timeout_min=settings.get(CONF_TIMEOUT_MIN),
+            timeout_max=settings.get(CONF_TIMEOUT_MAX),
+            keys=METHOD_KEYS,
+            limiter=fleet.limiter if fleet else None,
+        )
+        coordinator = MarstekCoordinator(
+            hass,
+            device,
+            settings.get(CONF_SCAN_INTERVAL),
+            store=_store(hass, entry, host if fleet else None),
+            fleet=fleet,
+            fleet_index=index,
+        )
+        # Entities start from the readings of the previous run, the first poll
+        # runs in the background so setup does not wait for the device
+        await coordinator.async_restore()
+        coordinators.append(coordinator)
+
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = {
         "host": entry.data[CONF_HOST],
-        "port": entry.data[CONF_PORT],
+        "port": port,
+        # The first device, the only one unless the entry is a hub
+        "coordinator": coordinators[0],
+        "coordinators": coordinators,
+        "methods": _methods(entry),
     }
 
     # Nieuwere API: meerdere platforms tegelijk
-    await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
+    try:
+        await hass.config_entries.async_forward_entry_setups(entry, ["sensor"])
+    except Exception:
+        hass.data[DOMAIN].pop(entry.entry_id)
+        for _ in coordinators:
+            release_socket(hass, port)
+        raise
+    entry.async_on_unload(entry.add_update_listener(_async_update_listener))
+    for coordinator in coordinators:
+        entry.async_create_background_task(
+            hass,
+            coordinator.async_start(),
+            f"{DOMAIN} first refresh {coordinator.device._host}",
+        )
     return True
 
 
+async def _async_update_listener(hass, entry):
+    """Apply changed options to the running devices instead of reloading.
+
+    Only the entities of added or removed methods are created or removed.
+    """
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    settings = _settings(entry)
+    methods = _methods(entry)
+    for coordinator in entry_data["coordinators"]:
+        coordinator.device.reconfigure(
+            methods,
+            settings.get(CONF_MAX_IN_FLIGHT),
+            settings.get(CONF_TIMEOUT_MIN),
+            settings.get(CONF_TIMEOUT_MAX),
+        )
+        coordinator.reconfigure(settings.get(CONF_SCAN_INTERVAL))
+        # Poll with the new plan right away, which restarts the timer
+        entry.async_create_background_task(
+            hass,
+            coordinator.async_start(),
+            f"{DOMAIN} restart {coordinator.device._host}",
+        )
+
+    old_methods = entry_data["methods"]
+    entry_data["methods"] = methods
+    added = [method for method in methods if method not in old_methods]
+    removed = [method for method in old_methods if method not in methods]
+    if added or removed:
+        async_dispatcher_send(
+            hass, SIGNAL_METHODS_CHANGED.format(entry.entry_id), added, removed
+        )
+
+
 async def async_unload_entry(hass, entry):
     # Nieuwere API: netjes ontladen
     unload_ok = await hass.config_entries.async_unload_platforms(entry, ["sensor"])
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id, None)
+        entry_data = hass.data[DOMAIN].pop(entry.entry_id, None)
+        if entry_data and "coordinator" in entry_data:
+            for coordinator in entry_data.get(
+                "coordinators", [entry_data["coordinator"]]
+            ):
+                # Written now, a delayed write could overwrite a reload's values
+                await coordinator.async_shutdown()
+                release_socket(hass, entry_data["port"])
     return unload_ok
+
+
+async def async_remove_entry(hass, entry):
+    hosts = _hosts(entry)
+    if len(hosts) == 1:
+        await _store(hass, entry).async_remove()
+        return
+    for host in hosts:
+        await _store(hass, entry, host).async_remove()
@@ -0,0 +1,581 @@
+"""Async UDP client for the Marstek local API."""
+import asyncio
+import contextlib
+import ipaddress
+import logging
+import socket
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+from .codec import decode_reply, encode_request, select_keys
+from .const import (
+    DATA_SOCKETS,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_TIMEOUT_MAX,
+    DEFAULT_TIMEOUT_MIN,
+    MAX_REQUEST_ID,
+    PACER_MAX_RATE,
+    PACER_MIN_RATE,
+    PACER_RATE,
+    PACER_STEP,
+    REQUEST_TIMEOUT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RequestRegistry:
+    """In-flight requests keyed by device IP and a unique numeric request id.
+
+    Each request gets a deadline. Replies that match no entry, arrive a second
+    time or come in after the deadline are rejected without touching any
+    cache, so the table never holds more than the requests in flight.
+    """
+
+    def __init__(self):
+        self._last_id = 0
+        self._pending = {}
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def register(self, ip, timeout):
+        """Add a request and return its id and the future for the reply."""
+        loop = asyncio.get_running_loop()
+        self._last_id = self._last_id % MAX_REQUEST_ID + 1
+        future = loop.create_future()
+        self._pending[(ip, self._last_id)] = (future, loop.time() + timeout)
+        return self._last_id, future
+
+    def resolve(self, ip, reply):
+        """Complete the request a reply belongs to, returning False if rejected."""
+        entry = self._pending.pop((ip, reply.get("id")), None)
+        if entry is None:
+            self.rejected += 1
+            return False
+        future, deadline = entry
+        if future.done() or asyncio.get_running_loop().time() > deadline:
+            self.rejected += 1
+            return False
+        future.set_result(reply)
+        return True
+
+    def discard(self, ip, request_id):
+        """Forget a request that completed or timed out."""
+        self._pending.pop((ip, request_id), None)
+
+    def fail_all(self, exc):
+        """Fail every request still waiting."""
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+
+class MarstekProtocol(asyncio.DatagramProtocol):
+    """Hands incoming JSON-RPC replies to the request waiting for them.
+
+    Requests are tracked in a RequestRegistry keyed by device IP and request
+    id, so one socket can serve any number of devices.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self._requests = RequestRegistry()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            result = decode_reply(data)
+        except ValueError as e:
+            _LOGGER.error("MarstekProtocol: Invalid response from %s: %s", addr, e)
+            return
+
+        if not isinstance(result, dict):
+            _LOGGER.debug("MarstekProtocol: Ignoring non-object reply from %s", addr)
+            return
+
+        if not self._requests.resolve(addr[0], result):
+            _LOGGER.debug(
+                "MarstekProtocol: Ignoring unknown or late reply from %s: %s",
+                addr,
+                result,
+            )
+
+    def error_received(self, exc):
+        _LOGGER.debug("MarstekProtocol: Socket error: %s", exc)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._requests.fail_all(exc or ConnectionError("Socket closed"))
+
+    async def request(self, addr, method, timeout):
+        """Send a request for method to addr and wait for its reply."""
+        request_id, future = self._requests.register(addr[0], timeout)
+        try:
+            self.transport.sendto(encode_request(request_id, method), addr)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._requests.discard(addr[0], request_id)
+
+
+class RequestPacer:
+    """Spaces requests to one host at a rate learned from its answers.
+
+    Works as a token bucket holding a single token: a request waits until
+    1 / rate seconds have passed since the previous one. Every answer adds a
+    fixed step to the rate and every lost request halves it (additive
+    increase, multiplicative decrease), so it settles just below the fastest
+    rate the device reliably keeps up with.
+    """
+
+    def __init__(self):
+        self.min_rate = PACER_MIN_RATE
+        self.max_rate = max(PACER_MIN_RATE, PACER_MAX_RATE)
+        self.rate = min(self.max_rate, max(self.min_rate, PACER_RATE))
+        self._next_at = 0.0
+
+    async def acquire(self):
+        """Wait until the next request may be sent."""
+        now = asyncio.get_running_loop().time()
+        send_at = max(now, self._next_at)
+        self._next_at = send_at + 1 / self.rate
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    def record_answer(self):
+        self.rate = min(self.max_rate, self.rate + PACER_STEP)
+
+    def record_loss(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+
+
+class MarstekSocket:
+    """Long-lived UDP endpoint on a local port, shared by the devices using it.
+
+    The endpoint is opened on first use and reopened if it was lost. It also
+    keeps a RequestPacer per host, so learned rates outlive a reopen.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.users = 0
+        self._protocol = None
+        self._lock = asyncio.Lock()
+        self._pacers = {}
+
+    @property
+    def is_open(self):
+        return self._protocol is not None and self._protocol.transport is not None
+
+    @property
+    def rejected(self):
+        """Replies dropped as unknown, duplicate or late since opening."""
+        return self._protocol._requests.rejected if self._protocol else 0
+
+    def pacer(self, ip):
+        """Return the RequestPacer for requests to ip."""
+        if ip not in self._pacers:
+            self._pacers[ip] = RequestPacer()
+        return self._pacers[ip]
+
+    async def async_open(self):
+        """Bind the endpoint unless it is already open."""
+        async with self._lock:
+            if self.is_open:
+                return
+            loop = asyncio.get_running_loop()
+            _, self._protocol = await loop.create_datagram_endpoint(
+                MarstekProtocol, local_addr=("0.0.0.0", self.port)
+            )
+            _LOGGER.debug("MarstekSocket: Listening on port %s", self.port)
+
+    async def request(self, addr, method, timeout):
+        """Send a request for method to addr and wait for its reply."""
+        if not self.is_open:
+            raise ConnectionError("Socket is not open")
+        return await self._protocol.request(addr, method, timeout)
+
+    def close(self):
+        """Close the endpoint, failing any request still waiting."""
+        if self.is_open:
+            self._protocol.transport.close()
+        self._protocol = None
+
+
+def acquire_socket(hass, port):
+    """Return the shared socket for port, creating it on first use."""
+    sockets = hass.data.setdefault(DATA_SOCKETS, {})
+    udp_socket = sockets.get(port)
+    if udp_socket is None:
+        udp_socket = sockets[port] = MarstekSocket(port)
+    udp_socket.users += 1
+    return udp_socket
+
+
+def release_socket(hass, port):
+    """Drop a user of the shared socket for port, closing it after the last."""
+    sockets = hass.data.get(DATA_SOCKETS, {})
+    udp_socket = sockets.get(port)
+    if udp_socket is None:
+        return
+    udp_socket.users -= 1
+    if udp_socket.users <= 0:
+        sockets.pop(port)
+        udp_socket.close()
+
+
+class RttEstimator:
+    """Round trip time tracking with a TCP style retransmission timeout.
+
+    Follows RFC 6298: a smoothed round trip time and its mean deviation are
+    updated from every answered request, and the timeout is the smoothed
+    value plus four deviations, kept between the floor and the ceiling.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, timeout_min, timeout_max):
+        self.timeout_min = timeout_min
+        self.timeout_max = max(timeout_min, timeout_max)
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.timeout = self._clamp(REQUEST_TIMEOUT)
+
+    def _clamp(self, timeout):
+        return min(self.timeout_max, max(self.timeout_min, timeout))
+
+    def sample(self, rtt):
+        """Update the estimate with a measured round trip in seconds."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.samples += 1
+        self.timeout = self._clamp(self.srtt + self.K * self.rttvar)
+
+    def set_bounds(self, timeout_min, timeout_max):
+        """Change the floor and ceiling, keeping the measured round trips."""
+        self.timeout_min = timeout_min
+        self.timeout_max = max(timeout_min, timeout_max)
+        self.timeout = self._clamp(self.timeout)
+
+    def backoff(self):
+        """Double the timeout after the device stopped answering."""
+        self.timeout = self._clamp(self.timeout * 2)
+
+    def as_dict(self):
+        return {
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "timeout": self.timeout,
+            "samples": self.samples,
+        }
+
+
+EMPTY = MappingProxyType({})
+
+
+@dataclass(frozen=True, slots=True)
+class CacheSnapshot:
+    """Read-only results of all methods as published after a poll cycle.
+
+    data maps each method to its read-only values and updated_at to the time
+    they were received. A new snapshot replaces the previous one as a whole,
+    so a reader holding one always sees values from the same cycles,
+    whatever happens after.
+    """
+
+    cycle: int = 0
+    timestamp: float | None = None
+    data: MappingProxyType = field(default_factory=lambda: EMPTY)
+    updated_at: MappingProxyType = field(default_factory=lambda: EMPTY)
+
+
+class MarstekDevice:
+    """Manages UDP communication and caches results per method.
+
+    Up to max_in_flight requests are outstanding at the same time and replies
+    are matched to their request through the JSON-RPC id. With a limit of one
+    the methods are requested one after another, paced by the socket's
+    RequestPacer for the device's IP.
+
+    Requests go through the given MarstekSocket, which is shared with other
+    devices on the same port. Without one the device opens its own.
+
+    Each request waits for the timeout of the device's RttEstimator. With
+    keys given, only those reply keys are kept per method. A limiter, shared
+    by the devices of a hub, is held for every outstanding request.
+
+    A cycle that takes longer than budget seconds is cut off: requests still
+    outstanding are cancelled and count as unanswered.
+
+    Every answered method is published right away as a new CacheSnapshot
+    and never changed in place; on_result, if set, is then called with the
+    method. JSON-RPC error replies are counted in errors
+    per method and error code instead, last_errors holds the error codes of
+    the latest cycle.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        methods,
+        device_name="Marstek Battery",
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        udp_socket: MarstekSocket | None = None,
+        timeout_min=None,
+        timeout_max=None,
+        keys=None,
+        limiter: asyncio.Semaphore | None = None,
+    ):
+        self._host = host
+        self._port = port
+        self._methods = methods
+        self._device_name = device_name
+        self._max_in_flight = max(1, max_in_flight or DEFAULT_MAX_IN_FLIGHT)
+        self._owns_socket = udp_socket is None
+        self._socket = udp_socket or MarstekSocket(port)
+        self._addr = None
+        self.snapshot = CacheSnapshot()
+        self.on_result = None
+        self._cycle = 0
+        self.errors = {}
+        self.last_errors = {}
+        # Reply keys to keep per method, everything for methods not listed
+        self._keys = keys or {}
+        # Shared with the other devices of a hub to bound their requests
+        self._limiter = limiter
+        # Seconds a cycle may take, set by the coordinator
+        self.budget = None
+        self.overruns = 0
+        self.rtt = RttEstimator(
+            timeout_min or DEFAULT_TIMEOUT_MIN, timeout_max or DEFAULT_TIMEOUT_MAX
+        )
+
+    async def _async_resolve(self):
+        """Return the device address, resolving a hostname only once.
+
+        Replies are matched on their source IP, so hostnames must be resolved.
+        """
+        if self._addr is None:
+            try:
+                ipaddress.ip_address(self._host)
+                ip = self._host
+            except ValueError:
+                infos = await asyncio.get_running_loop().getaddrinfo(
+                    self._host,
+                    self._port,
+                    family=socket.AF_INET,
+                    type=socket.SOCK_DGRAM,
+                )
+                ip = infos[0][4][0]
+            self._addr = (ip, self._port)
+        return self._addr
+
+    @property
+    def _cache(self):
+        return self.snapshot.data
+
+    def _publish(self, results, methods=()):
+        """Replace the snapshot with one holding results on top of the last.
+
+        The snapshot carries the number of the cycle in progress.
+
+        Methods without any result yet get an empty entry.
+        """
+        now = time.time()
+        data = dict(self.snapshot.data)
+        updated_at = dict(self.snapshot.updated_at)
+        for method, values in results.items():
+            data[method] = MappingProxyType(values)
+            updated_at[method] = now
+        for method in methods:
+            data.setdefault(method, EMPTY)
+        self.snapshot = CacheSnapshot(
+            self._cycle,
+            now,
+            MappingProxyType(data),
+            MappingProxyType(updated_at),
+        )
+
+    def restore(self, data, updated_at):
+        """Start from values stored by an earlier run, before any poll.
+
+        Only methods this device polls are taken over.
+        """
+        data = {
+            method: MappingProxyType(dict(values))
+            for method, values in data.items()
+            if method in self._methods
+        }
+        updated_at = {
+            method: timestamp
+            for method, timestamp in updated_at.items()
+            if method in data
+        }
+        self.snapshot = CacheSnapshot(
+            0,
+            max(updated_at.values(), default=None),
+            MappingProxyType(data),
+            MappingProxyType(updated_at),
+        )
+
+    async def _async_request(self, addr, method):
+        """Request a single method and return the reply, None if unanswered."""
+        _LOGGER.debug("MarstekDevice: Sending request for %s", method)
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._limiter or contextlib.nullcontext():
+                sent_at = loop.time()
+                result = await self._socket.request(addr, method, self.rtt.timeout)
+        except asyncio.TimeoutError:
+            _LOGGER.debug(
+                "MarstekDevice: No response for %s within %.2f s",
+                method,
+                self.rtt.timeout,
+            )
+            return None
+        except Exception as e:
+            _LOGGER.error("MarstekDevice: Error sending request for %s: %s", method, e)
+            return None
+
+        self.rtt.sample(loop.time() - sent_at)
+        return result
+
+    def _parse_reply(self, method, reply):
+        """Return the values in a reply, None if it is a JSON-RPC error."""
+        error = reply.get("error")
+        if error is not None:
+            code = str(error.get("code") if isinstance(error, dict) else error)
+            counts = self.errors.setdefault(method, {})
+            counts[code] = counts.get(code, 0) + 1
+            self.last_errors[method] = code
+            _LOGGER.debug("MarstekDevice: %s answered with error %s", method, error)
+            return None
+
+        res_values = reply.get("result", {})
+        if not isinstance(res_values, dict):
+            res_values = {}
+        res_values = select_keys(res_values, self._keys.get(method))
+        _LOGGER.debug("MarstekDevice: Received data for %s: %s", method, res_values)
+        return res_values
+
+    async def async_update(self, methods=None):
+        """Request methods, all configured ones by default.
+
+        Returns the methods that were answered.
+        """
+        methods = self._methods if methods is None else methods
+        _LOGGER.debug("MarstekDevice: Starting update cycle for %s", methods)
+        self.last_errors = {}
+        try:
+            await self._socket.async_open()
+            addr = await self._async_resolve()
+        except OSError as e:
+            _LOGGER.error("MarstekDevice: Socket setup failed: %s", e)
+            return set()
+
+        self._cycle += 1
+        answered = set()
+        replies = []
+
+        async def _async_fetch(method):
+            reply = await self._async_request(addr, method)
+            replies.append(reply)
+            # Error replies leave the last good values in place and the
+            # method unanswered, so only failed methods are requested again
+            values = None if reply is None else self._parse_reply(method, reply)
+            if values is not None:
+                answered.add(method)
+                self._publish({method: values})
+                if self.on_result is not None:
+                    self.on_result(method)
+            return reply
+
+        async def _async_serial():
+            pacer = self._socket.pacer(addr[0])
+            for method in methods:
+                await pacer.acquire()
+                reply = await _async_fetch(method)
+                if reply is not None:
+                    pacer.record_answer()
+                elif self._cache.get(method):
+                    # A method that never answered is likely unsupported,
+                    # its silence says nothing about the pace
+                    pacer.record_loss()
+
+        async def _async_pipelined():
+            slots = asyncio.Semaphore(self._max_in_flight)
+
+            async def _async_limited_fetch(method):
+                async with slots:
+                    return await _async_fetch(method)
+
+            await asyncio.gather(*(_async_limited_fetch(method) for method in methods))
+
+        try:
+            async with asyncio.timeout(self.budget):
+                if self._max_in_flight == 1:
+                    await _async_serial()
+                else:
+                    await _async_pipelined()
+        except TimeoutError:
+            self.overruns += 1
+            _LOGGER.debug(
+                "MarstekDevice: Cycle budget of %.1f s used up, cancelled %s",
+                self.budget,
+                [method for method in methods if method not in answered],
+            )
+
+        self._publish({}, methods)
+
+        # A single silent method is likely unsupported, only a fully silent
+        # cycle says something about the link
+        if replies and all(reply is None for reply in replies):
+            self.rtt.backoff()
+
+        return answered
+
+    def reconfigure(
+        self, methods, max_in_flight=None, timeout_min=None, timeout_max=None
+    ):
+        """Apply new settings between cycles, keeping cached values and RTTs."""
+        self._methods = list(methods)
+        self._max_in_flight = max(1, max_in_flight or DEFAULT_MAX_IN_FLIGHT)
+        self.rtt.set_bounds(
+            timeout_min or DEFAULT_TIMEOUT_MIN, timeout_max or DEFAULT_TIMEOUT_MAX
+        )
+
+    def close(self):
+        """Close the socket if this device opened it itself."""
+        if self._owns_socket:
+            self._socket.close()
+
+    def diagnostics(self):
+        """Return runtime state for the diagnostics download."""
+        return {
+            "methods": list(self._methods),
+            "max_in_flight": self._max_in_flight,
+            "cycle": self.snapshot.cycle,
+            "rtt": self.rtt.as_dict(),
+            "rejected_replies": self._socket.rejected,
+            "errors": self.errors,
+            "overruns": self.overruns,
+            "pacing_rate": self._socket.pacer(self._addr[0]).rate
+            if self._addr
+            else None,
+        }
+
+    def get_value(self, method, key):
+        return self._cache.get(method, {}).get(key)
@@ -0,0 +1,38 @@
+"""Wire format of the Marstek local API: JSON-RPC over UDP."""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson ships with Home Assistant
+    orjson = None
+
+# Everything after the request id, encoded once per method
+_REQUEST_TAILS = {}
+# Parameters of methods that take more than the id
+_PARAMS = {"Marstek.GetDevice": {"ble_mac": "0"}}
+
+
+def encode_request(request_id, method):
+    """Return the datagram requesting method under request_id."""
+    tail = _REQUEST_TAILS.get(method)
+    if tail is None:
+        body = json.dumps(
+            {"method": method, "params": _PARAMS.get(method, {"id": 0})},
+            separators=(",", ":"),
+        )
+        tail = _REQUEST_TAILS[method] = body[1:].encode("ascii")
+    return b'{"id":%d,' % request_id + tail
+
+
+def decode_reply(data):
+    """Parse a reply datagram, raising ValueError if it is not valid JSON."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def select_keys(values, keys):
+    """Return only keys from values, all of them when keys is None."""
+    if keys is None:
+        return values
+    return {key: values[key] for key in keys if key in values}
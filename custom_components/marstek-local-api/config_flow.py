@@ -2,8 +2,25 @@ import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SCAN_INTERVAL
+from homeassistant.core import callback
 
-from .const import CONF_DEVICE_NAME, CONF_DOMAINS, DOMAIN, OPTIONS
+from .const import (
+    CONF_DEVICE_NAME,
+    CONF_DOMAINS,
+    CONF_HOSTS,
+    CONF_MAX_IN_FLIGHT,
+    CONF_TIMEOUT_MAX,
+    CONF_TIMEOUT_MIN,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_PORT,
+    DEFAULT_SCAN_INTERVAL,
+    DEFAULT_TIMEOUT_MAX,
+    DEFAULT_TIMEOUT_MIN,
+    DOMAIN,
+    OPTIONS,
+)
+from .discovery import async_discover, async_get_subnet_hosts
+from .probe import async_probe
 
 
 class MarstekConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -11,21 +28,178 @@ class MarstekConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return MarstekOptionsFlow()
+
+    def __init__(self):
+        self._settings = {}
+        self._discovered = {}
+        self._host = None
+
     async def async_step_user(self, user_input=None):
-        """Handle the initial step."""
+        """Handle the initial step.
+
+        Several hosts separated by commas create a hub entry polling all of
+        them with the same settings. A single host is probed before its poll
+        settings are asked. Without a host the local network is searched for
+        devices.
+        """
         if user_input is not None:
-            return self.async_create_entry(title="Marstek Battery", data=user_input)
+            hosts = [
+                host.strip()
+                for host in user_input.get(CONF_HOST, "").split(",")
+                if host.strip()
+            ]
+            if len(hosts) > 1:
+                return self.async_create_entry(
+                    title="Marstek Hub", data={**user_input, CONF_HOSTS: hosts}
+                )
+            self._settings = {
+                key: value for key, value in user_input.items() if key != CONF_HOST
+            }
+            if not hosts:
+                return await self.async_step_discover()
+            self._host = hosts[0]
+            self._async_abort_entries_match({CONF_HOST: self._host})
+            return await self.async_step_settings()
 
         schema = vol.Schema(
             {
-                vol.Required(CONF_HOST): str,
-                vol.Required(CONF_PORT, default=30000): int,
+                vol.Optional(CONF_HOST): str,
+                vol.Required(CONF_PORT, default=DEFAULT_PORT): int,
                 vol.Required(CONF_DEVICE_NAME, default="Marstek Battery"): str,
-                vol.Optional(CONF_SCAN_INTERVAL, default=30): int,
+                # Left empty, a hub polls everything at the default interval
+                # and a single device gets what its probe recommends
+                vol.Optional(CONF_SCAN_INTERVAL): int,
+                vol.Optional(CONF_DOMAINS): cv.multi_select(OPTIONS),
                 vol.Optional(
-                    CONF_DOMAINS, default=list(OPTIONS.keys())
-                ): cv.multi_select(OPTIONS),
+                    CONF_MAX_IN_FLIGHT, default=DEFAULT_MAX_IN_FLIGHT
+                ): vol.All(int, vol.Range(min=1, max=len(OPTIONS))),
+                vol.Optional(CONF_TIMEOUT_MIN, default=DEFAULT_TIMEOUT_MIN): vol.All(
+                    vol.Coerce(float), vol.Range(min=0.1, max=30)
+                ),
+                vol.Optional(CONF_TIMEOUT_MAX, default=DEFAULT_TIMEOUT_MAX): vol.All(
+                    vol.Coerce(float), vol.Range(min=0.1, max=30)
+                ),
             }
         )
 
         return self.async_show_form(step_id="user", data_schema=schema)
+
+    async def async_step_discover(self, user_input=None):
+        """Let the user pick one of the devices found on the local network.
+
+        Devices at an address that already has an entry are left out. A known
+        device found at another address is offered, picking it moves its entry
+        there. The picked device is probed before its settings are asked.
+        """
+        if user_input is None:
+            port = self._settings.get(CONF_PORT, DEFAULT_PORT)
+            hosts = await async_get_subnet_hosts(self.hass)
+            configured_hosts = {
+                host
+                for entry in self._async_current_entries()
+                for host in entry.data.get(CONF_HOSTS) or [entry.data.get(CONF_HOST)]
+            }
+            self._discovered = {
+                device.host: device
+                for device in await async_discover(self.hass, port, hosts)
+                if device.host not in configured_hosts
+            }
+            if not self._discovered:
+                return self.async_abort(reason="no_devices_found")
+
+            devices = {
+                host: f"{host} ({device.model or 'Marstek'}, {device.rtt * 1000:.0f} ms)"
+                for host, device in self._discovered.items()
+            }
+            return self.async_show_form(
+                step_id="discover",
+                data_schema=vol.Schema({vol.Required(CONF_HOST): vol.In(devices)}),
+            )
+
+        device = self._discovered[user_input[CONF_HOST]]
+        if device.mac:
+            await self.async_set_unique_id(device.mac)
+            # A device that moved to another address keeps its entry
+            self._abort_if_unique_id_configured(updates={CONF_HOST: device.host})
+        self._host = device.host
+        return await self.async_step_settings()
+
+    async def async_step_settings(self, user_input=None):
+        """Ask the poll settings, pre-filled with what the probe recommends.
+
+        Settings already entered in the user step are kept as the defaults.
+        """
+        if user_input is not None:
+            return self.async_create_entry(
+                title="Marstek Battery",
+                data={**self._settings, CONF_HOST: self._host, **user_input},
+            )
+
+        port = self._settings.get(CONF_PORT, DEFAULT_PORT)
+        probe = await async_probe(self.hass, self._host, port)
+        if not probe.methods:
+            return self.async_abort(reason="cannot_connect")
+
+        schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_SCAN_INTERVAL,
+                    default=self._settings.get(CONF_SCAN_INTERVAL, probe.scan_interval),
+                ): int,
+                vol.Optional(
+                    CONF_DOMAINS,
+                    default=self._settings.get(CONF_DOMAINS) or probe.methods,
+                ): cv.multi_select(OPTIONS),
+            }
+        )
+        return self.async_show_form(
+            step_id="settings",
+            data_schema=schema,
+            description_placeholders={
+                "rtt": f"{probe.rtt * 1000:.0f}" if probe.rtt is not None else "-",
+                "loss": f"{probe.loss * 100:.0f}",
+            },
+        )
+
+
+class MarstekOptionsFlow(config_entries.OptionsFlow):
+    """Change the poll settings of a running entry.
+
+    The new options are applied to the running devices in place, see the
+    entry's update listener, so entity history and the socket are kept.
+    """
+
+    async def async_step_init(self, user_input=None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        settings = {**self.config_entry.data, **self.config_entry.options}
+        schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_SCAN_INTERVAL,
+                    default=settings.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL),
+                ): int,
+                vol.Optional(
+                    CONF_DOMAINS,
+                    default=settings.get(CONF_DOMAINS, list(OPTIONS.keys())),
+                ): cv.multi_select(OPTIONS),
+                vol.Optional(
+                    CONF_MAX_IN_FLIGHT,
+                    default=settings.get(CONF_MAX_IN_FLIGHT, DEFAULT_MAX_IN_FLIGHT),
+                ): vol.All(int, vol.Range(min=1, max=len(OPTIONS))),
+                vol.Optional(
+                    CONF_TIMEOUT_MIN,
+                    default=settings.get(CONF_TIMEOUT_MIN, DEFAULT_TIMEOUT_MIN),
+                ): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=30)),
+                vol.Optional(
+                    CONF_TIMEOUT_MAX,
+                    default=settings.get(CONF_TIMEOUT_MAX, DEFAULT_TIMEOUT_MAX),
+                ): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=30)),
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=schema)
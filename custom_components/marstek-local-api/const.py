@@ -1,4 +1,6 @@
 DOMAIN = "marstek_local_api"
+# Sockets per local port, shared by every entry polling over that port
+DATA_SOCKETS = f"{DOMAIN}_sockets"
 
 CONF_DOMAINS = "domains"
 
@@ -11,3 +13,98 @@ OPTIONS = {
     "ES.GetMode": "Charging Strategy",
 }
 CONF_DEVICE_NAME = "Device Name"
+CONF_MAX_IN_FLIGHT = "max_in_flight"
+CONF_TIMEOUT_MIN = "timeout_min"
+CONF_TIMEOUT_MAX = "timeout_max"
+# Hosts of a hub entry, which polls several devices with the same settings
+CONF_HOSTS = "hosts"
+# Sent with the added and removed methods when the options change them,
+# formatted with the entry id
+SIGNAL_METHODS_CHANGED = "marstek_local_api_methods_changed_{}"
+
+DEFAULT_PORT = 30000
+DEFAULT_SCAN_INTERVAL = 30
+# Slowest changing methods are never polled faster than this many seconds,
+# the others follow the scan interval
+METHOD_MIN_INTERVALS = {
+    "Bat.GetStatus": 30,
+    "Wifi.GetStatus": 600,
+    "BLE.GetStatus": 600,
+}
+# Send every selected method at once, lower it for firmware that drops bursts
+DEFAULT_MAX_IN_FLIGHT = len(OPTIONS)
+
+# Poll the scan interval methods every BURST_INTERVAL seconds while the
+# battery changes state, until readings stayed calm for BURST_HOLD seconds
+BURST_INTERVAL = 5
+BURST_HOLD = 120
+# Watts a power reading has to move between two polls to start a burst
+BURST_POWER_THRESHOLD = 50
+BURST_FLAG_KEYS = {"Bat.GetStatus": ("charg_flag", "dischrg_flag")}
+BURST_POWER_KEYS = {"ES.GetStatus": ("bat_power", "ongrid_power")}
+
+# Version of the stored last known readings, and the least number of seconds
+# between two writes of them
+STORAGE_VERSION = 1
+STORE_DELAY = 300
+# Restored readings count as fresh until the first poll completed, unless
+# they are older than this many seconds
+RESTORE_MAX_AGE = 900
+
+# Readings older than this many poll intervals of their method are stale and
+# their entities unavailable
+STALE_INTERVALS = 3
+
+# A method is dropped from the poll plan once the device rejects it as unknown
+# or leaves it unanswered this many cycles in a row while answering others.
+# Dropped methods are probed again every CAPABILITY_REPROBE seconds
+UNSUPPORTED_MISSES = 3
+CAPABILITY_REPROBE = 3600
+# JSON-RPC error code for a method the device does not know
+METHOD_NOT_FOUND = "-32601"
+
+# Consecutive unanswered cycles before a device is considered offline. It is
+# then only probed, after a delay that doubles from BREAKER_BASE_DELAY up to
+# BREAKER_MAX_DELAY seconds
+BREAKER_THRESHOLD = 3
+BREAKER_BASE_DELAY = 30
+BREAKER_MAX_DELAY = 900
+
+# Share of the poll interval a cycle may take. Requests still outstanding
+# then are cancelled and retried on the next tick
+CYCLE_BUDGET = 0.8
+
+# Discovery asks every address of the local subnets, at most a /24 around
+# Home Assistant's own address, for its device info. DISCOVERY_CONCURRENCY
+# requests are outstanding at a time, each waiting DISCOVERY_TIMEOUT seconds
+DISCOVERY_METHOD = "Marstek.GetDevice"
+DISCOVERY_MIN_PREFIX = 24
+DISCOVERY_CONCURRENCY = 32
+DISCOVERY_TIMEOUT = 1.0
+
+# The connection probe requests every method PROBE_ROUNDS times in a row.
+# Methods answered in at least PROBE_MIN_RELIABILITY of the rounds are
+# recommended, with the shortest of PROBE_INTERVALS that fits the slowest
+# round in the cycle budget, one interval longer per PROBE_LOSS_STEP of loss
+PROBE_ROUNDS = 3
+PROBE_MIN_RELIABILITY = 0.6
+PROBE_INTERVALS = (5, 10, 15, 30, 60, 120, 300)
+PROBE_LOSS_STEP = 0.1
+
+# Requests outstanding at the same time over all devices of a hub entry
+FLEET_MAX_IN_FLIGHT = 4
+
+# Seconds to wait for a reply until round trips have been measured
+REQUEST_TIMEOUT = 2.0
+# Bounds in seconds for the timeout derived from measured round trips
+DEFAULT_TIMEOUT_MIN = 0.5
+DEFAULT_TIMEOUT_MAX = 5.0
+# Requests per second to one host when they are sent one at a time. The rate
+# starts at PACER_RATE and is learned between PACER_MIN_RATE and PACER_MAX_RATE,
+# growing by PACER_STEP for every answer and halving for every lost request
+PACER_RATE = 2.0
+PACER_MIN_RATE = 0.5
+PACER_MAX_RATE = 20.0
+PACER_STEP = 0.5
+# Request ids wrap around before they leave the signed 32 bit range
+MAX_REQUEST_ID = 2**31 - 1
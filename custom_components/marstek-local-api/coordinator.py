@@ -0,0 +1,416 @@
+"""Update coordinator fanning out one poll cycle to all Marstek sensors."""
+import logging
+import time
+from datetime import timedelta
+
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+from .api import MarstekDevice
+from .const import (
+    CYCLE_BUDGET,
+    DEFAULT_SCAN_INTERVAL,
+    DOMAIN,
+    METHOD_MIN_INTERVALS,
+    METHOD_NOT_FOUND,
+    RESTORE_MAX_AGE,
+    STALE_INTERVALS,
+    STORE_DELAY,
+)
+from .scheduler import (
+    BurstController,
+    CapabilityTracker,
+    CircuitBreaker,
+    FleetScheduler,
+    PollScheduler,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MarstekCoordinator(DataUpdateCoordinator):
+    """Polls a MarstekDevice and pushes results to entities.
+
+    Every method has its own interval: the scan interval, or longer for
+    methods that rarely change. Each tick requests only the methods that are
+    due, in one shared cycle. While the battery changes state the scan
+    interval is temporarily replaced by the faster burst interval.
+
+    Methods the device turns out not to support are left out of the plan
+    and only probed again once in a while.
+
+    A device that stops answering trips a circuit breaker. Until a probe
+    request gets an answer again, the update fails and entities become
+    unavailable. Error replies count as answers here. Silence of methods that
+    never answered does not count, so a device without PV is not taken
+    offline by cycles that only request PV.
+
+    Entities subscribe with their method as listener context. Until the
+    sensor platform added its entities every configured method is polled,
+    from then on only methods with a listening, so enabled, entity, nothing
+    when all are disabled. The plan is rebuilt whenever entities come or
+    go. After each cycle changed_methods holds the methods whose values
+    differ from the previous data, so entities of the other methods can skip
+    writing state.
+    The data is the device's read-only CacheSnapshot data, snapshot tells the
+    cycle and time it was published. Each reply is pushed to the entities of
+    its method as soon as it arrives, without waiting for the whole cycle.
+
+    A method's values are stale once they are older than its TTL, by default
+    a few times its interval. ttls overrides that per method in seconds.
+
+    With a Store given, the latest values are written to it at most every
+    STORE_DELAY seconds, and on async_shutdown and Home Assistant's stop.
+    async_restore loads them back, and restored values younger than
+    RESTORE_MAX_AGE count as fresh until the first refresh completed.
+
+    A coordinator of one of the devices of a hub ticks on the phase its
+    FleetScheduler gives fleet_index, see async_start. poll_interval is the
+    time between ticks, also when update_interval is None in a fleet.
+    """
+
+    def __init__(
+        self,
+        hass,
+        device: MarstekDevice,
+        scan_interval=None,
+        ttls=None,
+        store=None,
+        fleet: FleetScheduler | None = None,
+        fleet_index=0,
+    ):
+        scan_interval = scan_interval or DEFAULT_SCAN_INTERVAL
+        self.device = device
+        self.burst = BurstController(scan_interval)
+        self.breaker = CircuitBreaker()
+        self.capabilities = CapabilityTracker()
+        self.changed_methods = set()
+        self.snapshot = device.snapshot
+        self._store = store
+        self._save_pending = False
+        self._restored = False
+        self._polling = False
+        self._entities_added = False
+        # Update callbacks of the listeners per method, their context
+        self._method_listeners = {}
+        self.skipped_ticks = 0
+        self.fleet = fleet
+        self._fleet_index = fleet_index
+        self._unsub_tick = None
+        self._shut_down = False
+        self._probe_method = device._methods[0] if device._methods else None
+        device.on_result = self._async_method_received
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN} {device._device_name}",
+            # The devices of a fleet tick on their own timer, see async_start
+            update_interval=None if fleet else timedelta(seconds=scan_interval),
+        )
+        self.scheduler = PollScheduler(self._method_intervals(scan_interval))
+        self._set_interval(self.scheduler.interval or scan_interval)
+        self._ttl_overrides = ttls or {}
+        self.ttls = self._default_ttls(scan_interval)
+
+    def _default_ttls(self, scan_interval):
+        # All of the device's methods, not only those polled now, or a method
+        # whose first listener is added later starts out stale
+        ttls = {
+            method: STALE_INTERVALS
+            * max(scan_interval, METHOD_MIN_INTERVALS.get(method, 0))
+            for method in self.device._methods
+        }
+        ttls.update(self._ttl_overrides)
+        return ttls
+
+    @callback
+    def reconfigure(self, scan_interval):
+        """Apply a new scan interval and the device's methods to the poller.
+
+        Call it after MarstekDevice.reconfigure. Cached values, learned
+        capabilities and the breaker are kept. The running timer keeps the
+        old interval until async_start polls with the new plan.
+        """
+        scan_interval = scan_interval or DEFAULT_SCAN_INTERVAL
+        methods = self.device._methods
+        if self._probe_method not in methods:
+            self._probe_method = methods[0] if methods else None
+        self.burst.set_idle_interval(scan_interval)
+        self.ttls = self._default_ttls(scan_interval)
+        self._replan()
+
+    @callback
+    def async_add_listener(self, update_callback, context=None):
+        """Listen for data updates and poll context's method while listening."""
+        remove = super().async_add_listener(update_callback, context)
+        method_listeners = self._method_listeners.setdefault(context, [])
+        method_listeners.append(update_callback)
+        self._replan()
+
+        @callback
+        def remove_listener():
+            remove()
+            method_listeners.remove(update_callback)
+            if not method_listeners:
+                self._method_listeners.pop(context, None)
+            self._replan()
+
+        return remove_listener
+
+    async def async_start(self):
+        """Start polling, in a fleet on the device's phase of the interval grid.
+
+        Outside a fleet this is the first refresh, which starts the timer of
+        the coordinator. In a fleet every tick is armed on the grid instead
+        of after the previous cycle, so differing cycle times, bursts and
+        probes do not move the devices of a hub together.
+        """
+        if self.fleet is None:
+            await self.async_refresh()
+            return
+        self._async_schedule_tick()
+
+    @callback
+    def _async_schedule_tick(self):
+        """Arm the next tick of a fleet device on its phase."""
+        if self._unsub_tick is not None:
+            self._unsub_tick()
+            self._unsub_tick = None
+        if self._shut_down:
+            return
+        loop = self.hass.loop
+        next_tick = self.fleet.next_tick(
+            self._fleet_index, self.poll_interval.total_seconds(), loop.time()
+        )
+        self._unsub_tick = loop.call_at(next_tick, self._async_tick).cancel
+
+    @callback
+    def _async_tick(self):
+        self._unsub_tick = None
+        # Armed before the cycle runs, a slow cycle skips ticks, see
+        # _async_update_data, but never shifts them
+        self._async_schedule_tick()
+        self.hass.async_create_task(self.async_refresh())
+
+    def _set_interval(self, seconds):
+        """Tick every seconds, on the coordinator's timer outside a fleet."""
+        self.poll_interval = timedelta(seconds=seconds)
+        if self.fleet is None:
+            self.update_interval = self.poll_interval
+
+    def is_stale(self, method, now=None):
+        """Return whether method has no values younger than its TTL."""
+        updated_at = self.snapshot.updated_at.get(method)
+        if updated_at is None:
+            return True
+        now = time.time() if now is None else now
+        ttl = self.ttls.get(method, 0)
+        if self._restored:
+            ttl = max(ttl, RESTORE_MAX_AGE)
+        return now - updated_at > ttl
+
+    @callback
+    def async_entities_added(self):
+        """Poll only the methods of listening entities from now on."""
+        self._entities_added = True
+        self._replan()
+
+    def _wanted_methods(self):
+        """Return the methods some entity listens to, all before entities exist."""
+        if not self._entities_added:
+            return set(self.device._methods)
+        return set(self.async_contexts())
+
+    def _method_intervals(self, rate):
+        wanted = self._wanted_methods()
+        return {
+            method: max(rate, METHOD_MIN_INTERVALS.get(method, 0))
+            for method in self.device._methods
+            if method in wanted and method not in self.capabilities.unsupported
+        }
+
+    def _replan(self):
+        """Rebuild the poll plan for the current rate and supported methods."""
+        self.scheduler.set_intervals(self._method_intervals(self.burst.interval))
+        self._set_interval(self.scheduler.interval or self.burst.interval)
+
+    async def async_restore(self):
+        """Load the values stored by the previous run into the device."""
+        if self._store is None:
+            return
+        stored = await self._store.async_load()
+        if not stored:
+            return
+        self.device.restore(stored.get("data", {}), stored.get("updated_at", {}))
+        self.snapshot = self.device.snapshot
+        self.data = self.snapshot.data
+        self._restored = True
+        _LOGGER.debug(
+            "MarstekCoordinator: Restored %s for %s",
+            sorted(self.data),
+            self.device._device_name,
+        )
+
+    async def async_shutdown(self):
+        """Stop polling and write the latest values, replacing a pending write."""
+        await super().async_shutdown()
+        self._shut_down = True
+        if self._unsub_tick is not None:
+            self._unsub_tick()
+            self._unsub_tick = None
+        if self._store is None:
+            return
+        await self._store.async_save(self._stored_data())
+
+    def _async_schedule_save(self):
+        """Write the latest values to the store, unless a write is pending."""
+        if self._store is None or self._save_pending:
+            return
+        self._save_pending = True
+        self._store.async_delay_save(self._stored_data, STORE_DELAY)
+
+    @callback
+    def _stored_data(self):
+        self._save_pending = False
+        snapshot = self.device.snapshot
+        return {
+            "data": {
+                method: dict(values)
+                for method, values in snapshot.data.items()
+                if values
+            },
+            "updated_at": dict(snapshot.updated_at),
+        }
+
+    async def _async_update_data(self):
+        """Run a poll cycle and keep the results for the next start.
+
+        A cycle may take CYCLE_BUDGET of the interval. A tick that comes while
+        the previous cycle still runs is skipped instead of queued behind it.
+        """
+        if self._polling:
+            self.skipped_ticks += 1
+            _LOGGER.debug(
+                "MarstekCoordinator: Previous cycle of %s still running, skipping tick",
+                self.device._device_name,
+            )
+            self.changed_methods = set()
+            return self.data
+
+        self._polling = True
+        self.device.budget = CYCLE_BUDGET * self.poll_interval.total_seconds()
+        try:
+            data = await self._async_poll()
+        finally:
+            self._polling = False
+            self._restored = False
+        self._async_schedule_save()
+        return data
+
+    async def _async_poll(self):
+        """Run a poll cycle for the due methods and return all results."""
+        now = self.hass.loop.time()
+        self.changed_methods = set()
+        if self.breaker.is_open:
+            return await self._async_probe(now)
+
+        previous = self.data or {}
+        wanted = self._wanted_methods()
+        methods = self.scheduler.due(now) + [
+            method for method in self.capabilities.reprobe_due(now) if method in wanted
+        ]
+        if methods:
+            answered = await self.device.async_update(methods)
+            errors = self.device.last_errors
+            rejected = {m for m, code in errors.items() if code == METHOD_NOT_FOUND}
+            horizon = self.scheduler.longest_interval or self.burst.interval
+            if self.capabilities.update(
+                methods,
+                answered,
+                rejected,
+                now,
+                horizon,
+                errored=set(errors) - rejected,
+            ):
+                _LOGGER.info(
+                    "MarstekCoordinator: %s does not support %s",
+                    self.device._device_name,
+                    sorted(self.capabilities.unsupported) or "nothing",
+                )
+                self._replan()
+            # Unanswered methods stay due and are retried on the next tick
+            self.scheduler.mark_polled(answered, now)
+            self._record_cycle(methods, answered, now)
+
+        data = self._snapshot()
+        rate = self.burst.interval
+        if self.burst.update(previous, data, now) != rate:
+            _LOGGER.debug(
+                "MarstekCoordinator: Poll rate for %s changed to %s s",
+                self.device._device_name,
+                self.burst.interval,
+            )
+            self._replan()
+        return data
+
+    def _record_cycle(self, methods, answered, now):
+        # An error reply is a rejected request, not a lost one, so the device
+        # is alive even when nothing was answered with values
+        if answered or self.device.last_errors:
+            self._probe_method = next(
+                (m for m in methods if m in answered), self._probe_method
+            )
+            self.breaker.record_success()
+            return
+        if (
+            not self.breaker.is_open
+            and self.capabilities.answered_at is not None
+            and not self.capabilities.has_answered(methods)
+        ):
+            # Only methods that never answered were requested, likely ones
+            # the device does not support, which says nothing about the link
+            return
+        self.breaker.record_failure(now)
+        if self.breaker.is_open:
+            raise UpdateFailed(
+                f"{self.device._device_name} stopped responding, "
+                f"probing again in {self.breaker.retry_at - now:.0f} s"
+            )
+
+    async def _async_probe(self, now):
+        """Send a single request to a device whose breaker is open."""
+        if not self.breaker.allow(now):
+            raise UpdateFailed(f"{self.device._device_name} is not responding")
+
+        answered = await self.device.async_update([self._probe_method])
+        self.scheduler.mark_polled(answered, now)
+        self._record_cycle([self._probe_method], answered, now)
+        _LOGGER.info(
+            "MarstekCoordinator: %s is responding again", self.device._device_name
+        )
+        return self._snapshot()
+
+    @callback
+    def _async_method_received(self, method):
+        """Push a method's new values to its entities before the cycle ends."""
+        if not self.last_update_success or self.breaker.is_open:
+            # Availability changes with the cycle result, let that update all
+            return
+        old = (self.data or {}).get(method)
+        self.snapshot = self.device.snapshot
+        self.data = self.snapshot.data
+        if self.data.get(method) == old:
+            return
+        self.changed_methods = {method}
+        for update_callback in list(self._method_listeners.get(method, ())):
+            update_callback()
+
+    def _snapshot(self):
+        """Take the device snapshot and note which methods changed since last time."""
+        self.snapshot = self.device.snapshot
+        data = self.snapshot.data
+        old = self.data or {}
+        self.changed_methods = {
+            method for method, values in data.items() if old.get(method) != values
+        }
+        return data
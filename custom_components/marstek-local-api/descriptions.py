@@ -0,0 +1,256 @@
+"""Sensor descriptions for every value the Marstek local API reports."""
+from collections.abc import Callable
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+
+
+@dataclass(frozen=True, kw_only=True, slots=True)
+class MarstekSensorEntityDescription(SensorEntityDescription):
+    """Describes a sensor reading key from the reply to method.
+
+    transform converts the raw value. deadband is an (absolute, relative)
+    pair: a new value within max(absolute, relative * previous) of the
+    current state is not written.
+    """
+
+    method: str
+    transform: Callable[[Any], Any] | None = None
+    deadband: tuple[float, float] | None = None
+
+
+def _to_bool(value):
+    return bool(value) if value is not None else False
+
+
+def _to_float(value):
+    return float(value)
+
+
+_POWER = {
+    "native_unit_of_measurement": "W",
+    "device_class": SensorDeviceClass.POWER,
+    "state_class": SensorStateClass.MEASUREMENT,
+}
+_ENERGY = {
+    "native_unit_of_measurement": "Wh",
+    "device_class": SensorDeviceClass.ENERGY,
+    "state_class": SensorStateClass.TOTAL_INCREASING,
+}
+_STORED_ENERGY = {
+    "native_unit_of_measurement": "Wh",
+    "device_class": SensorDeviceClass.ENERGY_STORAGE,
+    "state_class": SensorStateClass.MEASUREMENT,
+}
+_BATTERY = {
+    "native_unit_of_measurement": "%",
+    "device_class": SensorDeviceClass.BATTERY,
+    "state_class": SensorStateClass.MEASUREMENT,
+}
+
+SENSOR_DESCRIPTIONS = (
+    # Wifi
+    MarstekSensorEntityDescription(
+        method="Wifi.GetStatus", key="ssid", name="WiFi SSID"
+    ),
+    MarstekSensorEntityDescription(
+        method="Wifi.GetStatus",
+        key="rssi",
+        name="WiFi RSSI",
+        native_unit_of_measurement="dBm",
+        device_class=SensorDeviceClass.SIGNAL_STRENGTH,
+        state_class=SensorStateClass.MEASUREMENT,
+        deadband=(2, 0),
+    ),
+    MarstekSensorEntityDescription(
+        method="Wifi.GetStatus", key="sta_ip", name="WiFi IP"
+    ),
+    MarstekSensorEntityDescription(
+        method="Wifi.GetStatus", key="sta_gate", name="WiFi Gateway"
+    ),
+    MarstekSensorEntityDescription(
+        method="Wifi.GetStatus", key="sta_mask", name="WiFi Subnet"
+    ),
+    MarstekSensorEntityDescription(
+        method="Wifi.GetStatus", key="sta_dns", name="WiFi DNS"
+    ),
+    # Battery
+    MarstekSensorEntityDescription(
+        method="Bat.GetStatus", key="soc", name="Battery SOC", **_BATTERY
+    ),
+    # API docs show temp is already in °C
+    MarstekSensorEntityDescription(
+        method="Bat.GetStatus",
+        key="bat_temp",
+        name="Battery Temp",
+        native_unit_of_measurement="°C",
+        device_class=SensorDeviceClass.TEMPERATURE,
+        state_class=SensorStateClass.MEASUREMENT,
+    ),
+    # API docs show capacity is already in Wh
+    MarstekSensorEntityDescription(
+        method="Bat.GetStatus",
+        key="bat_capacity",
+        name="Battery Capacity",
+        **_STORED_ENERGY,
+    ),
+    MarstekSensorEntityDescription(
+        method="Bat.GetStatus",
+        key="rated_capacity",
+        name="Battery Rated Capacity",
+        **_STORED_ENERGY,
+    ),
+    MarstekSensorEntityDescription(
+        method="Bat.GetStatus",
+        key="charg_flag",
+        name="Battery Charging Flag",
+        transform=_to_bool,
+    ),
+    MarstekSensorEntityDescription(
+        method="Bat.GetStatus",
+        key="dischrg_flag",
+        name="Battery Discharging Flag",
+        transform=_to_bool,
+    ),
+    # PV
+    MarstekSensorEntityDescription(
+        method="PV.GetStatus",
+        key="pv_power",
+        name="PV Power",
+        deadband=(5, 0),
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="PV.GetStatus",
+        key="pv_voltage",
+        name="PV Voltage",
+        native_unit_of_measurement="V",
+        device_class=SensorDeviceClass.VOLTAGE,
+        state_class=SensorStateClass.MEASUREMENT,
+        deadband=(0, 0.01),
+    ),
+    MarstekSensorEntityDescription(
+        method="PV.GetStatus",
+        key="pv_current",
+        name="PV Current",
+        native_unit_of_measurement="A",
+        device_class=SensorDeviceClass.CURRENT,
+        state_class=SensorStateClass.MEASUREMENT,
+        deadband=(0, 0.01),
+    ),
+    # ES
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus", key="bat_soc", name="ES Battery SOC", **_BATTERY
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="bat_cap",
+        name="ES Battery Capacity",
+        **_STORED_ENERGY,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="pv_power",
+        name="ES PV Power",
+        deadband=(5, 0),
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="ongrid_power",
+        name="ES On-Grid Power",
+        deadband=(5, 0),
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="offgrid_power",
+        name="ES Off-Grid Power",
+        deadband=(5, 0),
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="bat_power",
+        name="ES Battery Power",
+        deadband=(5, 0),
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="total_pv_energy",
+        name="ES Total PV Energy",
+        **_ENERGY,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="total_grid_output_energy",
+        name="ES Grid Output Energy",
+        **_ENERGY,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="total_grid_input_energy",
+        name="ES Grid Input Energy",
+        **_ENERGY,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetStatus",
+        key="total_load_energy",
+        name="ES Total Load Energy",
+        **_ENERGY,
+    ),
+    # BLE
+    MarstekSensorEntityDescription(
+        method="BLE.GetStatus", key="state", name="BLE State"
+    ),
+    MarstekSensorEntityDescription(
+        method="BLE.GetStatus", key="ble_mac", name="BLE MAC"
+    ),
+    # Charging Status
+    MarstekSensorEntityDescription(
+        method="ES.GetMode", key="mode", name="Charging mode"
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetMode",
+        key="ongrid_power",
+        name="Ongrid power",
+        transform=_to_float,
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetMode",
+        key="offgrid_power",
+        name="Offgrid power (backup power)",
+        transform=_to_float,
+        **_POWER,
+    ),
+    MarstekSensorEntityDescription(
+        method="ES.GetMode", key="bat_soc", name="Battery %", **_BATTERY
+    ),
+)
+
+
+def _by_method():
+    index = {}
+    for description in SENSOR_DESCRIPTIONS:
+        index.setdefault(description.method, []).append(description)
+    return MappingProxyType({method: tuple(d) for method, d in index.items()})
+
+
+# Descriptions per method, in table order
+SENSORS_BY_METHOD = _by_method()
+
+# Reply keys read per method
+METHOD_KEYS = MappingProxyType(
+    {
+        method: frozenset(d.key for d in descriptions)
+        for method, descriptions in SENSORS_BY_METHOD.items()
+    }
+)
@@ -0,0 +1,31 @@
+"""Diagnostics support for Marstek Local API."""
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.const import CONF_HOST
+
+from .const import CONF_HOSTS, DOMAIN
+
+TO_REDACT = {CONF_HOST, CONF_HOSTS}
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return diagnostics for a config entry, per device for a hub."""
+    coordinators = hass.data[DOMAIN][entry.entry_id]["coordinators"]
+    result = {"entry": async_redact_data(dict(entry.data), TO_REDACT)}
+    if len(coordinators) == 1:
+        result.update(_coordinator_diagnostics(coordinators[0]))
+    else:
+        result["devices"] = [
+            _coordinator_diagnostics(coordinator) for coordinator in coordinators
+        ]
+    return result
+
+
+def _coordinator_diagnostics(coordinator):
+    return {
+        "update_interval": coordinator.poll_interval.total_seconds(),
+        "breaker": coordinator.breaker.as_dict(),
+        "skipped_ticks": coordinator.skipped_ticks,
+        "polled_methods": sorted(coordinator.scheduler._intervals),
+        "unsupported_methods": sorted(coordinator.capabilities.unsupported),
+        "device": coordinator.device.diagnostics(),
+    }
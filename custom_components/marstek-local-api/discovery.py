@@ -0,0 +1,92 @@
+"""Finding Marstek devices on the local network."""
+import asyncio
+import ipaddress
+import logging
+from dataclasses import dataclass
+
+from homeassistant.components.network import async_get_adapters
+
+from .api import acquire_socket, release_socket
+from .const import (
+    DISCOVERY_CONCURRENCY,
+    DISCOVERY_METHOD,
+    DISCOVERY_MIN_PREFIX,
+    DISCOVERY_TIMEOUT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class DiscoveredDevice:
+    """A device that answered the discovery request after rtt seconds."""
+
+    host: str
+    rtt: float
+    model: str | None = None
+    mac: str | None = None
+
+
+async def async_get_subnet_hosts(hass):
+    """Return the other addresses of the enabled IPv4 adapters' subnets."""
+    hosts = {}
+    for adapter in await async_get_adapters(hass):
+        if not adapter["enabled"]:
+            continue
+        for address in adapter["ipv4"]:
+            prefix = max(address["network_prefix"], DISCOVERY_MIN_PREFIX)
+            network = ipaddress.ip_network(
+                f"{address['address']}/{prefix}", strict=False
+            )
+            for host in network.hosts():
+                if str(host) != address["address"]:
+                    hosts[str(host)] = None
+    return list(hosts)
+
+
+async def async_discover(hass, port, hosts):
+    """Ask every host for its device info and return those that answered.
+
+    Requests go through the shared socket of port, DISCOVERY_CONCURRENCY at
+    a time. Any reply counts, firmware without the discovery method answers
+    with an error and is found without model or MAC.
+    """
+    udp_socket = acquire_socket(hass, port)
+    slots = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+
+    async def _async_probe(host):
+        async with slots:
+            sent_at = loop.time()
+            try:
+                reply = await udp_socket.request(
+                    (host, port), DISCOVERY_METHOD, DISCOVERY_TIMEOUT
+                )
+            except (asyncio.TimeoutError, OSError):
+                return None
+            rtt = loop.time() - sent_at
+        result = reply.get("result")
+        if not isinstance(result, dict):
+            result = {}
+        return DiscoveredDevice(
+            host,
+            rtt,
+            result.get("device"),
+            result.get("ble_mac") or result.get("wifi_mac"),
+        )
+
+    try:
+        await udp_socket.async_open()
+        found = await asyncio.gather(*(_async_probe(host) for host in hosts))
+    except OSError as e:
+        _LOGGER.error("MarstekDiscovery: Socket setup failed: %s", e)
+        return []
+    finally:
+        release_socket(hass, port)
+
+    devices = sorted(
+        (device for device in found if device is not None),
+        key=lambda device: ipaddress.ip_address(device.host),
+    )
+    _LOGGER.debug("MarstekDiscovery: %s of %s hosts answered", len(devices), len(hosts))
+    return devices
@@ -0,0 +1,94 @@
+"""Connection probe recommending poll settings for a device."""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+from .api import MarstekDevice, acquire_socket, release_socket
+from .const import (
+    CYCLE_BUDGET,
+    OPTIONS,
+    PROBE_INTERVALS,
+    PROBE_LOSS_STEP,
+    PROBE_MIN_RELIABILITY,
+    PROBE_ROUNDS,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class ProbeResult:
+    """What a burst of requests to a device showed.
+
+    reliability maps each method to the share of rounds it was answered in,
+    loss is the share of requests that got no reply at all, counting only
+    methods that replied at least once, and cycle_time the duration of the
+    slowest round in seconds.
+    """
+
+    reliability: dict = field(default_factory=dict)
+    loss: float = 1.0
+    cycle_time: float = 0.0
+    rtt: float | None = None
+
+    @property
+    def methods(self):
+        """Return the methods the device answered reliably."""
+        return [
+            method
+            for method, share in self.reliability.items()
+            if share >= PROBE_MIN_RELIABILITY
+        ]
+
+    @property
+    def scan_interval(self):
+        """Return the shortest interval the device keeps up with."""
+        needed = self.cycle_time / CYCLE_BUDGET
+        index = next(
+            (i for i, interval in enumerate(PROBE_INTERVALS) if interval >= needed),
+            len(PROBE_INTERVALS) - 1,
+        )
+        index += int(self.loss / PROBE_LOSS_STEP)
+        return PROBE_INTERVALS[min(index, len(PROBE_INTERVALS) - 1)]
+
+
+async def async_probe(hass, host, port, methods=None, rounds=PROBE_ROUNDS):
+    """Request all methods rounds times from host and return a ProbeResult."""
+    methods = list(methods or OPTIONS)
+    device = MarstekDevice(host, port, methods, udp_socket=acquire_socket(hass, port))
+    loop = asyncio.get_running_loop()
+    answered = dict.fromkeys(methods, 0)
+    silent = dict.fromkeys(methods, 0)
+    cycle_time = 0.0
+    try:
+        for _ in range(rounds):
+            started = loop.time()
+            replied = await device.async_update()
+            cycle_time = max(cycle_time, loop.time() - started)
+            for method in replied:
+                answered[method] += 1
+            # Error replies are answers too, only silence is loss
+            for method in methods:
+                if method not in replied and method not in device.last_errors:
+                    silent[method] += 1
+    finally:
+        release_socket(hass, port)
+
+    # A method that never replied is likely unsupported, not lost on the link
+    heard = [method for method in methods if silent[method] < rounds]
+    result = ProbeResult(
+        {method: count / rounds for method, count in answered.items()},
+        sum(silent[method] for method in heard) / (rounds * len(heard))
+        if heard
+        else 1.0,
+        cycle_time,
+        device.rtt.srtt,
+    )
+    _LOGGER.debug(
+        "MarstekProbe: %s answered %s, loss %.0f%%, slowest round %.2f s",
+        host,
+        result.methods,
+        result.loss * 100,
+        result.cycle_time,
+    )
+    return result
@@ -0,0 +1,274 @@
+"""Poll planning for the Marstek coordinator."""
+import asyncio
+import math
+import random
+
+from .const import (
+    BREAKER_BASE_DELAY,
+    BREAKER_MAX_DELAY,
+    BREAKER_THRESHOLD,
+    BURST_FLAG_KEYS,
+    BURST_HOLD,
+    BURST_INTERVAL,
+    BURST_POWER_KEYS,
+    BURST_POWER_THRESHOLD,
+    CAPABILITY_REPROBE,
+    FLEET_MAX_IN_FLIGHT,
+    UNSUPPORTED_MISSES,
+)
+
+
+class PollScheduler:
+    """Tracks when each method is due and groups due methods into one cycle.
+
+    The coordinator ticks at the shortest method interval. A method that
+    falls due within half a tick is pulled into the current cycle, so methods
+    with related intervals keep sharing cycles instead of drifting apart.
+    """
+
+    def __init__(self, intervals):
+        self._intervals = dict(intervals)
+        self._next_due = dict.fromkeys(self._intervals, 0.0)
+        self._last_polled = {}
+
+    @property
+    def interval(self):
+        """Seconds between coordinator ticks, None without methods."""
+        return min(self._intervals.values(), default=None)
+
+    @property
+    def longest_interval(self):
+        """Seconds between requests of the slowest method, None without methods."""
+        return max(self._intervals.values(), default=None)
+
+    def due(self, now):
+        """Return the methods to request in the cycle starting at now."""
+        if not self._intervals:
+            return []
+        horizon = now + self.interval / 2
+        return [m for m, due_at in self._next_due.items() if due_at <= horizon]
+
+    def mark_polled(self, methods, now):
+        """Schedule the next request of methods that were answered at now."""
+        for method in methods:
+            if method in self._intervals:
+                self._last_polled[method] = now
+                self._next_due[method] = now + self._intervals[method]
+
+    def set_intervals(self, intervals):
+        """Replace the planned methods and their intervals.
+
+        Intervals count from each method's last poll, methods that were
+        never answered are due right away.
+        """
+        self._intervals = dict(intervals)
+        self._next_due = {
+            method: self._last_polled[method] + interval
+            if method in self._last_polled
+            else 0.0
+            for method, interval in self._intervals.items()
+        }
+
+
+class CapabilityTracker:
+    """Learns which methods a device does not support.
+
+    A method is unsupported once the device rejects it as unknown, or leaves
+    it unanswered for misses cycles in a row while the device itself is
+    responsive. Unsupported methods are left out of the poll plan and probed
+    again every reprobe seconds, in case a firmware update added them.
+    """
+
+    def __init__(self, misses=UNSUPPORTED_MISSES, reprobe=CAPABILITY_REPROBE):
+        self._max_misses = misses
+        self._reprobe = reprobe
+        self._misses = {}
+        # Methods the device answered at least once, and when it last replied
+        self._answered = set()
+        self.answered_at = None
+        # Unsupported methods and when they were last requested
+        self.unsupported = {}
+
+    def has_answered(self, methods):
+        """Return whether the device ever answered one of methods."""
+        return not self._answered.isdisjoint(methods)
+
+    def update(self, requested, answered, rejected, now, horizon=math.inf, errored=()):
+        """Learn from a cycle, returning whether the supported methods changed.
+
+        errored holds the methods answered with another JSON-RPC error than
+        rejected ones get. The device knows those, so they count as answered.
+
+        The device is responsive when it replied in this cycle, or replied
+        within the last horizon seconds and the cycle only requested methods
+        that never answered. A method it answered before going silent as well
+        means the device is, and then silence says nothing about single
+        methods.
+        """
+        answered = set(answered).union(errored)
+        if answered or rejected:
+            self.answered_at = now
+            self._answered.update(answered)
+        responsive = bool(answered or rejected) or (
+            self.answered_at is not None
+            and now - self.answered_at <= horizon
+            and not self.has_answered(requested)
+        )
+        changed = False
+        for method in requested:
+            if method in answered:
+                self._misses.pop(method, None)
+                changed |= self.unsupported.pop(method, None) is not None
+                continue
+            if method in self.unsupported:
+                # Reprobed without an answer, the next probe counts from now
+                self.unsupported[method] = now
+                continue
+            if method not in rejected:
+                if not responsive:
+                    continue
+                misses = self._misses[method] = self._misses.get(method, 0) + 1
+                if misses < self._max_misses:
+                    continue
+            self.unsupported[method] = now
+            changed = True
+        return changed
+
+    def reprobe_due(self, now):
+        """Return the unsupported methods to try again in the cycle at now."""
+        return [
+            method
+            for method, probed_at in self.unsupported.items()
+            if now >= probed_at + self._reprobe
+        ]
+
+
+class BurstController:
+    """Picks the poll rate for the power methods from recent battery activity.
+
+    A flipped charge or discharge flag, or a power reading moving more than
+    the threshold, switches to the burst interval. Once readings stayed calm
+    for the hold time the interval doubles every cycle until it is back at
+    the idle rate.
+    """
+
+    def __init__(
+        self,
+        idle_interval,
+        burst_interval=BURST_INTERVAL,
+        hold=BURST_HOLD,
+        threshold=BURST_POWER_THRESHOLD,
+    ):
+        self._max_burst_interval = burst_interval
+        self._hold = hold
+        self._threshold = threshold
+        self._last_activity = None
+        self.set_idle_interval(idle_interval)
+
+    def set_idle_interval(self, idle_interval):
+        """Change the idle rate, ending a burst in progress."""
+        self.idle_interval = idle_interval
+        self.interval = idle_interval
+        self._burst_interval = min(self._max_burst_interval, idle_interval)
+
+    @property
+    def active(self):
+        return self.interval < self.idle_interval
+
+    def update(self, old, new, now):
+        """Compare two consecutive data sets and return the interval to use."""
+        if self._changed(old, new):
+            self._last_activity = now
+            self.interval = self._burst_interval
+        elif self.active and now - self._last_activity >= self._hold:
+            self.interval = min(self.idle_interval, self.interval * 2)
+        return self.interval
+
+    def _changed(self, old, new):
+        for method, keys in BURST_FLAG_KEYS.items():
+            before, after = old.get(method) or {}, new.get(method) or {}
+            for key in keys:
+                if key in before and key in after and before[key] != after[key]:
+                    return True
+
+        for method, keys in BURST_POWER_KEYS.items():
+            before, after = old.get(method) or {}, new.get(method) or {}
+            for key in keys:
+                try:
+                    delta = abs(float(after[key]) - float(before[key]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if delta > self._threshold:
+                    return True
+        return False
+
+
+class CircuitBreaker:
+    """Stops polling a device that keeps failing and probes it with backoff.
+
+    After threshold consecutive failed cycles the breaker opens. While open,
+    allow() only returns True once the retry delay has passed. That delay
+    doubles with every failed probe, with random jitter so devices that went
+    down together are not probed in lockstep. The first success closes it.
+    """
+
+    def __init__(
+        self,
+        threshold=BREAKER_THRESHOLD,
+        base_delay=BREAKER_BASE_DELAY,
+        max_delay=BREAKER_MAX_DELAY,
+    ):
+        self._threshold = threshold
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._delay = base_delay
+        self.failures = 0
+        self.is_open = False
+        self.retry_at = None
+
+    def allow(self, now):
+        """Return whether a request may be sent at now."""
+        return not self.is_open or now >= self.retry_at
+
+    def record_success(self):
+        self.failures = 0
+        self.is_open = False
+        self.retry_at = None
+        self._delay = self._base_delay
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.failures < self._threshold:
+            return
+        self.is_open = True
+        self.retry_at = now + random.uniform(self._delay / 2, self._delay)
+        self._delay = min(self._max_delay, self._delay * 2)
+
+    def as_dict(self):
+        return {
+            "open": self.is_open,
+            "failures": self.failures,
+            "retry_at": self.retry_at,
+        }
+
+
+class FleetScheduler:
+    """Spreads the polls of the devices of a hub evenly over their interval.
+
+    Device index of size devices ticks index / size of its interval after
+    the shared grid of that interval, so devices with the same interval never
+    poll together. limiter bounds the requests outstanding over all devices.
+    """
+
+    def __init__(self, size, max_in_flight=FLEET_MAX_IN_FLIGHT):
+        self.size = max(1, size)
+        self.limiter = asyncio.Semaphore(max_in_flight)
+
+    def phase(self, index, interval):
+        """Return the offset of device index within interval."""
+        return interval * (index % self.size) / self.size
+
+    def next_tick(self, index, interval, now):
+        """Return the first time after now at which device index ticks."""
+        phase = self.phase(index, interval)
+        return (math.floor((now - phase) / interval) + 1) * interval + phase
@@ -1,112 +1,69 @@
-import json
 import logging
-import socket
-import time
-from datetime import timedelta
 
 from homeassistant.components.sensor import SensorEntity
-from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SCAN_INTERVAL
+from homeassistant.core import callback
+from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import DeviceInfo
-from homeassistant.util import Throttle
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
 
-from .const import CONF_DEVICE_NAME, CONF_DOMAINS, DOMAIN, OPTIONS
+from .api import MarstekDevice
+from .const import DOMAIN, OPTIONS, SIGNAL_METHODS_CHANGED
+from .coordinator import MarstekCoordinator
+from .descriptions import SENSORS_BY_METHOD, MarstekSensorEntityDescription
 
 _LOGGER = logging.getLogger(__name__)
 
 
-class MarstekDevice:
-    """Manages UDP communication and caches results per method."""
+def _unique_id(device, method, key):
+    return f"marstek_local_{device._device_name.replace(' ', '_').lower()}_{method.lower()}_{key}"
 
-    def __init__(
-        self, host, port, methods, scan_interval, device_name="Marstek Battery"
-    ):
-        self._host = host
-        self._port = port
-        self._methods = methods
-        self._device_name = device_name
-        self._cache = {}
-        # Handle None scan_interval by using a default of 10 seconds
-        scan_interval = scan_interval or 30
-        self.update = Throttle(timedelta(seconds=scan_interval))(self.update)
-
-    def _send_request(self, sock, method):
-        """Send a single UDP request for a method."""
-        try:
-            _LOGGER.debug("MarstekDevice: Sending request for %s", method)
-            payload = {"id": method, "method": method, "params": {"id": 0}}
-            sock.sendto(
-                json.dumps(payload, separators=(",", ":")).encode("ascii"),
-                (self._host, self._port),
-            )
-            return self._receive_response(sock, method)
-        except Exception as e:
-            _LOGGER.error("MarstekDevice: Error sending request for %s: %s", method, e)
-            return False
 
-    def _receive_response(self, sock, method):
-        """Receive and process UDP response."""
-        try:
-            data, addr = sock.recvfrom(8192)
-            result = json.loads(data.decode())
-            _LOGGER.debug("MARSTEK RECEIVE RAW", result)
-            res_method = result.get("id")
-            res_values = result.get("result", {})
-            if res_method:
-                self._cache[res_method] = res_values
-                _LOGGER.debug(
-                    "MarstekDevice: Received data for %s: %s", res_method, res_values
-                )
-                return True
-        except socket.timeout:
-            _LOGGER.debug("MarstekDevice: No response yet for %s", method)
-        except Exception as e:
-            _LOGGER.error("MarstekDevice: Error receiving response for %s: %s", method, e)
+def _within_deadband(old, new, deadband):
+    """Return whether new is too close to old to be worth writing."""
+    if old == new:
+        return True
+    if deadband is None or new == 0:
         return False
+    if not all(isinstance(v, (int, float)) for v in (old, new)):
+        return False
+    absolute, relative = deadband
+    return abs(new - old) <= max(absolute, relative * abs(old))
 
-    def update(self):
-        _LOGGER.debug("MarstekDevice: Starting update cycle")
-        sock = None
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(2.0)
-            sock.bind(("0.0.0.0", self._port))
-
-            for method in self._methods:
-                self._send_request(sock, method)
-                time.sleep(0.5)
-
-            # Ensure all methods have at least empty cache
-            for method in self._methods:
-                if method not in self._cache:
-                    self._cache[method] = {}
-
-        except Exception as e:
-            _LOGGER.error("MarstekDevice: Socket setup failed: %s", e)
-        finally:
-            if sock:
-                try:
-                    sock.close()
-                except Exception:
-                    pass
 
-    def get_value(self, method, key):
-        return self._cache.get(method, {}).get(key)
+class MarstekBaseSensor(CoordinatorEntity, SensorEntity):
+    """Individual sensor reading its method's slice of the coordinator data.
 
+    State is only written when the value changed by more than the sensor's
+    deadband, or when availability changed. The sensor is unavailable while
+    its method's values are stale, and last_updated_at tells when the
+    reading in its state was received.
+    """
 
-class MarstekBaseSensor(SensorEntity):
-    """Individual sensor reading values from a shared MarstekDevice."""
+    entity_description: MarstekSensorEntityDescription
 
     def __init__(
-        self, device: MarstekDevice, method, key, name, unit=None, transform=None
+        self,
+        coordinator: MarstekCoordinator,
+        description: MarstekSensorEntityDescription,
     ):
+        method = description.method
+        key = description.key
+        super().__init__(coordinator, context=method)
+        device: MarstekDevice = coordinator.device
+        self.entity_description = description
         self._device = device
         self._method = method
         self._key = key
-        self._attr_name = f"{device._device_name} {name}"
-        self._attr_unique_id = f"marstek_local_{device._device_name.replace(' ', '_').lower()}_{method.lower()}_{key}"
-        self._unit = unit
+        self._attr_name = f"{device._device_name} {description.name}"
+        self._attr_unique_id = _unique_id(device, method, key)
         self._state = None
-        self._transform = transform
+        self._transform = description.transform
+        self._deadband = description.deadband
+        self._last_available = True
+        self._updated_at = None
 
         domain_name = method
         self._attr_device_info = DeviceInfo(
@@ -120,117 +77,98 @@ class MarstekBaseSensor(SensorEntity):
         return self._state
 
     @property
-    def native_unit_of_measurement(self):
-        return self._unit
-
-    def update(self):
-        self._device.update()
-        value = self._device.get_value(self._method, self._key)
-        if value is not None:
-            if self._transform:
-                try:
-                    value = self._transform(value)
-                except Exception as e:
-                    _LOGGER.error("Transform failed for %s: %s", self._attr_name, e)
-            self._state = value
-            _LOGGER.debug("Sensor %s updated to %s", self._attr_name, self._state)
-        else:
+    def available(self):
+        return super().available and not self.coordinator.is_stale(self._method)
+
+    @property
+    def extra_state_attributes(self):
+        if self._updated_at is None:
+            return None
+        return {"last_updated_at": dt_util.utc_from_timestamp(self._updated_at)}
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+        self._last_available = self.available
+        self._update_state()
+
+    @callback
+    def _handle_coordinator_update(self):
+        changed = (
+            self._method in self.coordinator.changed_methods and self._update_state()
+        )
+        available = self.available
+        if changed or available != self._last_available:
+            self._last_available = available
+            super()._handle_coordinator_update()
+
+    def _update_state(self):
+        """Read the new value, returning whether the state changed."""
+        values = (self.coordinator.data or {}).get(self._method, {})
+        value = values.get(self._key)
+        if value is None:
             _LOGGER.debug(
                 "Sensor %s has no new value, keeping previous state %s",
                 self._attr_name,
                 self._state,
             )
+            return False
 
-
-async def async_setup_entry(hass, entry, async_add_entities):
-    host = entry.data[CONF_HOST]
-    port = entry.data[CONF_PORT]
-    scan_interval = entry.data.get(CONF_SCAN_INTERVAL)
-    device_name = entry.data.get(CONF_DEVICE_NAME, "Marstek Battery")
-
-    chosen_domains = entry.data.get(CONF_DOMAINS, list(OPTIONS.keys()))
-    device = MarstekDevice(host, port, chosen_domains, scan_interval, device_name)
-
-    sensors_def = [
-        # Wifi
-        ("Wifi.GetStatus", "ssid", "WiFi SSID", None, None),
-        ("Wifi.GetStatus", "rssi", "WiFi RSSI", "dBm", None),
-        ("Wifi.GetStatus", "sta_ip", "WiFi IP", None, None),
-        ("Wifi.GetStatus", "sta_gate", "WiFi Gateway", None, None),
-        ("Wifi.GetStatus", "sta_mask", "WiFi Subnet", None, None),
-        ("Wifi.GetStatus", "sta_dns", "WiFi DNS", None, None),
-        # Battery
-        ("Bat.GetStatus", "soc", "Battery SOC", "%", None),
-        (
-            "Bat.GetStatus",
-            "bat_temp",
-            "Battery Temp",
-            "°C",
-            None,
-        ),  # API docs show temp is already in °C
-        (
-            "Bat.GetStatus",
-            "bat_capacity",
-            "Battery Capacity",
-            "Wh",
-            None,
-        ),  # API docs show capacity is already in Wh
-        ("Bat.GetStatus", "rated_capacity", "Battery Rated Capacity", "Wh", None),
-        (
-            "Bat.GetStatus",
-            "charg_flag",
-            "Battery Charging Flag",
-            None,
-            lambda v: bool(v) if v is not None else False,
-        ),
-        (
-            "Bat.GetStatus",
-            "dischrg_flag",
-            "Battery Discharging Flag",
-            None,
-            lambda v: bool(v) if v is not None else False,
-        ),
-        # PV
-        ("PV.GetStatus", "pv_power", "PV Power", "W", None),
-        ("PV.GetStatus", "pv_voltage", "PV Voltage", "V", None),
-        ("PV.GetStatus", "pv_current", "PV Current", "A", None),
-        # ES
-        ("ES.GetStatus", "bat_soc", "ES Battery SOC", "%", None),
-        ("ES.GetStatus", "bat_cap", "ES Battery Capacity", "Wh", None),
-        ("ES.GetStatus", "pv_power", "ES PV Power", "W", None),
-        ("ES.GetStatus", "ongrid_power", "ES On-Grid Power", "W", None),
-        ("ES.GetStatus", "offgrid_power", "ES Off-Grid Power", "W", None),
-        ("ES.GetStatus", "bat_power", "ES Battery Power", "W", None),
-        ("ES.GetStatus", "total_pv_energy", "ES Total PV Energy", "Wh", None),
-        (
-            "ES.GetStatus",
-            "total_grid_output_energy",
-            "ES Grid Output Energy",
-            "Wh",
-            None,
-        ),
-        ("ES.GetStatus", "total_grid_input_energy", "ES Grid Input Energy", "Wh", None),
-        ("ES.GetStatus", "total_load_energy", "ES Total Load Energy", "Wh", None),
-        # BLE
-        ("BLE.GetStatus", "state", "BLE State", None, None),
-        ("BLE.GetStatus", "ble_mac", "BLE MAC", None, None),
-        # Charging Status
-        ("ES.GetMode", "mode", "Charging mode", None, None),
-        ("ES.GetMode", "ongrid_power", "Ongrid power", "W", lambda v: float(v)),
-        (
-            "ES.GetMode",
-            "offgrid_power",
-            "Offgrid power (backup power)",
-            "W",
-            lambda v: float(v),
-        ),
-        ("ES.GetMode", "bat_soc", "Battery %", "%", None),
+        if self._transform:
+            try:
+                value = self._transform(value)
+            except Exception as e:
+                _LOGGER.error("Transform failed for %s: %s", self._attr_name, e)
+        if self._state is not None and _within_deadband(
+            self._state, value, self._deadband
+        ):
+            return False
+        self._state = value
+        self._updated_at = self.coordinator.snapshot.updated_at.get(self._method)
+        _LOGGER.debug("Sensor %s updated to %s", self._attr_name, self._state)
+        return True
+
+
+def _sensors(coordinators, methods):
+    return [
+        MarstekBaseSensor(coordinator, description)
+        for coordinator in coordinators
+        for method in methods
+        for description in SENSORS_BY_METHOD.get(method, ())
     ]
 
-    entities = [
-        MarstekBaseSensor(device, *params[:4], transform=params[4])
-        for params in sensors_def
-        if params[0] in chosen_domains
-    ]
 
-    async_add_entities(entities, True)
+async def async_setup_entry(hass, entry, async_add_entities):
+    entry_data = hass.data[DOMAIN][entry.entry_id]
+    coordinators = entry_data["coordinators"]
+
+    @callback
+    def _async_methods_changed(added, removed):
+        """Add the sensors of added methods and remove those of removed ones."""
+        entity_registry = er.async_get(hass)
+        device_registry = dr.async_get(hass)
+        for coordinator in coordinators:
+            device = coordinator.device
+            for method in removed:
+                for description in SENSORS_BY_METHOD.get(method, ()):
+                    entity_id = entity_registry.async_get_entity_id(
+                        "sensor", DOMAIN, _unique_id(device, method, description.key)
+                    )
+                    if entity_id is not None:
+                        entity_registry.async_remove(entity_id)
+                device_entry = device_registry.async_get_device(
+                    identifiers={(DOMAIN, f"{device._host}_{method}")}
+                )
+                if device_entry is not None:
+                    device_registry.async_update_device(
+                        device_entry.id, remove_config_entry_id=entry.entry_id
+                    )
+        async_add_entities(_sensors(coordinators, added))
+
+    entry.async_on_unload(
+        async_dispatcher_connect(
+            hass, SIGNAL_METHODS_CHANGED.format(entry.entry_id), _async_methods_changed
+        )
+    )
+    async_add_entities(_sensors(coordinators, entry_data["methods"]))
+    for coordinator in coordinators:
+        coordinator.async_entities_added()
@@ -3,7 +3,7 @@ import os
 import socket
 import sys
 from datetime import timedelta
-from unittest.mock import MagicMock, Mock, patch
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
 import pytest
 from homeassistant.config_entries import ConfigEntry
@@ -17,12 +17,14 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 # Import the Marstek Local API components
+from custom_components.marstek_local_api.api import CacheSnapshot
 from custom_components.marstek_local_api.const import (
     CONF_DEVICE_NAME,
     CONF_DOMAINS,
     DOMAIN,
     OPTIONS,
 )
+from custom_components.marstek_local_api.coordinator import MarstekCoordinator
 from custom_components.marstek_local_api.sensor import MarstekDevice
 
 
@@ -120,11 +122,24 @@ def mock_device(mock_device_data):
         return device._cache.get(method, {}).get(key)
     
     device.get_value = Mock(side_effect=mock_get_value)
-    device.update = Mock()
+    device.async_update = AsyncMock()
     
     return device
 
 
+@pytest.fixture
+def mock_coordinator(mock_device, mock_device_data):
+    """Mock MarstekCoordinator wrapping the mock device."""
+    coordinator = Mock(spec=MarstekCoordinator)
+    coordinator.device = mock_device
+    coordinator.data = mock_device_data.copy()
+    coordinator.last_update_success = True
+    coordinator.changed_methods = set(mock_device_data)
+    coordinator.is_stale.return_value = False
+    coordinator.snapshot = CacheSnapshot()
+    return coordinator
+
+
 @pytest.fixture
 def mock_json_response():
     """Mock JSON response from device."""
@@ -0,0 +1,75 @@
+"""Tests for the JSON-RPC wire codec."""
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api import codec
+
+
+def test_encode_request_discovery_params():
+    """Test the discovery method carries its own parameters."""
+    frame = codec.encode_request(7, "Marstek.GetDevice")
+
+    assert json.loads(frame) == {
+        "id": 7,
+        "method": "Marstek.GetDevice",
+        "params": {"ble_mac": "0"},
+    }
+
+
+def test_encode_request_matches_json():
+    """Test the pre-encoded frame equals a freshly dumped request."""
+    frame = codec.encode_request(42, "Bat.GetStatus")
+
+    assert json.loads(frame) == {
+        "id": 42,
+        "method": "Bat.GetStatus",
+        "params": {"id": 0},
+    }
+    assert frame == json.dumps(
+        {"id": 42, "method": "Bat.GetStatus", "params": {"id": 0}},
+        separators=(",", ":"),
+    ).encode("ascii")
+
+
+def test_encode_request_reuses_tail():
+    """Test the part after the id is encoded once per method."""
+    codec.encode_request(1, "ES.GetMode")
+    tail = codec._REQUEST_TAILS["ES.GetMode"]
+
+    assert codec.encode_request(2, "ES.GetMode").endswith(tail)
+    assert codec._REQUEST_TAILS["ES.GetMode"] is tail
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_decode_reply(use_orjson):
+    """Test replies decode from bytes with and without orjson."""
+    orjson = codec.orjson if use_orjson else None
+    with patch.object(codec, "orjson", orjson):
+        assert codec.decode_reply(b'{"id":1,"result":{"soc":85}}') == {
+            "id": 1,
+            "result": {"soc": 85},
+        }
+        with pytest.raises(ValueError):
+            codec.decode_reply(b"invalid json")
+        with pytest.raises(ValueError):
+            codec.decode_reply(b"\xff\xfe")
+
+
+def test_select_keys():
+    """Test only requested keys are kept."""
+    values = {"soc": 85, "bat_temp": 250, "unused": 1}
+
+    assert codec.select_keys(values, frozenset({"soc", "bat_temp", "missing"})) == {
+        "soc": 85,
+        "bat_temp": 250,
+    }
+    assert codec.select_keys(values, None) is values
@@ -1,11 +1,13 @@
 """Tests for MarstekConfigFlow."""
 import os
 import sys
+from unittest.mock import AsyncMock, patch
 
 import pytest
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SCAN_INTERVAL
+from homeassistant.data_entry_flow import AbortFlow
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 
 # Add the project root to Python path
@@ -13,18 +15,39 @@ project_root = os.path.dirname(os.path.dirname(__file__))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from custom_components.marstek_local_api.config_flow import MarstekConfigFlow
+from custom_components.marstek_local_api.config_flow import (
+    MarstekConfigFlow,
+    MarstekOptionsFlow,
+)
 from custom_components.marstek_local_api.const import (
     CONF_DEVICE_NAME,
     CONF_DOMAINS,
+    CONF_HOSTS,
+    CONF_TIMEOUT_MIN,
     DOMAIN,
     OPTIONS,
 )
+from custom_components.marstek_local_api.discovery import DiscoveredDevice
+from custom_components.marstek_local_api.probe import ProbeResult
 
 
 class TestMarstekConfigFlow:
     """Test MarstekConfigFlow."""
 
+    PROBE = ProbeResult({"Bat.GetStatus": 1.0}, 0.0, 0.5, 0.012)
+
+    async def _async_create(self, flow, user_input):
+        """Submit a single host, then accept the poll settings as offered."""
+        with patch(
+            "custom_components.marstek_local_api.config_flow.async_probe",
+            AsyncMock(return_value=self.PROBE),
+        ):
+            result = await flow.async_step_user(user_input)
+        assert result["step_id"] == "settings"
+        return await flow.async_step_settings(
+            {str(key): key.default() for key in result["data_schema"].schema}
+        )
+
     @pytest.mark.asyncio
     async def test_config_flow_init(self, hass):
         """Test config flow initialization."""
@@ -77,12 +100,98 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: ["Bat.GetStatus", "Wifi.GetStatus"],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["title"] == "Marstek Battery"
         assert result["data"] == user_input
 
+    @pytest.mark.asyncio
+    async def test_async_step_user_probes_host(self, hass):
+        """Test a typed-in host is probed to pre-fill its poll settings."""
+        flow = MarstekConfigFlow()
+        flow.hass = hass
+        probe = ProbeResult({"ES.GetStatus": 1.0}, 0.1, 4.5, 0.2)
+
+        with patch(
+            "custom_components.marstek_local_api.config_flow.async_probe",
+            AsyncMock(return_value=probe),
+        ) as mock_probe:
+            result = await flow.async_step_user(
+                {CONF_HOST: " 192.168.1.100 ", CONF_PORT: 31000}
+            )
+
+        mock_probe.assert_awaited_once_with(hass, "192.168.1.100", 31000)
+        assert result["type"] == "form"
+        assert result["step_id"] == "settings"
+        defaults = {str(key): key.default() for key in result["data_schema"].schema}
+        assert defaults == {CONF_SCAN_INTERVAL: 15, CONF_DOMAINS: ["ES.GetStatus"]}
+        assert result["description_placeholders"] == {"rtt": "200", "loss": "10"}
+
+    @pytest.mark.asyncio
+    async def test_async_step_user_keeps_entered_settings(self, hass):
+        """Test settings typed with the host are offered over the probe's."""
+        flow = MarstekConfigFlow()
+        flow.hass = hass
+
+        with patch(
+            "custom_components.marstek_local_api.config_flow.async_probe",
+            AsyncMock(return_value=self.PROBE),
+        ):
+            result = await flow.async_step_user(
+                {
+                    CONF_HOST: "192.168.1.100",
+                    CONF_PORT: 30000,
+                    CONF_SCAN_INTERVAL: 42,
+                    CONF_DOMAINS: ["ES.GetStatus"],
+                }
+            )
+
+        defaults = {str(key): key.default() for key in result["data_schema"].schema}
+        assert defaults == {CONF_SCAN_INTERVAL: 42, CONF_DOMAINS: ["ES.GetStatus"]}
+
+    @pytest.mark.asyncio
+    async def test_async_step_user_configured_host_aborts(self, hass):
+        """Test a typed-in host that already has an entry is not probed."""
+        MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.100", CONF_PORT: 30000},
+        ).add_to_hass(hass)
+        flow = MarstekConfigFlow()
+        flow.hass = hass
+        flow.handler = DOMAIN
+        flow.context = {"source": config_entries.SOURCE_USER}
+
+        with patch(
+            "custom_components.marstek_local_api.config_flow.async_probe"
+        ) as mock_probe, pytest.raises(AbortFlow) as aborted:
+            await flow.async_step_user({CONF_HOST: "192.168.1.100"})
+
+        assert aborted.value.reason == "already_configured"
+        mock_probe.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_async_step_user_create_hub(self, hass):
+        """Test several hosts create one hub entry."""
+        flow = MarstekConfigFlow()
+        flow.hass = hass
+
+        result = await flow.async_step_user(
+            {
+                CONF_HOST: "192.168.1.100, 192.168.1.101,192.168.1.102",
+                CONF_PORT: 30000,
+                CONF_DEVICE_NAME: "Marstek Battery",
+            }
+        )
+
+        assert result["type"] == "create_entry"
+        assert result["title"] == "Marstek Hub"
+        assert result["data"][CONF_HOSTS] == [
+            "192.168.1.100",
+            "192.168.1.101",
+            "192.168.1.102",
+        ]
+
     @pytest.mark.asyncio
     async def test_async_step_user_default_values(self, hass):
         """Test that form shows with correct default values."""
@@ -100,8 +209,9 @@ class TestMarstekConfigFlow:
         # Check that defaults were applied
         assert validated[CONF_PORT] == 30000
         assert validated[CONF_DEVICE_NAME] == "Marstek Battery"
-        assert validated[CONF_SCAN_INTERVAL] == 30
-        assert validated[CONF_DOMAINS] == list(OPTIONS.keys())
+        # Left to the probe, or to the hub's own defaults
+        assert CONF_SCAN_INTERVAL not in validated
+        assert CONF_DOMAINS not in validated
 
     @pytest.mark.asyncio
     async def test_async_step_user_minimal_input(self, hass):
@@ -114,7 +224,7 @@ class TestMarstekConfigFlow:
             # PORT, DEVICE_NAME, SCAN_INTERVAL, DOMAINS should use defaults
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_HOST] == "192.168.1.50"
@@ -133,7 +243,7 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: ["ES.GetStatus"],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_PORT] == 31000
@@ -156,7 +266,7 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: all_domains,
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_DOMAINS] == all_domains
@@ -176,14 +286,14 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: ["Bat.GetStatus"],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_DOMAINS] == ["Bat.GetStatus"]
 
     @pytest.mark.asyncio
     async def test_async_step_user_empty_domains(self, hass):
-        """Test config flow with empty domains list."""
+        """Test an empty domains list offers the methods the device answered."""
         flow = MarstekConfigFlow()
         flow.hass = hass
 
@@ -195,10 +305,10 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: [],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
-        assert result["data"][CONF_DOMAINS] == []
+        assert result["data"][CONF_DOMAINS] == ["Bat.GetStatus"]
 
     @pytest.mark.asyncio
     async def test_async_step_user_high_scan_interval(self, hass):
@@ -214,7 +324,7 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: ["Bat.GetStatus"],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_SCAN_INTERVAL] == 300
@@ -233,7 +343,7 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: ["Bat.GetStatus"],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_HOST] == "2001:db8::1"
@@ -252,7 +362,7 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: ["Bat.GetStatus"],
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
 
         assert result["type"] == "create_entry"
         assert result["data"][CONF_HOST] == "marstek-battery.local"
@@ -293,7 +403,7 @@ class TestMarstekConfigFlow:
             CONF_DOMAINS: expected_domains,
         }
 
-        result = await flow.async_step_user(user_input)
+        result = await self._async_create(flow, user_input)
         assert result["type"] == "create_entry"
 
     @pytest.mark.asyncio
@@ -323,4 +433,196 @@ class TestMarstekConfigFlow:
             assert isinstance(validated[CONF_SCAN_INTERVAL], int)
             assert isinstance(validated[CONF_DOMAINS], list)
         except vol.Invalid:
-            pytest.fail("Valid input should not raise validation error")
\ No newline at end of file
+            pytest.fail("Valid input should not raise validation error")
+
+
+class TestDiscovery:
+    """Test finding devices from the config flow."""
+
+    SETTINGS = {CONF_HOST: "", CONF_PORT: 30000, CONF_DEVICE_NAME: "Marstek Battery"}
+
+    def _flow(self, hass):
+        flow = MarstekConfigFlow()
+        flow.hass = hass
+        flow.handler = DOMAIN
+        flow.context = {"source": config_entries.SOURCE_USER}
+        return flow
+
+    def _patch_discovery(self, devices):
+        return patch(
+            "custom_components.marstek_local_api.config_flow.async_get_subnet_hosts",
+            AsyncMock(return_value=["192.168.1.100", "192.168.1.101"]),
+        ), patch(
+            "custom_components.marstek_local_api.config_flow.async_discover",
+            AsyncMock(return_value=devices),
+        )
+
+    @pytest.mark.asyncio
+    async def test_empty_host_lists_found_devices(self, hass):
+        """Test leaving the host empty offers the devices that answered."""
+        flow = self._flow(hass)
+        hosts, discover = self._patch_discovery(
+            [
+                DiscoveredDevice("192.168.1.100", 0.012, "VenusE", "aabbcc"),
+                DiscoveredDevice("192.168.1.101", 0.034),
+            ]
+        )
+
+        with hosts, discover as mock_discover:
+            result = await flow.async_step_user(self.SETTINGS)
+
+        mock_discover.assert_awaited_once_with(
+            hass, 30000, ["192.168.1.100", "192.168.1.101"]
+        )
+        assert result["type"] == "form"
+        assert result["step_id"] == "discover"
+        choices = result["data_schema"].schema[CONF_HOST].container
+        assert choices == {
+            "192.168.1.100": "192.168.1.100 (VenusE, 12 ms)",
+            "192.168.1.101": "192.168.1.101 (Marstek, 34 ms)",
+        }
+
+        probe = ProbeResult(
+            {"ES.GetStatus": 1.0, "PV.GetStatus": 0.0}, 0.0, 0.5, 0.012
+        )
+        with patch(
+            "custom_components.marstek_local_api.config_flow.async_probe",
+            AsyncMock(return_value=probe),
+        ) as mock_probe:
+            result = await flow.async_step_discover({CONF_HOST: "192.168.1.100"})
+
+        mock_probe.assert_awaited_once_with(hass, "192.168.1.100", 30000)
+        assert flow.unique_id == "aabbcc"
+        assert result["type"] == "form"
+        assert result["step_id"] == "settings"
+        defaults = {
+            str(key): key.default() for key in result["data_schema"].schema
+        }
+        assert defaults == {CONF_SCAN_INTERVAL: 5, CONF_DOMAINS: ["ES.GetStatus"]}
+        assert result["description_placeholders"] == {"rtt": "12", "loss": "0"}
+
+        result = await flow.async_step_settings(
+            {CONF_SCAN_INTERVAL: 10, CONF_DOMAINS: ["ES.GetStatus"]}
+        )
+
+        assert result["type"] == "create_entry"
+        assert result["data"][CONF_HOST] == "192.168.1.100"
+        assert result["data"][CONF_PORT] == 30000
+        assert result["data"][CONF_SCAN_INTERVAL] == 10
+        assert result["data"][CONF_DOMAINS] == ["ES.GetStatus"]
+
+    @pytest.mark.asyncio
+    async def test_silent_device_aborts(self, hass):
+        """Test a picked device that does not answer the probe is not added."""
+        flow = self._flow(hass)
+        flow._discovered = {"192.168.1.101": DiscoveredDevice("192.168.1.101", 0.03)}
+        flow._settings = {CONF_PORT: 30000}
+
+        with patch(
+            "custom_components.marstek_local_api.config_flow.async_probe",
+            AsyncMock(return_value=ProbeResult({"ES.GetStatus": 0.0})),
+        ):
+            result = await flow.async_step_discover({CONF_HOST: "192.168.1.101"})
+
+        assert result["type"] == "abort"
+        assert result["reason"] == "cannot_connect"
+
+    @pytest.mark.asyncio
+    async def test_configured_hosts_left_out(self, hass):
+        """Test devices at an address with an entry are not offered again."""
+        MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.101", CONF_PORT: 30000},
+        ).add_to_hass(hass)
+        flow = self._flow(hass)
+        hosts, discover = self._patch_discovery(
+            [DiscoveredDevice("192.168.1.101", 0.034)]
+        )
+
+        with hosts, discover:
+            result = await flow.async_step_user(self.SETTINGS)
+
+        assert result["type"] == "abort"
+        assert result["reason"] == "no_devices_found"
+
+    @pytest.mark.asyncio
+    async def test_moved_device_updates_its_entry(self, hass):
+        """Test picking a known device at a new address moves its entry."""
+        entry = MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.50", CONF_PORT: 30000},
+            unique_id="aabbcc",
+        )
+        entry.add_to_hass(hass)
+        flow = self._flow(hass)
+        hosts, discover = self._patch_discovery(
+            [DiscoveredDevice("192.168.1.100", 0.012, "VenusE", "aabbcc")]
+        )
+
+        with hosts, discover:
+            result = await flow.async_step_user(self.SETTINGS)
+
+        assert result["step_id"] == "discover"
+        with pytest.raises(AbortFlow) as aborted:
+            await flow.async_step_discover({CONF_HOST: "192.168.1.100"})
+
+        assert aborted.value.reason == "already_configured"
+        assert entry.data[CONF_HOST] == "192.168.1.100"
+
+    @pytest.mark.asyncio
+    async def test_device_without_mac_offered_next_to_manual_entry(self, hass):
+        """Test a manual entry without unique id does not hide MAC-less devices."""
+        MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.50", CONF_PORT: 30000},
+        ).add_to_hass(hass)
+        flow = self._flow(hass)
+        hosts, discover = self._patch_discovery(
+            [DiscoveredDevice("192.168.1.101", 0.034)]
+        )
+
+        with hosts, discover:
+            result = await flow.async_step_user(self.SETTINGS)
+
+        assert result["type"] == "form"
+        assert result["step_id"] == "discover"
+        choices = result["data_schema"].schema[CONF_HOST].container
+        assert list(choices) == ["192.168.1.101"]
+
+
+class TestOptionsFlow:
+    """Test changing the settings of an existing entry."""
+
+    @pytest.mark.asyncio
+    async def test_form_defaults_to_current_settings(self, hass, mock_config_entry):
+        """Test the form starts from the options, falling back to the data."""
+        mock_config_entry.add_to_hass(hass)
+        hass.config_entries.async_update_entry(
+            mock_config_entry, options={CONF_SCAN_INTERVAL: 60}
+        )
+        flow = MarstekConfigFlow.async_get_options_flow(mock_config_entry)
+        flow.hass = hass
+        flow.handler = mock_config_entry.entry_id
+
+        result = await flow.async_step_init()
+
+        assert isinstance(flow, MarstekOptionsFlow)
+        assert result["type"] == "form"
+        defaults = {str(key): key.default() for key in result["data_schema"].schema}
+        assert defaults[CONF_SCAN_INTERVAL] == 60
+        assert defaults[CONF_DOMAINS] == ["Bat.GetStatus", "Wifi.GetStatus"]
+        assert defaults[CONF_TIMEOUT_MIN] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_submit_stores_options(self, hass, mock_config_entry):
+        """Test the submitted settings become the entry's options."""
+        mock_config_entry.add_to_hass(hass)
+        flow = MarstekOptionsFlow()
+        flow.hass = hass
+        flow.handler = mock_config_entry.entry_id
+        options = {CONF_SCAN_INTERVAL: 15, CONF_DOMAINS: ["ES.GetStatus"]}
+
+        result = await flow.async_step_init(options)
+
+        assert result["type"] == "create_entry"
+        assert result["data"] == options
@@ -0,0 +1,516 @@
+"""Tests for MarstekCoordinator."""
+import asyncio
+import os
+import sys
+from datetime import timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api.api import MarstekDevice
+from custom_components.marstek_local_api.coordinator import MarstekCoordinator
+from custom_components.marstek_local_api.scheduler import FleetScheduler
+
+
+class TestMarstekCoordinator:
+    """Test the per-entry update coordinator."""
+
+    def test_update_interval_from_scan_interval(self, hass):
+        """Test the coordinator polls at the configured scan interval."""
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"])
+
+        coordinator = MarstekCoordinator(hass, device, 45)
+
+        assert coordinator.update_interval == timedelta(seconds=45)
+        assert coordinator.device is device
+
+    def test_update_interval_default(self, hass):
+        """Test a missing scan interval falls back to the default."""
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"])
+
+        coordinator = MarstekCoordinator(hass, device, None)
+
+        assert coordinator.update_interval == timedelta(seconds=30)
+
+    @pytest.mark.asyncio
+    async def test_single_fetch_per_refresh(self, hass, mock_device_data):
+        """Test one refresh polls the device once and publishes its snapshot."""
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"])
+        device._publish({"Bat.GetStatus": mock_device_data["Bat.GetStatus"]})
+        device.async_update = AsyncMock(return_value={"Bat.GetStatus"})
+        coordinator = MarstekCoordinator(hass, device, 10)
+
+        await coordinator.async_refresh()
+
+        device.async_update.assert_awaited_once_with(["Bat.GetStatus"])
+        assert coordinator.data["Bat.GetStatus"]["soc"] == 85
+        assert coordinator.snapshot is device.snapshot
+        assert coordinator.data is device.snapshot.data
+
+    def test_method_intervals(self, hass):
+        """Test slow methods get a longer interval than the scan interval."""
+        device = MarstekDevice(
+            "192.168.1.100",
+            30000,
+            ["ES.GetStatus", "Bat.GetStatus", "Wifi.GetStatus", "BLE.GetStatus"],
+        )
+
+        coordinator = MarstekCoordinator(hass, device, 5)
+
+        assert coordinator.update_interval == timedelta(seconds=5)
+        assert coordinator.scheduler._intervals == {
+            "ES.GetStatus": 5,
+            "Bat.GetStatus": 30,
+            "Wifi.GetStatus": 600,
+            "BLE.GetStatus": 600,
+        }
+
+    @pytest.mark.asyncio
+    async def test_refresh_requests_only_due_methods(self, hass):
+        """Test a tick only requests methods whose interval has passed."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Wifi.GetStatus"]
+        )
+        device.async_update = AsyncMock(return_value={"ES.GetStatus", "Wifi.GetStatus"})
+        coordinator = MarstekCoordinator(hass, device, 5)
+
+        await coordinator.async_refresh()
+        device.async_update.assert_awaited_once_with(["ES.GetStatus", "Wifi.GetStatus"])
+
+        device.async_update.reset_mock()
+        device.async_update.return_value = {"ES.GetStatus"}
+        with patch.object(hass.loop, "time", return_value=hass.loop.time() + 5):
+            await coordinator.async_refresh()
+        device.async_update.assert_awaited_once_with(["ES.GetStatus"])
+
+    @pytest.mark.asyncio
+    async def test_battery_activity_speeds_up_polling(self, hass):
+        """Test a power swing switches the coordinator to the burst interval."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Wifi.GetStatus"]
+        )
+        device.async_update = AsyncMock(return_value={"ES.GetStatus"})
+        coordinator = MarstekCoordinator(hass, device, 60)
+
+        device._publish({"ES.GetStatus": {"bat_power": 0}})
+        await coordinator.async_refresh()
+        assert coordinator.update_interval == timedelta(seconds=60)
+
+        device._publish({"ES.GetStatus": {"bat_power": -800}})
+        await coordinator.async_refresh()
+
+        assert coordinator.update_interval == timedelta(seconds=5)
+        assert coordinator.scheduler._intervals == {
+            "ES.GetStatus": 5,
+            "Wifi.GetStatus": 600,
+        }
+
+    @pytest.mark.asyncio
+    async def test_silent_device_opens_breaker(self, hass, mock_device_data):
+        """Test repeated silent cycles make the entities unavailable."""
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"])
+        device._publish({"Bat.GetStatus": mock_device_data["Bat.GetStatus"]})
+        device.async_update = AsyncMock(return_value=set())
+        coordinator = MarstekCoordinator(hass, device, 10)
+
+        for _ in range(2):
+            await coordinator.async_refresh()
+            assert coordinator.last_update_success
+
+        await coordinator.async_refresh()
+
+        assert not coordinator.last_update_success
+        assert coordinator.breaker.is_open
+        # The last readings are kept for when the device comes back
+        assert coordinator.data["Bat.GetStatus"]["soc"] == 85
+
+    @pytest.mark.asyncio
+    async def test_never_answered_method_does_not_trip_breaker(self, hass):
+        """Test cycles of only a method without answers keep the device up."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["PV.GetStatus", "Wifi.GetStatus"]
+        )
+        device.async_update = AsyncMock(return_value={"Wifi.GetStatus"})
+        coordinator = MarstekCoordinator(hass, device, 30)
+        now = hass.loop.time()
+        await coordinator.async_refresh()
+
+        # Wifi is only due every 600 s, the cycles between request PV alone
+        device.async_update.return_value = set()
+        for tick in range(1, 4):
+            with patch.object(hass.loop, "time", return_value=now + 30 * tick):
+                await coordinator.async_refresh()
+            assert coordinator.last_update_success
+
+        assert coordinator.breaker.failures == 0
+        assert set(coordinator.capabilities.unsupported) == {"PV.GetStatus"}
+
+    @pytest.mark.asyncio
+    async def test_error_replies_keep_breaker_closed(self, hass):
+        """Test a device answering only with errors is not taken offline."""
+        device = MarstekDevice("192.168.1.100", 30000, ["ES.GetStatus"])
+
+        async def _async_update(methods):
+            device.last_errors = {"ES.GetStatus": "-32000"}
+            return set()
+
+        device.async_update = AsyncMock(side_effect=_async_update)
+        coordinator = MarstekCoordinator(hass, device, 10)
+
+        for _ in range(3):
+            await coordinator.async_refresh()
+
+        assert coordinator.last_update_success
+        assert coordinator.breaker.failures == 0
+
+    @pytest.mark.asyncio
+    async def test_open_breaker_only_probes(self, hass):
+        """Test an open breaker waits for the backoff and sends one probe."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Bat.GetStatus"]
+        )
+        device.async_update = AsyncMock(return_value={"Bat.GetStatus"})
+        coordinator = MarstekCoordinator(hass, device, 10)
+        now = hass.loop.time()
+        await coordinator.async_refresh()
+
+        # Bat answered before, its silence once due again is the device's
+        device.async_update.return_value = set()
+        for tick in range(1, 4):
+            with patch.object(hass.loop, "time", return_value=now + 30 * tick):
+                await coordinator.async_refresh()
+        assert coordinator.breaker.is_open
+
+        device.async_update.reset_mock()
+        await coordinator.async_refresh()
+        device.async_update.assert_not_awaited()
+
+        device.async_update.return_value = {"Bat.GetStatus"}
+        retry_at = coordinator.breaker.retry_at
+        with patch.object(hass.loop, "time", return_value=retry_at):
+            await coordinator.async_refresh()
+
+        device.async_update.assert_awaited_once_with(["Bat.GetStatus"])
+        assert not coordinator.breaker.is_open
+        assert coordinator.last_update_success
+
+    @pytest.mark.asyncio
+    async def test_changed_methods(self, hass):
+        """Test only methods whose values differ are reported as changed."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Bat.GetStatus"]
+        )
+        device.async_update = AsyncMock(return_value={"ES.GetStatus", "Bat.GetStatus"})
+        coordinator = MarstekCoordinator(hass, device, 10)
+        device._publish(
+            {"ES.GetStatus": {"bat_power": 0}, "Bat.GetStatus": {"soc": 85}}
+        )
+        await coordinator.async_refresh()
+        assert coordinator.changed_methods == {"ES.GetStatus", "Bat.GetStatus"}
+
+        device._publish(
+            {"ES.GetStatus": {"bat_power": 0}, "Bat.GetStatus": {"soc": 86}}
+        )
+        await coordinator.async_refresh()
+
+        assert coordinator.changed_methods == {"Bat.GetStatus"}
+
+    def test_default_ttls(self, hass):
+        """Test values go stale after a few intervals of their method."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Wifi.GetStatus"]
+        )
+
+        coordinator = MarstekCoordinator(hass, device, 10, ttls={"ES.GetStatus": 60})
+
+        assert coordinator.ttls == {"ES.GetStatus": 60, "Wifi.GetStatus": 1800}
+
+    def test_is_stale(self, hass):
+        """Test staleness follows the time values were received."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Bat.GetStatus"]
+        )
+        coordinator = MarstekCoordinator(hass, device, 10)
+        with patch(
+            "custom_components.marstek_local_api.api.time.time", return_value=1000.0
+        ):
+            device._publish({"ES.GetStatus": {"bat_power": 0}}, ["Bat.GetStatus"])
+        coordinator.snapshot = device.snapshot
+
+        assert not coordinator.is_stale("ES.GetStatus", now=1030.0)
+        assert coordinator.is_stale("ES.GetStatus", now=1031.0)
+        # Never answered
+        assert coordinator.is_stale("Bat.GetStatus", now=1000.0)
+
+    @pytest.mark.asyncio
+    async def test_unsupported_method_left_out(self, hass):
+        """Test a method the device rejects is no longer requested."""
+        device = MarstekDevice("192.168.1.100", 30000, ["ES.GetStatus", "PV.GetStatus"])
+
+        async def _async_update(methods):
+            device.last_errors = {"PV.GetStatus": "-32601"}
+            return {"ES.GetStatus"}
+
+        device.async_update = AsyncMock(side_effect=_async_update)
+        coordinator = MarstekCoordinator(hass, device, 10)
+
+        await coordinator.async_refresh()
+        assert set(coordinator.capabilities.unsupported) == {"PV.GetStatus"}
+
+        device.async_update.reset_mock()
+        with patch.object(hass.loop, "time", return_value=hass.loop.time() + 10):
+            await coordinator.async_refresh()
+        device.async_update.assert_awaited_once_with(["ES.GetStatus"])
+
+        device.async_update.reset_mock()
+        with patch.object(hass.loop, "time", return_value=hass.loop.time() + 3600):
+            await coordinator.async_refresh()
+        device.async_update.assert_awaited_once_with(["ES.GetStatus", "PV.GetStatus"])
+
+    @pytest.mark.asyncio
+    async def test_polls_only_methods_with_entities(self, hass):
+        """Test the plan follows the methods entities listen to."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Wifi.GetStatus", "BLE.GetStatus"]
+        )
+        coordinator = MarstekCoordinator(hass, device, 10)
+        assert set(coordinator.scheduler._intervals) == set(device._methods)
+
+        remove_es = coordinator.async_add_listener(lambda: None, "ES.GetStatus")
+        remove_wifi = coordinator.async_add_listener(lambda: None, "Wifi.GetStatus")
+        coordinator.async_entities_added()
+        assert set(coordinator.scheduler._intervals) == {
+            "ES.GetStatus",
+            "Wifi.GetStatus",
+        }
+
+        remove_wifi()
+        assert set(coordinator.scheduler._intervals) == {"ES.GetStatus"}
+
+        # With every entity disabled or removed nothing is polled
+        remove_es()
+        assert coordinator.scheduler._intervals == {}
+
+    @pytest.mark.asyncio
+    async def test_method_enabled_later_not_stale(self, hass):
+        """Test a method whose first entity is enabled later keeps its TTL."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Bat.GetStatus"]
+        )
+        coordinator = MarstekCoordinator(hass, device, 10)
+        remove_es = coordinator.async_add_listener(lambda: None, "ES.GetStatus")
+        coordinator.async_entities_added()
+        coordinator.reconfigure(10)
+        assert set(coordinator.scheduler._intervals) == {"ES.GetStatus"}
+
+        remove_bat = coordinator.async_add_listener(lambda: None, "Bat.GetStatus")
+        with patch(
+            "custom_components.marstek_local_api.api.time.time", return_value=1000.0
+        ):
+            device._publish({"Bat.GetStatus": {"soc": 86}})
+        coordinator.snapshot = device.snapshot
+
+        assert coordinator.ttls["Bat.GetStatus"] == 90
+        assert not coordinator.is_stale("Bat.GetStatus", now=1060.0)
+        remove_bat()
+        remove_es()
+
+    @pytest.mark.asyncio
+    async def test_replies_streamed_to_entities(self, hass):
+        """Test a reply reaches its method's entities before the cycle ends."""
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["ES.GetStatus", "Wifi.GetStatus"]
+        )
+        coordinator = MarstekCoordinator(hass, device, 10)
+        es_updates = []
+        wifi_updates = []
+        remove_es = coordinator.async_add_listener(
+            lambda: es_updates.append(coordinator.data["ES.GetStatus"]["bat_power"]),
+            "ES.GetStatus",
+        )
+        remove_wifi = coordinator.async_add_listener(
+            lambda: wifi_updates.append(1), "Wifi.GetStatus"
+        )
+
+        async def _async_update(methods):
+            device._cycle += 1
+            device._publish({"ES.GetStatus": {"bat_power": 300}})
+            device.on_result("ES.GetStatus")
+            # ES entities already saw the reply while Wifi is still pending
+            assert es_updates == [300]
+            assert wifi_updates == []
+            device._publish({}, methods)
+            return {"ES.GetStatus"}
+
+        device.async_update = AsyncMock(side_effect=_async_update)
+        await coordinator.async_refresh()
+
+        assert coordinator.data["ES.GetStatus"] == {"bat_power": 300}
+        # The end of the cycle reports no further change for ES
+        assert coordinator.changed_methods == {"Wifi.GetStatus"}
+        remove_es()
+        remove_wifi()
+
+    @pytest.mark.asyncio
+    async def test_restore_until_first_refresh(self, hass):
+        """Test stored values are shown and fresh until the first poll ends."""
+        device = MarstekDevice("192.168.1.100", 30000, ["ES.GetStatus", "PV.GetStatus"])
+        store = Mock()
+        store.async_load = AsyncMock(
+            return_value={
+                "data": {"ES.GetStatus": {"bat_power": 250}, "BLE.GetStatus": {}},
+                "updated_at": {"ES.GetStatus": 1000.0, "BLE.GetStatus": 1000.0},
+            }
+        )
+        coordinator = MarstekCoordinator(hass, device, 10, store=store)
+
+        await coordinator.async_restore()
+
+        # Methods no longer configured are not taken over
+        assert dict(coordinator.data) == {"ES.GetStatus": {"bat_power": 250}}
+        assert coordinator.snapshot.cycle == 0
+        assert not coordinator.is_stale("ES.GetStatus", now=1600.0)
+        assert coordinator.is_stale("PV.GetStatus", now=1600.0)
+        # Readings of a device that was off for long are not shown as current
+        assert coordinator.is_stale("ES.GetStatus", now=1901.0)
+
+        device.async_update = AsyncMock(return_value=set())
+        await coordinator.async_refresh()
+
+        assert coordinator.data["ES.GetStatus"] == {"bat_power": 250}
+        assert coordinator.is_stale("ES.GetStatus")
+
+    @pytest.mark.asyncio
+    async def test_results_saved_with_delay(self, hass):
+        """Test polled values are written once per store delay."""
+        device = MarstekDevice("192.168.1.100", 30000, ["ES.GetStatus"])
+        store = Mock()
+        coordinator = MarstekCoordinator(hass, device, 10, store=store)
+
+        async def _async_update(methods):
+            device._publish({"ES.GetStatus": {"bat_power": 300}}, methods)
+            return {"ES.GetStatus"}
+
+        device.async_update = AsyncMock(side_effect=_async_update)
+        await coordinator.async_refresh()
+        await coordinator.async_refresh()
+
+        store.async_delay_save.assert_called_once()
+        data_func, delay = store.async_delay_save.call_args.args
+        assert delay == 300
+        stored = data_func()
+        assert stored["data"] == {"ES.GetStatus": {"bat_power": 300}}
+        assert set(stored["updated_at"]) == {"ES.GetStatus"}
+
+        # Once written, the next cycle schedules a new write
+        await coordinator.async_refresh()
+        assert store.async_delay_save.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_shutdown_writes_values(self, hass):
+        """Test shutting down writes the latest values right away."""
+        device = MarstekDevice("192.168.1.100", 30000, ["ES.GetStatus"])
+        store = Mock()
+        store.async_save = AsyncMock()
+        coordinator = MarstekCoordinator(hass, device, 10, store=store)
+        device._publish({"ES.GetStatus": {"bat_power": 300}})
+
+        await coordinator.async_shutdown()
+
+        stored = store.async_save.call_args.args[0]
+        assert stored["data"] == {"ES.GetStatus": {"bat_power": 300}}
+
+    @pytest.mark.asyncio
+    async def test_fleet_ticks_on_phase(self, hass):
+        """Test devices of a hub tick on their own phase of the grid."""
+        fleet = FleetScheduler(3)
+        coordinators = [
+            MarstekCoordinator(
+                hass,
+                MarstekDevice(f"192.168.1.{100 + i}", 30000, ["ES.GetStatus"]),
+                30,
+                fleet=fleet,
+                fleet_index=i,
+            )
+            for i in range(3)
+        ]
+
+        ticks = []
+        with patch.object(hass.loop, "time", return_value=1000.0), patch.object(
+            hass.loop, "call_at"
+        ) as call_at:
+            for coordinator in coordinators:
+                await coordinator.async_start()
+                ticks.append(call_at.call_args.args[0])
+
+        assert ticks == [1020.0, 1030.0, 1010.0]
+        assert coordinators[0].update_interval is None
+        assert coordinators[0].poll_interval == timedelta(seconds=30)
+
+    @pytest.mark.asyncio
+    async def test_fleet_tick_stays_on_grid(self, hass):
+        """Test a late tick arms the next one on the grid, not after it."""
+        coordinator = MarstekCoordinator(
+            hass,
+            MarstekDevice("192.168.1.101", 30000, ["ES.GetStatus"]),
+            30,
+            fleet=FleetScheduler(3),
+            fleet_index=1,
+        )
+
+        with patch.object(MarstekCoordinator, "async_refresh") as mock_refresh:
+            with patch.object(hass.loop, "time", return_value=1037.0), patch.object(
+                hass.loop, "call_at"
+            ) as call_at:
+                coordinator._async_tick()
+            await hass.async_block_till_done()
+
+        assert call_at.call_args.args[0] == 1060.0
+        mock_refresh.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_tick_skipped_while_cycle_runs(self, hass):
+        """Test a tick during a running cycle is skipped, not queued."""
+        device = MarstekDevice("192.168.1.100", 30000, ["ES.GetStatus"])
+        release = asyncio.Event()
+
+        async def _async_update(methods):
+            await release.wait()
+            return set(methods)
+
+        device.async_update = AsyncMock(side_effect=_async_update)
+        coordinator = MarstekCoordinator(hass, device, 10)
+
+        first = hass.async_create_task(coordinator.async_refresh())
+        await asyncio.sleep(0)
+        await coordinator.async_refresh()
+
+        assert coordinator.skipped_ticks == 1
+        assert device.budget == pytest.approx(8)
+        release.set()
+        await first
+        device.async_update.assert_awaited_once()
+
+    def test_reconfigure(self, hass):
+        """Test new settings replace the plan, TTLs and probe method."""
+        device = MarstekDevice("192.168.1.100", 30000, ["PV.GetStatus", "ES.GetStatus"])
+        coordinator = MarstekCoordinator(hass, device, 10, ttls={"ES.GetStatus": 5})
+
+        device.reconfigure(
+            ["ES.GetStatus", "Bat.GetStatus"], timeout_min=1, timeout_max=2
+        )
+        coordinator.reconfigure(60)
+
+        assert coordinator.update_interval == timedelta(seconds=60)
+        assert coordinator.scheduler._intervals == {
+            "ES.GetStatus": 60,
+            "Bat.GetStatus": 60,
+        }
+        assert coordinator.ttls == {"ES.GetStatus": 5, "Bat.GetStatus": 180}
+        assert coordinator._probe_method == "ES.GetStatus"
+        assert device.rtt.timeout == 2
@@ -0,0 +1,74 @@
+"""Tests for the sensor description table."""
+import dataclasses
+import os
+import sys
+
+import pytest
+from homeassistant.components.sensor import SensorDeviceClass, SensorStateClass
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api.const import OPTIONS
+from custom_components.marstek_local_api.descriptions import (
+    METHOD_KEYS,
+    SENSOR_DESCRIPTIONS,
+    SENSORS_BY_METHOD,
+)
+
+
+def test_descriptions_unique():
+    """Test every method and key pair is described once."""
+    pairs = [(d.method, d.key) for d in SENSOR_DESCRIPTIONS]
+
+    assert len(pairs) == len(set(pairs)) == 31
+
+
+def test_every_option_described():
+    """Test each selectable domain has sensors."""
+    assert set(SENSORS_BY_METHOD) == set(OPTIONS)
+
+
+def test_index_by_method():
+    """Test the index keeps table order and lists the keys per method."""
+    assert [d.key for d in SENSORS_BY_METHOD["ES.GetMode"]] == [
+        "mode",
+        "ongrid_power",
+        "offgrid_power",
+        "bat_soc",
+    ]
+    assert METHOD_KEYS["BLE.GetStatus"] == {"state", "ble_mac"}
+
+
+def test_descriptions_frozen():
+    """Test descriptions and the index cannot be changed."""
+    description = SENSORS_BY_METHOD["Bat.GetStatus"][0]
+
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        description.key = "other"
+    with pytest.raises(TypeError):
+        SENSORS_BY_METHOD["Bat.GetStatus"] = ()
+
+
+def test_energy_totals_increase():
+    """Test lifetime energy counters are usable in the energy dashboard."""
+    totals = [
+        d for d in SENSORS_BY_METHOD["ES.GetStatus"] if d.key.startswith("total_")
+    ]
+
+    assert len(totals) == 4
+    for description in totals:
+        assert description.device_class == SensorDeviceClass.ENERGY
+        assert description.state_class == SensorStateClass.TOTAL_INCREASING
+
+
+def test_transforms():
+    """Test the flag and power transforms."""
+    flags = {d.key: d for d in SENSORS_BY_METHOD["Bat.GetStatus"]}
+    mode = {d.key: d for d in SENSORS_BY_METHOD["ES.GetMode"]}
+
+    assert flags["charg_flag"].transform(1) is True
+    assert flags["dischrg_flag"].transform(None) is False
+    assert mode["ongrid_power"].transform("200.5") == 200.5
@@ -1,11 +1,9 @@
 """Tests for MarstekDevice class."""
+import asyncio
 import json
 import os
-import socket
 import sys
-import time
-from datetime import timedelta
-from unittest.mock import Mock, call, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 
@@ -14,9 +12,65 @@ project_root = os.path.dirname(os.path.dirname(__file__))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from custom_components.marstek_local_api.api import (
+    MarstekProtocol,
+    MarstekSocket,
+    RequestPacer,
+    RequestRegistry,
+    RttEstimator,
+)
+from custom_components.marstek_local_api.const import MAX_REQUEST_ID
 from custom_components.marstek_local_api.sensor import MarstekDevice
 
 
+@pytest.fixture(autouse=True)
+def fast_timing():
+    """Shorten request timeout and pacing so tests run quickly."""
+    with patch("custom_components.marstek_local_api.api.REQUEST_TIMEOUT", 0.05), patch(
+        "custom_components.marstek_local_api.api.PACER_RATE", 1000
+    ), patch("custom_components.marstek_local_api.api.PACER_MAX_RATE", 1000), patch(
+        "custom_components.marstek_local_api.api.DEFAULT_TIMEOUT_MIN", 0.01
+    ):
+        yield
+
+
+@pytest.fixture
+def fake_endpoint():
+    """Replace create_datagram_endpoint with a fake device sending replies."""
+    transport = Mock()
+    transport.in_flight = []
+    calls = []
+    replies = {}
+
+    async def create_datagram_endpoint(loop, protocol_factory, **kwargs):
+        calls.append(kwargs)
+        protocol = protocol_factory()
+
+        def sendto(data, addr):
+            transport.in_flight.append(len(protocol._requests))
+            request = json.loads(data.decode())
+            reply = replies.get(request["method"])
+            if isinstance(reply, Exception):
+                raise reply
+            if reply is not None:
+                if not isinstance(reply, bytes):
+                    reply = json.dumps({**reply, "id": request["id"]}).encode()
+                loop.call_soon(protocol.datagram_received, reply, addr)
+
+        transport.sendto.side_effect = sendto
+        protocol.connection_made(transport)
+        return transport, protocol
+
+    def _configure(method_replies):
+        replies.update(method_replies)
+        return transport, calls
+
+    with patch.object(
+        asyncio.BaseEventLoop, "create_datagram_endpoint", create_datagram_endpoint
+    ):
+        yield _configure
+
+
 class TestMarstekDevice:
     """Test MarstekDevice UDP communication and caching."""
 
@@ -25,10 +79,9 @@ class TestMarstekDevice:
         host = "192.168.1.100"
         port = 30000
         methods = ["Bat.GetStatus", "Wifi.GetStatus"]
-        scan_interval = 10
         device_name = "Test Battery"
 
-        device = MarstekDevice(host, port, methods, scan_interval, device_name)
+        device = MarstekDevice(host, port, methods, device_name)
 
         assert device._host == host
         assert device._port == port
@@ -36,209 +89,745 @@ class TestMarstekDevice:
         assert device._device_name == device_name
         assert device._cache == {}
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_successful_communication(self, mock_sleep, mock_socket_class, mock_json_response, mock_device_data):
+    @pytest.mark.asyncio
+    async def test_update_successful_communication(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
         """Test successful UDP communication and caching."""
-        # Setup mock socket
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        
-        # Mock successful receives for each method
-        responses = []
         methods = ["Bat.GetStatus", "Wifi.GetStatus"]
-        for method in methods:
-            data = mock_device_data[method]
-            response = mock_json_response(method, data)
-            responses.append((json.dumps(response).encode(), ("192.168.1.100", 30000)))
-        
-        mock_sock.recvfrom.side_effect = responses
-
-        # Create device and update
-        device = MarstekDevice("192.168.1.100", 30000, methods, 10, "Test Battery")
-        device.update()
-
-        # Verify socket operations
-        mock_socket_class.assert_called_once_with(socket.AF_INET, socket.SOCK_DGRAM)
-        mock_sock.settimeout.assert_called_once_with(2.0)
-        mock_sock.bind.assert_called_once_with(("0.0.0.0", 30000))
-        
+        transport, calls = fake_endpoint(
+            {m: mock_json_response(m, mock_device_data[m]) for m in methods}
+        )
+
+        device = MarstekDevice("192.168.1.100", 30000, methods, "Test Battery")
+        await device.async_update()
+
+        # Verify the endpoint was bound to the configured port
+        assert calls == [{"local_addr": ("0.0.0.0", 30000)}]
+        assert device._socket.is_open
+
         # Verify UDP requests were sent
-        assert mock_sock.sendto.call_count == len(methods)
+        assert transport.sendto.call_count == len(methods)
         for i, method in enumerate(methods):
-            expected_payload = {"id": method, "method": method, "params": {"id": 0}}
-            call_args = mock_sock.sendto.call_args_list[i]
-            sent_data = call_args[0][0]
-            sent_address = call_args[0][1]
-            
+            expected_payload = {"id": i + 1, "method": method, "params": {"id": 0}}
+            sent_data, sent_address = transport.sendto.call_args_list[i][0]
+
             assert json.loads(sent_data.decode()) == expected_payload
             assert sent_address == ("192.168.1.100", 30000)
 
         # Verify data was cached
         assert device._cache["Bat.GetStatus"]["soc"] == 85
         assert device._cache["Wifi.GetStatus"]["ssid"] == "TestNetwork"
-        
-        # Verify sleep was called between requests
-        assert mock_sleep.call_count == len(methods)
-        for call in mock_sleep.call_args_list:
-            assert call == call(0.5)
 
-        mock_sock.close.assert_called_once()
+        transport.close.assert_not_called()
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_with_socket_timeout(self, mock_sleep, mock_socket_class):
-        """Test handling of socket timeouts during communication."""
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        mock_sock.recvfrom.side_effect = socket.timeout("Timeout")
+    @pytest.mark.asyncio
+    async def test_update_with_timeout(self, fake_endpoint):
+        """Test handling of missing replies during communication."""
+        transport, _ = fake_endpoint({})
 
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device.update()
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        await device.async_update()
 
         # Verify empty cache is created for methods with no response
         assert device._cache["Bat.GetStatus"] == {}
-        mock_sock.close.assert_called_once()
+        transport.close.assert_not_called()
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_with_socket_error(self, mock_sleep, mock_socket_class, caplog):
+    @pytest.mark.asyncio
+    async def test_update_with_socket_error(self, caplog):
         """Test handling of socket errors during setup."""
-        mock_socket_class.side_effect = OSError("Socket error")
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
 
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        
-        with caplog.at_level("ERROR"):
-            device.update()
+        loop = asyncio.get_running_loop()
+        with patch.object(
+            loop, "create_datagram_endpoint", side_effect=OSError("Bind failed")
+        ), caplog.at_level("ERROR"):
+            await device.async_update()
 
         assert "Socket setup failed" in caplog.text
         assert device._cache == {}
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_with_send_error(self, mock_sleep, mock_socket_class, caplog):
+    @pytest.mark.asyncio
+    async def test_update_with_send_error(self, fake_endpoint, caplog):
         """Test handling of errors during UDP send operations."""
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        mock_sock.sendto.side_effect = OSError("Send error")
+        transport, _ = fake_endpoint({"Bat.GetStatus": OSError("Send error")})
+
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
 
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        
         with caplog.at_level("ERROR"):
-            device.update()
+            await device.async_update()
 
         assert "Error sending request" in caplog.text
         # Should still create empty cache
         assert device._cache["Bat.GetStatus"] == {}
-        mock_sock.close.assert_called_once()
+        transport.close.assert_not_called()
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_with_invalid_json_response(self, mock_sleep, mock_socket_class, caplog):
+    @pytest.mark.asyncio
+    async def test_update_with_invalid_json_response(self, fake_endpoint):
         """Test handling of invalid JSON responses."""
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        mock_sock.recvfrom.return_value = (b"invalid json", ("192.168.1.100", 30000))
+        transport, _ = fake_endpoint({"Bat.GetStatus": b"invalid json"})
 
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device.update()
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        await device.async_update()
 
         # Should still create empty cache for methods
         assert device._cache["Bat.GetStatus"] == {}
-        mock_sock.close.assert_called_once()
+        transport.close.assert_not_called()
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_with_malformed_response(self, mock_sleep, mock_socket_class):
+    @pytest.mark.asyncio
+    async def test_update_with_malformed_response(self, fake_endpoint):
         """Test handling of responses with missing fields."""
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        
         # Response missing 'result' field
-        malformed_response = {"id": "Bat.GetStatus"}
-        mock_sock.recvfrom.return_value = (
-            json.dumps(malformed_response).encode(),
-            ("192.168.1.100", 30000)
-        )
+        fake_endpoint({"Bat.GetStatus": {"id": "Bat.GetStatus"}})
 
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device.update()
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        await device.async_update()
 
         # Should cache empty dict as result defaults to {}
         assert device._cache["Bat.GetStatus"] == {}
 
+    @pytest.mark.asyncio
+    async def test_update_pipelines_requests(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test all methods are in flight together and matched by id."""
+        methods = ["Bat.GetStatus", "Wifi.GetStatus", "ES.GetStatus"]
+        transport, _ = fake_endpoint(
+            {m: mock_json_response(m, mock_device_data[m]) for m in methods}
+        )
+
+        device = MarstekDevice("192.168.1.100", 30000, methods, "Test Battery")
+        await device.async_update()
+
+        assert transport.in_flight == [1, 2, 3]
+        assert device._cache["Bat.GetStatus"]["soc"] == 85
+        assert device._cache["Wifi.GetStatus"]["ssid"] == "TestNetwork"
+        assert device._cache["ES.GetStatus"]["bat_power"] == -300
+
+    @pytest.mark.asyncio
+    async def test_update_respects_in_flight_limit(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test the in-flight limit caps outstanding requests."""
+        methods = ["Bat.GetStatus", "Wifi.GetStatus", "ES.GetStatus"]
+        transport, _ = fake_endpoint(
+            {m: mock_json_response(m, mock_device_data[m]) for m in methods}
+        )
+
+        device = MarstekDevice(
+            "192.168.1.100", 30000, methods, "Test Battery", max_in_flight=2
+        )
+        await device.async_update()
+
+        assert max(transport.in_flight) == 2
+        assert set(device._cache) == set(methods)
+
+    @pytest.mark.asyncio
+    async def test_update_serial_with_limit_of_one(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test a limit of one requests methods one after another with pacing."""
+        methods = ["Bat.GetStatus", "Wifi.GetStatus"]
+        transport, _ = fake_endpoint(
+            {m: mock_json_response(m, mock_device_data[m]) for m in methods}
+        )
+
+        device = MarstekDevice(
+            "192.168.1.100", 30000, methods, "Test Battery", max_in_flight=1
+        )
+        pacer = device._socket.pacer("192.168.1.100")
+        pacer.rate = 100
+
+        await device.async_update()
+
+        assert transport.in_flight == [1, 1]
+        assert pacer.rate == 101
+
+    @pytest.mark.asyncio
+    async def test_serial_loss_slows_pacing(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test a known method going silent halves the pace."""
+        fake_endpoint({})
+        device = MarstekDevice(
+            "192.168.1.100",
+            30000,
+            ["Bat.GetStatus", "BLE.GetStatus"],
+            "Test Battery",
+            max_in_flight=1,
+        )
+        device._publish({"Bat.GetStatus": mock_device_data["Bat.GetStatus"]})
+        pacer = device._socket.pacer("192.168.1.100")
+        pacer.rate = 100
+
+        await device.async_update()
+
+        # BLE.GetStatus never answered before, so only one loss counts
+        assert pacer.rate == 50
+
+    @pytest.mark.asyncio
+    async def test_update_subset_returns_answered(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test only the given methods are requested and answered ones returned."""
+        transport, _ = fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", mock_device_data["Bat.GetStatus"])}
+        )
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["Bat.GetStatus", "Wifi.GetStatus", "ES.GetStatus"]
+        )
+
+        answered = await device.async_update(["Bat.GetStatus", "Wifi.GetStatus"])
+
+        assert answered == {"Bat.GetStatus"}
+        assert transport.sendto.call_count == 2
+        assert "ES.GetStatus" not in device._cache
+
+    @pytest.mark.asyncio
+    async def test_update_measures_round_trips(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test answered requests feed the round trip estimate."""
+        fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", mock_device_data["Bat.GetStatus"])}
+        )
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus", "Wifi.GetStatus"])
+
+        await device.async_update()
+
+        assert device.rtt.samples == 1
+        assert device.rtt.srtt is not None
+        assert device.diagnostics()["rtt"]["samples"] == 1
+
+    @pytest.mark.asyncio
+    async def test_silent_cycle_backs_off_timeout(self, fake_endpoint):
+        """Test the timeout grows only when no method was answered."""
+        fake_endpoint({})
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["Bat.GetStatus"], timeout_max=5.0
+        )
+        initial = device.rtt.timeout
+
+        await device.async_update()
+
+        assert device.rtt.timeout == initial * 2
+
+    @pytest.mark.asyncio
+    async def test_socket_reused_across_cycles(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test the endpoint is bound once and kept open between cycles."""
+        transport, calls = fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", mock_device_data["Bat.GetStatus"])}
+        )
+
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        await device.async_update()
+        await device.async_update()
+
+        assert len(calls) == 1
+        assert transport.sendto.call_count == 2
+
+        device.close()
+        transport.close.assert_called_once()
+        assert not device._socket.is_open
+
+    @pytest.mark.asyncio
+    async def test_shared_socket_routes_replies_by_source(self, fake_endpoint):
+        """Test devices sharing a socket only receive their own replies."""
+        transport, calls = fake_endpoint({})
+        udp_socket = MarstekSocket(30000)
+        first = MarstekDevice(
+            "192.168.1.100", 30000, ["Bat.GetStatus"], "First", udp_socket=udp_socket
+        )
+        second = MarstekDevice(
+            "192.168.1.101", 30000, ["Bat.GetStatus"], "Second", udp_socket=udp_socket
+        )
+
+        def sendto(data, addr):
+            request = json.loads(data.decode())
+            reply = {"id": request["id"], "result": {"soc": int(addr[0].rsplit(".", 1)[1])}}
+            asyncio.get_running_loop().call_soon(
+                udp_socket._protocol.datagram_received, json.dumps(reply).encode(), addr
+            )
+
+        await udp_socket.async_open()
+        transport.sendto.side_effect = sendto
+        await asyncio.gather(first.async_update(), second.async_update())
+
+        assert len(calls) == 1
+        assert first._cache["Bat.GetStatus"] == {"soc": 100}
+        assert second._cache["Bat.GetStatus"] == {"soc": 101}
+
+        # A device never closes a socket it was handed
+        first.close()
+        transport.close.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_cycle_cut_off_at_budget(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test requests still outstanding at the budget are cancelled."""
+        transport, _ = fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", mock_device_data["Bat.GetStatus"])}
+        )
+        device = MarstekDevice(
+            "192.168.1.100",
+            30000,
+            ["Bat.GetStatus", "PV.GetStatus"],
+            "Test Battery",
+            timeout_min=5,
+        )
+        device.budget = 0.05
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        answered = await device.async_update()
+
+        assert loop.time() - started < 1
+        assert answered == {"Bat.GetStatus"}
+        assert device.overruns == 1
+        assert device._cache["PV.GetStatus"] == {}
+        assert len(device._socket._protocol._requests) == 0
+
+    @pytest.mark.asyncio
+    async def test_shared_limiter_bounds_all_devices(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test devices of a hub together keep to the limiter's requests."""
+        methods = ["Bat.GetStatus", "Wifi.GetStatus", "ES.GetStatus"]
+        transport, _ = fake_endpoint(
+            {m: mock_json_response(m, mock_device_data[m]) for m in methods}
+        )
+        udp_socket = MarstekSocket(30000)
+        limiter = asyncio.Semaphore(2)
+        devices = [
+            MarstekDevice(
+                f"192.168.1.{100 + i}",
+                30000,
+                methods,
+                f"Battery {i}",
+                udp_socket=udp_socket,
+                limiter=limiter,
+            )
+            for i in range(3)
+        ]
+
+        await asyncio.gather(*(device.async_update() for device in devices))
+
+        assert len(transport.in_flight) == 9
+        assert max(transport.in_flight) == 2
+        assert all(set(device._cache) == set(methods) for device in devices)
+
+    @pytest.mark.asyncio
+    async def test_hostname_resolved_once(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test hostnames are resolved so replies can be matched on source IP."""
+        transport, _ = fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", mock_device_data["Bat.GetStatus"])}
+        )
+        device = MarstekDevice("marstek.local", 30000, ["Bat.GetStatus"], "Test Battery")
+
+        loop = asyncio.get_running_loop()
+        infos = [(2, 2, 17, "", ("192.168.1.100", 30000))]
+        with patch.object(loop, "getaddrinfo", AsyncMock(return_value=infos)) as mock_resolve:
+            await device.async_update()
+            await device.async_update()
+
+        mock_resolve.assert_awaited_once()
+        assert transport.sendto.call_args[0][1] == ("192.168.1.100", 30000)
+        assert device._cache["Bat.GetStatus"]["soc"] == 85
+
     def test_get_value_existing_key(self):
         """Test getting existing values from cache."""
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device._cache = {
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        device._publish({
             "Bat.GetStatus": {"soc": 85, "bat_temp": 250}
-        }
+        })
 
         assert device.get_value("Bat.GetStatus", "soc") == 85
         assert device.get_value("Bat.GetStatus", "bat_temp") == 250
 
     def test_get_value_missing_method(self):
         """Test getting value from non-existing method."""
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device._cache = {"Bat.GetStatus": {"soc": 85}}
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        device._publish({"Bat.GetStatus": {"soc": 85}})
 
         assert device.get_value("NonExistent.Method", "soc") is None
 
     def test_get_value_missing_key(self):
         """Test getting non-existing key from existing method."""
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device._cache = {"Bat.GetStatus": {"soc": 85}}
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        device._publish({"Bat.GetStatus": {"soc": 85}})
 
         assert device.get_value("Bat.GetStatus", "nonexistent_key") is None
 
     def test_get_value_empty_cache(self):
         """Test getting value when cache is empty."""
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
 
         assert device.get_value("Bat.GetStatus", "soc") is None
 
-    @patch("socket.socket")
-    @patch("time.sleep")
-    def test_update_multiple_methods_mixed_success(self, mock_sleep, mock_socket_class, mock_json_response, mock_device_data):
+    @pytest.mark.asyncio
+    async def test_update_multiple_methods_mixed_success(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
         """Test update with some methods succeeding and others failing."""
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        
         # First method succeeds, second times out
-        responses = [
-            (json.dumps(mock_json_response("Bat.GetStatus", mock_device_data["Bat.GetStatus"])).encode(), 
-             ("192.168.1.100", 30000)),
-            socket.timeout("Timeout for second method")
-        ]
-        mock_sock.recvfrom.side_effect = responses
+        fake_endpoint(
+            {
+                "Bat.GetStatus": mock_json_response(
+                    "Bat.GetStatus", mock_device_data["Bat.GetStatus"]
+                )
+            }
+        )
 
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus", "Wifi.GetStatus"], 10, "Test Battery")
-        device.update()
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus", "Wifi.GetStatus"], "Test Battery")
+        await device.async_update()
 
         # First method should have data, second should be empty
         assert device._cache["Bat.GetStatus"]["soc"] == 85
         assert device._cache["Wifi.GetStatus"] == {}
 
-    @patch("socket.socket")
-    def test_socket_cleanup_on_exception(self, mock_socket_class):
-        """Test that socket is properly closed even when exceptions occur."""
-        mock_sock = Mock()
-        mock_socket_class.return_value = mock_sock
-        mock_sock.bind.side_effect = OSError("Bind failed")
-
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, "Test Battery")
-        device.update()
-
-        # Socket should still be closed despite the exception
-        mock_sock.close.assert_called_once()
-
-    @patch("custom_components.marstek_local_api.sensor.Throttle")
-    def test_throttle_decorator_applied(self, mock_throttle):
-        """Test that throttle decorator is properly applied to update method."""
-        # Make the mock return a function that just returns the original function
-        mock_throttle.return_value = lambda func: func
-        
-        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 30, "Test Battery")
-        
-        # Verify throttle was called with correct timedelta
-        mock_throttle.assert_called_once_with(timedelta(seconds=30))
\ No newline at end of file
+    @pytest.mark.asyncio
+    async def test_error_reply_keeps_last_good_values(self, fake_endpoint):
+        """Test an error reply is counted and does not replace cached values."""
+        error = {"id": 0, "error": {"code": -32601, "message": "Method not found"}}
+        fake_endpoint({"Bat.GetStatus": error, "ES.GetMode": error})
+        device = MarstekDevice(
+            "192.168.1.100", 30000, ["Bat.GetStatus", "ES.GetMode"], "Test Battery"
+        )
+        device._publish({"Bat.GetStatus": {"soc": 85}})
+        timeout = device.rtt.timeout
+
+        answered = await device.async_update()
+        await device.async_update(["Bat.GetStatus"])
+
+        assert answered == set()
+        assert device.get_value("Bat.GetStatus", "soc") == 85
+        assert device._cache["ES.GetMode"] == {}
+        assert device.errors == {
+            "Bat.GetStatus": {"-32601": 2},
+            "ES.GetMode": {"-32601": 1},
+        }
+        # The device did answer, so the link is not backed off
+        assert device.rtt.timeout <= timeout
+        assert device.diagnostics()["errors"] == device.errors
+
+    @pytest.mark.asyncio
+    async def test_update_keeps_only_wanted_keys(self, fake_endpoint, mock_json_response):
+        """Test replies are reduced to the keys the sensors read."""
+        fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", {"soc": 85, "extra": 1})}
+        )
+        device = MarstekDevice(
+            "192.168.1.100",
+            30000,
+            ["Bat.GetStatus"],
+            "Test Battery",
+            keys={"Bat.GetStatus": frozenset({"soc", "bat_temp"})},
+        )
+
+        await device.async_update()
+
+        assert device._cache["Bat.GetStatus"] == {"soc": 85}
+
+    @pytest.mark.asyncio
+    async def test_results_published_as_they_arrive(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test each answered method is published before the next is requested."""
+        methods = ["ES.GetStatus", "Wifi.GetStatus", "Bat.GetStatus"]
+        fake_endpoint(
+            {
+                m: mock_json_response(m, mock_device_data[m])
+                for m in ("ES.GetStatus", "Bat.GetStatus")
+            }
+        )
+        device = MarstekDevice(
+            "192.168.1.100", 30000, methods, "Test Battery", max_in_flight=1
+        )
+        seen = []
+        device.on_result = lambda method: seen.append(
+            (method, set(device.snapshot.data), device.snapshot.cycle)
+        )
+
+        await device.async_update()
+
+        assert seen == [
+            ("ES.GetStatus", {"ES.GetStatus"}, 1),
+            ("Bat.GetStatus", {"ES.GetStatus", "Bat.GetStatus"}, 1),
+        ]
+        assert set(device.snapshot.data) == set(methods)
+
+    @pytest.mark.asyncio
+    async def test_update_publishes_new_snapshot(
+        self, fake_endpoint, mock_json_response, mock_device_data
+    ):
+        """Test a cycle replaces the snapshot instead of changing it."""
+        fake_endpoint(
+            {"Bat.GetStatus": mock_json_response("Bat.GetStatus", {"soc": 86})}
+        )
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        device._publish({"Bat.GetStatus": {"soc": 85}})
+        before = device.snapshot
+
+        await device.async_update()
+
+        assert before.data["Bat.GetStatus"]["soc"] == 85
+        assert device.snapshot.cycle == before.cycle + 1
+        assert device.snapshot.timestamp >= before.timestamp
+        assert device.get_value("Bat.GetStatus", "soc") == 86
+
+    @pytest.mark.asyncio
+    async def test_failed_method_keeps_previous_values(self, fake_endpoint):
+        """Test an unanswered method keeps the values of an earlier cycle."""
+        fake_endpoint({})
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        device._publish({"Bat.GetStatus": {"soc": 85}})
+        received_at = device.snapshot.updated_at["Bat.GetStatus"]
+
+        await device.async_update()
+
+        assert device.get_value("Bat.GetStatus", "soc") == 85
+        assert device.snapshot.cycle == 1
+        assert device.snapshot.updated_at["Bat.GetStatus"] == received_at
+
+    def test_snapshot_is_read_only(self):
+        """Test published values cannot be changed by readers."""
+        device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], "Test Battery")
+        device._publish({"Bat.GetStatus": {"soc": 85}})
+
+        with pytest.raises(TypeError):
+            device.snapshot.data["Bat.GetStatus"]["soc"] = 0
+        with pytest.raises(TypeError):
+            device.snapshot.data["Wifi.GetStatus"] = {}
+
+
+class TestMarstekProtocol:
+    """Test reply routing in MarstekProtocol."""
+
+    @pytest.mark.asyncio
+    async def test_reply_resolves_pending_request(self):
+        """Test a reply with a matching id resolves the waiting request."""
+        protocol = MarstekProtocol()
+        protocol.connection_made(Mock())
+        addr = ("192.168.1.100", 30000)
+
+        task = asyncio.create_task(protocol.request(addr, "Bat.GetStatus", 1))
+        await asyncio.sleep(0)
+        sent = json.loads(protocol.transport.sendto.call_args[0][0])
+        protocol.datagram_received(
+            json.dumps({"id": sent["id"], "result": {"soc": 50}}).encode(), addr
+        )
+
+        assert (await task)["result"] == {"soc": 50}
+        assert len(protocol._requests) == 0
+
+    @pytest.mark.asyncio
+    async def test_request_ids_are_unique(self):
+        """Test every request gets a new numeric id."""
+        protocol = MarstekProtocol()
+        protocol.connection_made(Mock())
+        addr = ("192.168.1.100", 30000)
+
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await protocol.request(addr, "Bat.GetStatus", 0)
+
+        ids = [json.loads(c[0][0])["id"] for c in protocol.transport.sendto.call_args_list]
+        assert ids == [1, 2, 3]
+        assert len(protocol._requests) == 0
+
+    @pytest.mark.asyncio
+    async def test_unexpected_reply_is_ignored(self):
+        """Test replies without a waiting request are dropped."""
+        protocol = MarstekProtocol()
+        protocol.connection_made(Mock())
+
+        protocol.datagram_received(
+            json.dumps({"id": "ES.GetStatus", "result": {}}).encode(),
+            ("192.168.1.100", 30000),
+        )
+
+        assert len(protocol._requests) == 0
+        assert protocol._requests.rejected == 1
+
+    @pytest.mark.asyncio
+    async def test_connection_lost_fails_pending_requests(self):
+        """Test pending requests are failed when the socket closes."""
+        protocol = MarstekProtocol()
+        protocol.connection_made(Mock())
+
+        task = asyncio.create_task(
+            protocol.request(("192.168.1.100", 30000), "Bat.GetStatus", 1)
+        )
+        await asyncio.sleep(0)
+        protocol.connection_lost(None)
+
+        with pytest.raises(ConnectionError):
+            await task
+
+
+class TestRequestPacer:
+    """Test the learned request pacing."""
+
+    @pytest.mark.asyncio
+    async def test_requests_spaced_by_rate(self):
+        """Test consecutive requests wait one interval after each other."""
+        with patch("custom_components.marstek_local_api.api.PACER_RATE", 4):
+            pacer = RequestPacer()
+        loop = asyncio.get_running_loop()
+
+        with patch.object(loop, "time", return_value=100.0), patch(
+            "custom_components.marstek_local_api.api.asyncio.sleep", AsyncMock()
+        ) as mock_sleep:
+            await pacer.acquire()
+            await pacer.acquire()
+            await pacer.acquire()
+
+        assert [c.args[0] for c in mock_sleep.await_args_list] == [0.25, 0.5]
+
+    def test_additive_increase(self):
+        """Test answers raise the rate step by step up to the maximum."""
+        with patch("custom_components.marstek_local_api.api.PACER_RATE", 2), patch(
+            "custom_components.marstek_local_api.api.PACER_MAX_RATE", 3
+        ), patch("custom_components.marstek_local_api.api.PACER_STEP", 0.5):
+            pacer = RequestPacer()
+            rates = []
+            for _ in range(3):
+                pacer.record_answer()
+                rates.append(pacer.rate)
+
+        assert rates == [2.5, 3, 3]
+
+    def test_multiplicative_decrease(self):
+        """Test a loss halves the rate down to the minimum."""
+        with patch("custom_components.marstek_local_api.api.PACER_RATE", 4), patch(
+            "custom_components.marstek_local_api.api.PACER_MIN_RATE", 1.5
+        ):
+            pacer = RequestPacer()
+        pacer.record_loss()
+        assert pacer.rate == 2
+        pacer.record_loss()
+        assert pacer.rate == 1.5
+
+    def test_pacer_kept_per_host(self):
+        """Test the socket hands out one pacer per host."""
+        udp_socket = MarstekSocket(30000)
+
+        assert udp_socket.pacer("192.168.1.100") is udp_socket.pacer("192.168.1.100")
+        assert udp_socket.pacer("192.168.1.100") is not udp_socket.pacer("192.168.1.101")
+
+
+class TestRttEstimator:
+    """Test the round trip time estimator."""
+
+    def test_initial_timeout(self):
+        """Test the default timeout is used until a round trip is measured."""
+        with patch("custom_components.marstek_local_api.api.REQUEST_TIMEOUT", 2.0):
+            rtt = RttEstimator(0.5, 5.0)
+
+        assert rtt.timeout == 2.0
+        assert rtt.srtt is None
+
+    def test_first_sample(self):
+        """Test the first sample sets the estimate as in RFC 6298."""
+        rtt = RttEstimator(0.1, 5.0)
+
+        rtt.sample(0.2)
+
+        assert rtt.srtt == pytest.approx(0.2)
+        assert rtt.rttvar == pytest.approx(0.1)
+        assert rtt.timeout == pytest.approx(0.6)
+
+    def test_smoothing(self):
+        """Test later samples are averaged in."""
+        rtt = RttEstimator(0.01, 5.0)
+        rtt.sample(0.2)
+
+        rtt.sample(0.4)
+
+        assert rtt.rttvar == pytest.approx(0.75 * 0.1 + 0.25 * 0.2)
+        assert rtt.srtt == pytest.approx(0.875 * 0.2 + 0.125 * 0.4)
+        assert rtt.timeout == pytest.approx(rtt.srtt + 4 * rtt.rttvar)
+
+    def test_timeout_clamped(self):
+        """Test the timeout stays between the floor and the ceiling."""
+        fast = RttEstimator(0.5, 5.0)
+        fast.sample(0.01)
+        slow = RttEstimator(0.5, 5.0)
+        slow.sample(3.0)
+
+        assert fast.timeout == 0.5
+        assert slow.timeout == 5.0
+
+    def test_backoff(self):
+        """Test a backoff doubles the timeout up to the ceiling."""
+        rtt = RttEstimator(0.5, 5.0)
+        rtt.sample(0.5)
+
+        assert rtt.timeout == pytest.approx(1.5)
+
+        rtt.backoff()
+        assert rtt.timeout == pytest.approx(3.0)
+        rtt.backoff()
+        assert rtt.timeout == 5.0
+
+
+class TestRequestRegistry:
+    """Test the in-flight request table."""
+
+    @pytest.mark.asyncio
+    async def test_late_reply_rejected(self):
+        """Test a reply for a request that already timed out is dropped."""
+        registry = RequestRegistry()
+        request_id, future = registry.register("192.168.1.100", 0.05)
+        registry.discard("192.168.1.100", request_id)
+
+        assert registry.resolve("192.168.1.100", {"id": request_id}) is False
+        assert not future.done()
+        assert registry.rejected == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_reply_rejected(self):
+        """Test a reply arriving after its deadline is dropped."""
+        registry = RequestRegistry()
+        request_id, future = registry.register("192.168.1.100", 0)
+        await asyncio.sleep(0.01)
+
+        assert registry.resolve("192.168.1.100", {"id": request_id}) is False
+        assert not future.done()
+        assert len(registry) == 0
+
+    @pytest.mark.asyncio
+    async def test_duplicate_reply_rejected(self):
+        """Test only the first reply for a request is accepted."""
+        registry = RequestRegistry()
+        request_id, future = registry.register("192.168.1.100", 1)
+
+        assert registry.resolve("192.168.1.100", {"id": request_id, "result": 1})
+        assert not registry.resolve("192.168.1.100", {"id": request_id, "result": 2})
+        assert future.result() == {"id": request_id, "result": 1}
+        assert registry.rejected == 1
+
+    @pytest.mark.asyncio
+    async def test_reply_from_other_host_rejected(self):
+        """Test a reply is only accepted from the host the request went to."""
+        registry = RequestRegistry()
+        request_id, future = registry.register("192.168.1.100", 1)
+
+        assert registry.resolve("192.168.1.101", {"id": request_id}) is False
+        assert not future.done()
+        assert len(registry) == 1
+
+    @pytest.mark.asyncio
+    async def test_ids_wrap_around(self):
+        """Test ids restart at one after the maximum."""
+        registry = RequestRegistry()
+        registry._last_id = MAX_REQUEST_ID
+
+        request_id, _ = registry.register("192.168.1.100", 1)
+
+        assert request_id == 1
@@ -0,0 +1,45 @@
+"""Tests for the Marstek Local API diagnostics."""
+import os
+import sys
+
+import pytest
+from homeassistant.const import CONF_HOST
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api.api import MarstekDevice
+from custom_components.marstek_local_api.const import DOMAIN
+from custom_components.marstek_local_api.coordinator import MarstekCoordinator
+from custom_components.marstek_local_api.diagnostics import (
+    async_get_config_entry_diagnostics,
+)
+
+
+@pytest.mark.asyncio
+async def test_config_entry_diagnostics(hass, mock_config_entry):
+    """Test diagnostics expose the round trip estimate and redact the host."""
+    device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus", "PV.GetStatus"])
+    device.rtt.sample(0.2)
+    coordinator = MarstekCoordinator(hass, device, 10)
+    coordinator.capabilities.unsupported = {"PV.GetStatus": 0}
+    coordinator._replan()
+    hass.data[DOMAIN] = {
+        mock_config_entry.entry_id: {
+            "coordinator": coordinator,
+            "coordinators": [coordinator],
+        }
+    }
+
+    result = await async_get_config_entry_diagnostics(hass, mock_config_entry)
+
+    assert result["entry"][CONF_HOST] == "**REDACTED**"
+    assert result["update_interval"] == 30
+    assert result["device"]["rtt"]["srtt"] == pytest.approx(0.2)
+    assert result["device"]["rtt"]["timeout"] == pytest.approx(0.6)
+    assert result["device"]["rejected_replies"] == 0
+    assert result["breaker"] == {"open": False, "failures": 0, "retry_at": None}
+    assert result["polled_methods"] == ["Bat.GetStatus"]
+    assert result["unsupported_methods"] == ["PV.GetStatus"]
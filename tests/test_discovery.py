@@ -0,0 +1,95 @@
+"""Tests for finding Marstek devices on the local network."""
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api.api import MarstekSocket
+from custom_components.marstek_local_api.const import DATA_SOCKETS
+from custom_components.marstek_local_api.discovery import (
+    DiscoveredDevice,
+    async_discover,
+    async_get_subnet_hosts,
+)
+
+
+@pytest.mark.asyncio
+async def test_subnet_hosts(hass):
+    """Test the sweep covers at most a /24 of every enabled adapter."""
+    adapters = [
+        {
+            "enabled": True,
+            "ipv4": [{"address": "10.1.2.3", "network_prefix": 16}],
+        },
+        {
+            "enabled": False,
+            "ipv4": [{"address": "192.168.5.1", "network_prefix": 24}],
+        },
+    ]
+    with patch(
+        "custom_components.marstek_local_api.discovery.async_get_adapters",
+        AsyncMock(return_value=adapters),
+    ):
+        hosts = await async_get_subnet_hosts(hass)
+
+    assert len(hosts) == 253
+    assert hosts[0] == "10.1.2.1"
+    assert "10.1.2.3" not in hosts
+
+
+@pytest.mark.asyncio
+async def test_discover_devices_that_answer(hass):
+    """Test answering hosts are returned with model, MAC and response time."""
+    in_flight = 0
+    peak = 0
+
+    async def request(self, addr, method, timeout):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        if addr[0] == "10.0.0.7":
+            return {"id": 1, "result": {"device": "VenusE", "ble_mac": "aabbcc"}}
+        if addr[0] == "10.0.0.3":
+            return {"id": 1, "error": {"code": -32601}}
+        raise asyncio.TimeoutError
+
+    hosts = [f"10.0.0.{i}" for i in range(1, 101)]
+    with patch.object(MarstekSocket, "async_open", AsyncMock()), patch.object(
+        MarstekSocket, "request", request
+    ), patch("custom_components.marstek_local_api.discovery.DISCOVERY_CONCURRENCY", 8):
+        devices = await async_discover(hass, 30000, hosts)
+
+    assert [device.host for device in devices] == ["10.0.0.3", "10.0.0.7"]
+    assert devices[0].mac is None
+    assert devices[1].model == "VenusE"
+    assert devices[1].mac == "aabbcc"
+    assert devices[1].rtt >= 0
+    assert peak == 8
+    # The shared socket is released again
+    assert 30000 not in hass.data[DATA_SOCKETS]
+
+
+@pytest.mark.asyncio
+async def test_discover_socket_failure(hass):
+    """Test a port that cannot be bound finds nothing."""
+    with patch.object(
+        MarstekSocket, "async_open", AsyncMock(side_effect=OSError("in use"))
+    ):
+        assert await async_discover(hass, 30000, ["10.0.0.1"]) == []
+
+
+def test_discovered_device_is_frozen():
+    """Test found devices cannot be changed afterwards."""
+    device = DiscoveredDevice("10.0.0.7", 0.01)
+
+    with pytest.raises(AttributeError):
+        device.host = "10.0.0.8"
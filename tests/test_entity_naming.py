@@ -1,6 +1,7 @@
 """Test the entity naming with device name."""
 import os
 import sys
+from unittest.mock import Mock
 
 import pytest
 
@@ -9,20 +10,26 @@ project_root = os.path.dirname(os.path.dirname(__file__))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from custom_components.marstek_local_api.coordinator import MarstekCoordinator
+from custom_components.marstek_local_api.descriptions import (
+    MarstekSensorEntityDescription,
+)
 from custom_components.marstek_local_api.sensor import MarstekBaseSensor, MarstekDevice
 
 
 def test_entity_naming_with_device_name():
     """Test that entity names include the device name."""
     device_name = "My Custom Battery"
-    device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10, device_name)
+    device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], device_name)
     
     sensor = MarstekBaseSensor(
-        device=device,
-        method="Bat.GetStatus",
-        key="soc",
-        name="Battery SOC",
-        unit="%"
+        coordinator=Mock(spec=MarstekCoordinator, device=device),
+        description=MarstekSensorEntityDescription(
+            method="Bat.GetStatus",
+            key="soc",
+            name="Battery SOC",
+            native_unit_of_measurement="%",
+        ),
     )
     
     # Test that the sensor name includes the device name
@@ -35,14 +42,16 @@ def test_entity_naming_with_device_name():
 
 def test_entity_naming_with_default_device_name():
     """Test that entity names work with default device name."""
-    device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"], 10)  # No device name provided
+    device = MarstekDevice("192.168.1.100", 30000, ["Bat.GetStatus"])  # No device name provided
     
     sensor = MarstekBaseSensor(
-        device=device,
-        method="Bat.GetStatus", 
-        key="soc",
-        name="Battery SOC",
-        unit="%"
+        coordinator=Mock(spec=MarstekCoordinator, device=device),
+        description=MarstekSensorEntityDescription(
+            method="Bat.GetStatus",
+            key="soc",
+            name="Battery SOC",
+            native_unit_of_measurement="%",
+        ),
     )
     
     # Test with default device name
@@ -53,13 +62,15 @@ def test_entity_naming_with_default_device_name():
 def test_entity_naming_with_spaces_and_special_chars():
     """Test entity naming handles spaces and special characters."""
     device_name = "Kitchen Battery #1"
-    device = MarstekDevice("192.168.1.100", 30000, ["Wifi.GetStatus"], 10, device_name)
+    device = MarstekDevice("192.168.1.100", 30000, ["Wifi.GetStatus"], device_name)
     
     sensor = MarstekBaseSensor(
-        device=device,
-        method="Wifi.GetStatus",
-        key="ssid", 
-        name="WiFi SSID"
+        coordinator=Mock(spec=MarstekCoordinator, device=device),
+        description=MarstekSensorEntityDescription(
+            method="Wifi.GetStatus",
+            key="ssid",
+            name="WiFi SSID",
+        ),
     )
     
     # Test that spaces are converted to underscores in unique_id but preserved in name
@@ -1,12 +1,20 @@
 """Tests for the Marstek Local API integration init module."""
+import asyncio
 import os
 import sys
+import time
+from datetime import timedelta
 from unittest.mock import AsyncMock, patch
 
 import pytest
-from homeassistant.const import CONF_HOST, CONF_PORT
+from homeassistant.const import CONF_HOST, CONF_PORT, CONF_SCAN_INTERVAL
 from homeassistant.core import HomeAssistant
-from pytest_homeassistant_custom_component.common import MockConfigEntry
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.util import dt as dt_util
+from pytest_homeassistant_custom_component.common import (
+    MockConfigEntry,
+    async_fire_time_changed,
+)
 
 # Add the project root to Python path
 project_root = os.path.dirname(os.path.dirname(__file__))
@@ -15,10 +23,28 @@ if project_root not in sys.path:
 
 from custom_components.marstek_local_api import (
     DOMAIN,
+    async_remove_entry,
     async_setup,
     async_setup_entry,
     async_unload_entry,
 )
+from custom_components.marstek_local_api.const import (
+    CONF_DOMAINS,
+    CONF_HOSTS,
+    CONF_TIMEOUT_MAX,
+    DATA_SOCKETS,
+    SIGNAL_METHODS_CHANGED,
+    STORE_DELAY,
+)
+
+
+@pytest.fixture(autouse=True)
+def mock_refresh():
+    """Avoid polling a real device during entry setup."""
+    with patch(
+        "custom_components.marstek_local_api.MarstekCoordinator.async_refresh"
+    ) as mock_refresh:
+        yield mock_refresh
 
 
 class TestIntegrationSetup:
@@ -32,10 +58,20 @@ class TestIntegrationSetup:
         assert result is True
 
     @pytest.mark.asyncio
-    async def test_async_setup_entry_success(self, hass: HomeAssistant, mock_config_entry):
+    async def test_async_setup_entry_success(
+        self, hass: HomeAssistant, mock_config_entry, mock_refresh
+    ):
         """Test successful config entry setup."""
         # Ensure hass.data[DOMAIN] exists
         hass.data.setdefault(DOMAIN, {})
+        release = asyncio.Event()
+        refreshed = []
+
+        async def _async_refresh():
+            await release.wait()
+            refreshed.append(True)
+
+        mock_refresh.side_effect = _async_refresh
 
         with patch("homeassistant.config_entries.ConfigEntries.async_forward_entry_setups") as mock_forward:
             mock_forward.return_value = True
@@ -52,6 +88,15 @@ class TestIntegrationSetup:
             assert stored_data["host"] == mock_config_entry.data[CONF_HOST]
             assert stored_data["port"] == mock_config_entry.data[CONF_PORT]
             
+            # Check that a coordinator was created and refreshed in the background
+            assert stored_data["coordinator"].device._host == "192.168.1.100"
+            # Setup returned while the first refresh still waits for the device
+            assert refreshed == []
+            release.set()
+            await hass.async_block_till_done()
+            assert refreshed == [True]
+            mock_refresh.assert_called_once()
+
             # Check that platform setup was called
             mock_forward.assert_called_once_with(mock_config_entry, ["sensor"])
 
@@ -266,4 +311,186 @@ class TestIntegrationSetup:
             await async_unload_entry(hass, mock_config_entry)
 
             # Should unload the same sensor platform
-            mock_unload.assert_called_once_with(mock_config_entry, ["sensor"])
\ No newline at end of file
+            mock_unload.assert_called_once_with(mock_config_entry, ["sensor"])
+
+    @pytest.mark.asyncio
+    async def test_entries_share_socket_per_port(self, hass: HomeAssistant):
+        """Test entries on the same port share one socket until the last unloads."""
+        entry1 = MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.100", CONF_PORT: 30000},
+            entry_id="entry1",
+        )
+        entry2 = MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.101", CONF_PORT: 30000},
+            entry_id="entry2",
+        )
+        entry3 = MockConfigEntry(
+            domain=DOMAIN,
+            data={CONF_HOST: "192.168.1.102", CONF_PORT: 30001},
+            entry_id="entry3",
+        )
+
+        with patch("homeassistant.config_entries.ConfigEntries.async_forward_entry_setups"):
+            for entry in (entry1, entry2, entry3):
+                await async_setup_entry(hass, entry)
+
+        devices = [
+            hass.data[DOMAIN][entry_id]["coordinator"].device
+            for entry_id in ("entry1", "entry2", "entry3")
+        ]
+        assert devices[0]._socket is devices[1]._socket
+        assert devices[0]._socket is not devices[2]._socket
+        assert hass.data[DATA_SOCKETS][30000].users == 2
+
+        with patch(
+            "homeassistant.config_entries.ConfigEntries.async_unload_platforms",
+            return_value=True,
+        ):
+            await async_unload_entry(hass, entry1)
+            assert hass.data[DATA_SOCKETS][30000].users == 1
+
+            await async_unload_entry(hass, entry2)
+            assert 30000 not in hass.data[DATA_SOCKETS]
+            assert 30001 in hass.data[DATA_SOCKETS]
+
+    @pytest.mark.asyncio
+    async def test_setup_restores_last_known_values(
+        self, hass: HomeAssistant, hass_storage, mock_config_entry
+    ):
+        """Test entities start from the stored values before the first poll."""
+        key = f"{DOMAIN}.{mock_config_entry.entry_id}"
+        updated_at = time.time() - 600
+        hass_storage[key] = {
+            "version": 1,
+            "key": key,
+            "data": {
+                "data": {"Bat.GetStatus": {"soc": 85}},
+                "updated_at": {"Bat.GetStatus": updated_at},
+            },
+        }
+
+        with patch("homeassistant.config_entries.ConfigEntries.async_forward_entry_setups"):
+            await async_setup_entry(hass, mock_config_entry)
+
+        coordinator = hass.data[DOMAIN][mock_config_entry.entry_id]["coordinator"]
+        assert coordinator.data["Bat.GetStatus"]["soc"] == 85
+        assert coordinator.snapshot.updated_at["Bat.GetStatus"] == updated_at
+        assert not coordinator.is_stale("Bat.GetStatus")
+
+    @pytest.mark.asyncio
+    async def test_unload_writes_last_known_values(
+        self, hass: HomeAssistant, hass_storage, mock_config_entry
+    ):
+        """Test unloading writes the values at once instead of delayed."""
+        key = f"{DOMAIN}.{mock_config_entry.entry_id}"
+        with patch("homeassistant.config_entries.ConfigEntries.async_forward_entry_setups"):
+            await async_setup_entry(hass, mock_config_entry)
+        coordinator = hass.data[DOMAIN][mock_config_entry.entry_id]["coordinator"]
+        coordinator.device._publish({"Bat.GetStatus": {"soc": 70}})
+        coordinator._async_schedule_save()
+
+        with patch(
+            "homeassistant.config_entries.ConfigEntries.async_unload_platforms",
+            return_value=True,
+        ):
+            await async_unload_entry(hass, mock_config_entry)
+
+        assert hass_storage[key]["data"]["data"] == {"Bat.GetStatus": {"soc": 70}}
+
+        # The delayed write was dropped with the unload, it would store these
+        coordinator.device._publish({"Bat.GetStatus": {"soc": 20}})
+        async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=STORE_DELAY + 1))
+        await hass.async_block_till_done()
+        assert hass_storage[key]["data"]["data"] == {"Bat.GetStatus": {"soc": 70}}
+
+    @pytest.mark.asyncio
+    async def test_async_remove_entry_deletes_store(
+        self, hass: HomeAssistant, hass_storage, mock_config_entry
+    ):
+        """Test removing an entry drops its stored values."""
+        key = f"{DOMAIN}.{mock_config_entry.entry_id}"
+        hass_storage[key] = {"version": 1, "key": key, "data": {}}
+
+        await async_remove_entry(hass, mock_config_entry)
+
+        assert key not in hass_storage
+
+    @pytest.mark.asyncio
+    async def test_hub_entry_sets_up_every_host(self, hass: HomeAssistant):
+        """Test a hub entry polls each host as a device of one fleet."""
+        entry = MockConfigEntry(
+            domain=DOMAIN,
+            data={
+                CONF_HOST: "192.168.1.100,192.168.1.101",
+                CONF_HOSTS: ["192.168.1.100", "192.168.1.101"],
+                CONF_PORT: 30000,
+            },
+            entry_id="hub",
+        )
+
+        with patch("homeassistant.config_entries.ConfigEntries.async_forward_entry_setups"):
+            await async_setup_entry(hass, entry)
+
+        coordinators = hass.data[DOMAIN]["hub"]["coordinators"]
+        devices = [coordinator.device for coordinator in coordinators]
+        assert [device._host for device in devices] == ["192.168.1.100", "192.168.1.101"]
+        assert [device._device_name for device in devices] == [
+            "Marstek Battery 1",
+            "Marstek Battery 2",
+        ]
+        assert devices[0]._limiter is devices[1]._limiter is not None
+        assert coordinators[0].fleet is coordinators[1].fleet
+        assert [coordinator._fleet_index for coordinator in coordinators] == [0, 1]
+        assert hass.data[DATA_SOCKETS][30000].users == 2
+
+        with patch(
+            "homeassistant.config_entries.ConfigEntries.async_unload_platforms",
+            return_value=True,
+        ):
+            await async_unload_entry(hass, entry)
+        assert 30000 not in hass.data[DATA_SOCKETS]
+
+    @pytest.mark.asyncio
+    async def test_options_applied_without_reload(
+        self, hass: HomeAssistant, mock_config_entry, mock_refresh
+    ):
+        """Test changed options reach the running poller in place."""
+        mock_config_entry.add_to_hass(hass)
+        with patch("homeassistant.config_entries.ConfigEntries.async_forward_entry_setups"):
+            await async_setup_entry(hass, mock_config_entry)
+        await hass.async_block_till_done()
+        mock_refresh.reset_mock()
+        entry_data = hass.data[DOMAIN][mock_config_entry.entry_id]
+        coordinator = entry_data["coordinator"]
+        changes = []
+        remove = async_dispatcher_connect(
+            hass,
+            SIGNAL_METHODS_CHANGED.format(mock_config_entry.entry_id),
+            lambda added, removed: changes.append((added, removed)),
+        )
+
+        with patch(
+            "homeassistant.config_entries.ConfigEntries.async_reload"
+        ) as mock_reload:
+            hass.config_entries.async_update_entry(
+                mock_config_entry,
+                options={
+                    CONF_SCAN_INTERVAL: 60,
+                    CONF_DOMAINS: ["Bat.GetStatus", "ES.GetStatus"],
+                    CONF_TIMEOUT_MAX: 1.0,
+                },
+            )
+            await hass.async_block_till_done()
+        remove()
+
+        mock_reload.assert_not_called()
+        # The new plan is polled right away
+        mock_refresh.assert_called_once()
+        assert hass.data[DOMAIN][mock_config_entry.entry_id]["coordinator"] is coordinator
+        assert coordinator.device._methods == ["Bat.GetStatus", "ES.GetStatus"]
+        assert coordinator.device.rtt.timeout_max == 1.0
+        assert coordinator.burst.idle_interval == 60
+        assert set(coordinator.scheduler._intervals) == {"Bat.GetStatus", "ES.GetStatus"}
+        assert changes == [(["ES.GetStatus"], ["Wifi.GetStatus"])]
@@ -0,0 +1,95 @@
+"""Tests for the connection probe."""
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api.api import MarstekDevice
+from custom_components.marstek_local_api.const import DATA_SOCKETS
+from custom_components.marstek_local_api.probe import ProbeResult, async_probe
+
+
+class TestProbeResult:
+    """Test the settings recommended from a probe."""
+
+    def test_reliable_methods(self):
+        """Test only methods answered often enough are recommended."""
+        result = ProbeResult(
+            {"ES.GetStatus": 1.0, "Bat.GetStatus": 2 / 3, "PV.GetStatus": 1 / 3}
+        )
+
+        assert result.methods == ["ES.GetStatus", "Bat.GetStatus"]
+
+    def test_fast_device_gets_shortest_interval(self):
+        """Test a quick, loss free device is polled at the fastest rate."""
+        assert ProbeResult(loss=0.0, cycle_time=0.3).scan_interval == 5
+
+    def test_interval_fits_slowest_round(self):
+        """Test the slowest round fits in the cycle budget of the interval."""
+        assert ProbeResult(loss=0.0, cycle_time=4.5).scan_interval == 10
+
+    def test_loss_lengthens_interval(self):
+        """Test every step of loss moves one interval up."""
+        assert ProbeResult(loss=0.1, cycle_time=0.3).scan_interval == 10
+        assert ProbeResult(loss=0.25, cycle_time=0.3).scan_interval == 15
+
+    def test_interval_capped(self):
+        """Test a very slow device gets the longest interval."""
+        assert ProbeResult(loss=1.0, cycle_time=1000).scan_interval == 300
+
+
+@pytest.mark.asyncio
+async def test_async_probe(hass):
+    """Test reliability, loss and cycle time are measured over the rounds."""
+    rounds = iter(
+        [
+            ({"ES.GetStatus", "Bat.GetStatus"}, {}),
+            ({"ES.GetStatus"}, {"PV.GetStatus": "-32601"}),
+            ({"ES.GetStatus", "Bat.GetStatus"}, {"PV.GetStatus": "-32601"}),
+        ]
+    )
+
+    async def async_update(self, methods=None):
+        answered, self.last_errors = next(rounds)
+        return answered
+
+    with patch.object(MarstekDevice, "async_update", async_update):
+        result = await async_probe(
+            hass,
+            "192.168.1.100",
+            30000,
+            ["ES.GetStatus", "Bat.GetStatus", "PV.GetStatus"],
+        )
+
+    assert result.reliability == {
+        "ES.GetStatus": 1.0,
+        "Bat.GetStatus": 2 / 3,
+        "PV.GetStatus": 0.0,
+    }
+    # PV is silent once and rejected twice, Bat silent once
+    assert result.loss == pytest.approx(2 / 9)
+    assert result.methods == ["ES.GetStatus", "Bat.GetStatus"]
+    assert 30000 not in hass.data[DATA_SOCKETS]
+
+
+@pytest.mark.asyncio
+async def test_async_probe_ignores_never_heard_methods(hass):
+    """Test silence of a method that never replied is not counted as loss."""
+
+    async def async_update(self, methods=None):
+        self.last_errors = {}
+        return {"ES.GetStatus"}
+
+    with patch.object(MarstekDevice, "async_update", async_update):
+        result = await async_probe(
+            hass, "192.168.1.100", 30000, ["ES.GetStatus", "PV.GetStatus"]
+        )
+
+    assert result.loss == 0.0
+    assert result.methods == ["ES.GetStatus"]
@@ -0,0 +1,354 @@
+"""Tests for PollScheduler."""
+import os
+import sys
+from unittest.mock import patch
+
+# Add the project root to Python path
+project_root = os.path.dirname(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from custom_components.marstek_local_api.scheduler import (
+    BurstController,
+    CapabilityTracker,
+    CircuitBreaker,
+    FleetScheduler,
+    PollScheduler,
+)
+
+
+class TestPollScheduler:
+    """Test per-method poll planning."""
+
+    def test_interval_is_shortest_method_interval(self):
+        """Test the tick follows the fastest method."""
+        scheduler = PollScheduler(
+            {"ES.GetStatus": 5, "Bat.GetStatus": 30, "Wifi.GetStatus": 600}
+        )
+
+        assert scheduler.interval == 5
+
+    def test_interval_without_methods(self):
+        """Test an empty plan has no interval and nothing due."""
+        scheduler = PollScheduler({})
+
+        assert scheduler.interval is None
+        assert scheduler.due(100.0) == []
+
+    def test_everything_due_initially(self):
+        """Test all methods are requested in the first cycle."""
+        scheduler = PollScheduler({"ES.GetStatus": 5, "Wifi.GetStatus": 600})
+
+        assert scheduler.due(1000.0) == ["ES.GetStatus", "Wifi.GetStatus"]
+
+    def test_methods_follow_their_own_interval(self):
+        """Test slow methods are only requested when their interval passed."""
+        scheduler = PollScheduler(
+            {"ES.GetStatus": 5, "Bat.GetStatus": 30, "Wifi.GetStatus": 600}
+        )
+        scheduler.mark_polled(["ES.GetStatus", "Bat.GetStatus", "Wifi.GetStatus"], 0.0)
+
+        polls = {"ES.GetStatus": 0, "Bat.GetStatus": 0, "Wifi.GetStatus": 0}
+        for tick in range(1, 121):
+            now = tick * 5.0
+            due = scheduler.due(now)
+            scheduler.mark_polled(due, now)
+            for method in due:
+                polls[method] += 1
+
+        assert polls == {"ES.GetStatus": 120, "Bat.GetStatus": 20, "Wifi.GetStatus": 1}
+
+    def test_late_tick_merges_nearly_due_method(self):
+        """Test a method due just after a tick joins that tick's cycle."""
+        scheduler = PollScheduler({"ES.GetStatus": 5, "Bat.GetStatus": 30})
+        scheduler.mark_polled(["ES.GetStatus", "Bat.GetStatus"], 0.0)
+
+        assert scheduler.due(29.9) == ["ES.GetStatus", "Bat.GetStatus"]
+
+    def test_unanswered_method_stays_due(self):
+        """Test methods that were not marked polled are requested again."""
+        scheduler = PollScheduler({"ES.GetStatus": 5, "Wifi.GetStatus": 600})
+        scheduler.mark_polled(["ES.GetStatus"], 0.0)
+
+        assert scheduler.due(5.0) == ["ES.GetStatus", "Wifi.GetStatus"]
+
+    def test_set_intervals_counts_from_last_poll(self):
+        """Test a shorter interval pulls the next request forward."""
+        scheduler = PollScheduler({"ES.GetStatus": 30, "Wifi.GetStatus": 600})
+        scheduler.mark_polled(["ES.GetStatus", "Wifi.GetStatus"], 0.0)
+
+        scheduler.set_intervals({"ES.GetStatus": 5, "Wifi.GetStatus": 600})
+
+        assert scheduler.interval == 5
+        assert scheduler.due(5.0) == ["ES.GetStatus"]
+
+    def test_set_intervals_replaces_methods(self):
+        """Test methods can leave the plan and come back."""
+        scheduler = PollScheduler({"ES.GetStatus": 5, "PV.GetStatus": 5})
+        scheduler.mark_polled(["ES.GetStatus", "PV.GetStatus"], 0.0)
+
+        scheduler.set_intervals({"ES.GetStatus": 5})
+        assert scheduler.due(5.0) == ["ES.GetStatus"]
+
+        scheduler.set_intervals(
+            {"ES.GetStatus": 5, "PV.GetStatus": 5, "BLE.GetStatus": 600}
+        )
+        assert scheduler.due(5.0) == ["ES.GetStatus", "PV.GetStatus", "BLE.GetStatus"]
+
+
+class TestCapabilityTracker:
+    """Test learning which methods a device supports."""
+
+    def test_rejected_method_unsupported_at_once(self):
+        """Test a method-not-found error drops the method right away."""
+        tracker = CapabilityTracker(misses=3, reprobe=3600)
+
+        changed = tracker.update(
+            ["ES.GetStatus", "PV.GetStatus"], {"ES.GetStatus"}, {"PV.GetStatus"}, 0
+        )
+
+        assert changed
+        assert set(tracker.unsupported) == {"PV.GetStatus"}
+
+    def test_silent_method_unsupported_after_misses(self):
+        """Test a method unanswered in consecutive live cycles is dropped."""
+        tracker = CapabilityTracker(misses=3, reprobe=3600)
+        methods = ["ES.GetStatus", "PV.GetStatus"]
+
+        assert not tracker.update(methods, {"ES.GetStatus"}, set(), 0)
+        assert not tracker.update(methods, {"ES.GetStatus"}, set(), 10)
+        assert tracker.update(methods, {"ES.GetStatus"}, set(), 20)
+        assert set(tracker.unsupported) == {"PV.GetStatus"}
+
+    def test_silent_device_teaches_nothing(self):
+        """Test cycles without any answer do not count as misses."""
+        tracker = CapabilityTracker(misses=1, reprobe=3600)
+
+        assert not tracker.update(["PV.GetStatus"], set(), set(), 0)
+        assert tracker.unsupported == {}
+
+    def test_miss_judged_against_latest_answer(self):
+        """Test a cycle of only silent methods counts while the device is up."""
+        tracker = CapabilityTracker(misses=3, reprobe=3600)
+        tracker.update(["Wifi.GetStatus", "PV.GetStatus"], {"Wifi.GetStatus"}, set(), 0)
+
+        assert not tracker.update(["PV.GetStatus"], set(), set(), 30, horizon=600)
+        assert tracker.update(["PV.GetStatus"], set(), set(), 60, horizon=600)
+        assert set(tracker.unsupported) == {"PV.GetStatus"}
+
+    def test_no_miss_without_recent_answer(self):
+        """Test silence long after the last answer teaches nothing."""
+        tracker = CapabilityTracker(misses=1, reprobe=3600)
+        tracker.update(["Wifi.GetStatus"], {"Wifi.GetStatus"}, set(), 0)
+
+        assert not tracker.update(["PV.GetStatus"], set(), set(), 601, horizon=600)
+        assert tracker.unsupported == {}
+
+    def test_no_miss_when_answered_method_silent(self):
+        """Test a method that answered before going silent means the device is."""
+        tracker = CapabilityTracker(misses=1, reprobe=3600)
+        tracker.update(["ES.GetStatus"], {"ES.GetStatus"}, set(), 0)
+
+        assert not tracker.update(["ES.GetStatus", "PV.GetStatus"], set(), set(), 10)
+        assert tracker.unsupported == {}
+        assert tracker.has_answered(["ES.GetStatus"])
+        assert not tracker.has_answered(["PV.GetStatus"])
+
+    def test_error_reply_is_not_a_miss(self):
+        """Test a method answered with another error is known to the device."""
+        tracker = CapabilityTracker(misses=1, reprobe=3600)
+        methods = ["ES.GetStatus", "PV.GetStatus"]
+
+        for now in (0, 10, 20):
+            assert not tracker.update(
+                methods, {"ES.GetStatus"}, set(), now, errored={"PV.GetStatus"}
+            )
+        assert tracker.unsupported == {}
+
+    def test_reprobe(self):
+        """Test unsupported methods are probed again and can come back."""
+        tracker = CapabilityTracker(misses=1, reprobe=3600)
+        tracker.update(["ES.GetStatus", "PV.GetStatus"], {"ES.GetStatus"}, set(), 0)
+
+        assert tracker.reprobe_due(3599) == []
+        assert tracker.reprobe_due(3600) == ["PV.GetStatus"]
+
+        # Still silent: the next probe is an interval later
+        assert not tracker.update(["PV.GetStatus"], {"ES.GetStatus"}, set(), 3600)
+        assert tracker.reprobe_due(3600) == []
+
+        # A silent reprobe moves the next one on as well
+        assert not tracker.update(["PV.GetStatus"], set(), set(), 7200)
+        assert tracker.reprobe_due(7200) == []
+
+        assert tracker.update(["PV.GetStatus"], {"PV.GetStatus"}, set(), 10800)
+        assert tracker.unsupported == {}
+
+
+class TestBurstController:
+    """Test adaptive burst polling."""
+
+    IDLE = {
+        "Bat.GetStatus": {"charg_flag": 0, "dischrg_flag": 0},
+        "ES.GetStatus": {"bat_power": 0, "ongrid_power": 100},
+    }
+
+    def _with(self, method, **values):
+        data = {m: dict(v) for m, v in self.IDLE.items()}
+        data[method].update(values)
+        return data
+
+    def test_starts_idle(self):
+        """Test the controller starts at the idle interval."""
+        burst = BurstController(60, burst_interval=5, hold=120, threshold=50)
+
+        assert burst.interval == 60
+        assert not burst.active
+
+    def test_flag_flip_starts_burst(self):
+        """Test a charge flag flip switches to the burst interval."""
+        burst = BurstController(60, burst_interval=5, hold=120, threshold=50)
+
+        interval = burst.update(self.IDLE, self._with("Bat.GetStatus", charg_flag=1), 0)
+
+        assert interval == 5
+        assert burst.active
+
+    def test_power_swing_starts_burst(self):
+        """Test a power move beyond the threshold switches to bursting."""
+        burst = BurstController(60, burst_interval=5, hold=120, threshold=50)
+
+        assert (
+            burst.update(self.IDLE, self._with("ES.GetStatus", bat_power=40), 0) == 60
+        )
+        assert (
+            burst.update(self.IDLE, self._with("ES.GetStatus", ongrid_power=-400), 0)
+            == 5
+        )
+
+    def test_first_reading_does_not_start_burst(self):
+        """Test missing previous data is not mistaken for activity."""
+        burst = BurstController(60, burst_interval=5, hold=120, threshold=50)
+
+        assert burst.update({}, self.IDLE, 0) == 60
+
+    def test_decays_back_to_idle(self):
+        """Test the interval doubles back to idle once readings settle."""
+        burst = BurstController(60, burst_interval=5, hold=120, threshold=50)
+        burst.update(self.IDLE, self._with("Bat.GetStatus", dischrg_flag=1), 0)
+
+        # Still within the hold time
+        assert burst.update(self.IDLE, self.IDLE, 100) == 5
+        # Settled: 10, 20, 40, then capped at the idle rate
+        intervals = [burst.update(self.IDLE, self.IDLE, 120 + i) for i in range(5)]
+
+        assert intervals == [10, 20, 40, 60, 60]
+        assert not burst.active
+
+    def test_set_idle_interval_ends_burst(self):
+        """Test a new idle interval applies at once, also mid burst."""
+        burst = BurstController(60, burst_interval=5, hold=120, threshold=50)
+        burst.update(self.IDLE, self._with("Bat.GetStatus", charg_flag=1), 0)
+
+        burst.set_idle_interval(3)
+
+        assert burst.interval == 3
+        assert not burst.active
+        assert (
+            burst.update(self.IDLE, self._with("Bat.GetStatus", charg_flag=0), 1) == 3
+        )
+
+    def test_burst_never_slower_than_idle(self):
+        """Test a burst interval above the scan interval has no effect."""
+        burst = BurstController(3, burst_interval=5, hold=120, threshold=50)
+
+        assert (
+            burst.update(self.IDLE, self._with("Bat.GetStatus", charg_flag=1), 0) == 3
+        )
+
+
+class TestCircuitBreaker:
+    """Test the breaker that stops polling unresponsive devices."""
+
+    def test_opens_after_threshold(self):
+        """Test only consecutive failures up to the threshold open it."""
+        breaker = CircuitBreaker(threshold=3, base_delay=30, max_delay=900)
+
+        breaker.record_failure(0)
+        breaker.record_failure(1)
+        assert not breaker.is_open
+        assert breaker.allow(1)
+
+        breaker.record_failure(2)
+        assert breaker.is_open
+        assert 17 <= breaker.retry_at <= 32
+
+    def test_success_resets_failures(self):
+        """Test an answer in between starts the count over."""
+        breaker = CircuitBreaker(threshold=2, base_delay=30, max_delay=900)
+
+        breaker.record_failure(0)
+        breaker.record_success()
+        breaker.record_failure(1)
+
+        assert not breaker.is_open
+        assert breaker.failures == 1
+
+    def test_probe_delay_doubles_with_jitter(self):
+        """Test each failed probe doubles the delay up to the maximum."""
+        breaker = CircuitBreaker(threshold=1, base_delay=30, max_delay=100)
+
+        with patch(
+            "custom_components.marstek_local_api.scheduler.random.uniform",
+            side_effect=lambda low, high: high,
+        ):
+            delays = []
+            for _ in range(4):
+                breaker.record_failure(0)
+                delays.append(breaker.retry_at)
+
+        assert delays == [30, 60, 100, 100]
+        assert not breaker.allow(99)
+        assert breaker.allow(100)
+
+    def test_success_closes_and_resets_delay(self):
+        """Test the first answer closes the breaker and resets the backoff."""
+        breaker = CircuitBreaker(threshold=1, base_delay=30, max_delay=900)
+        breaker.record_failure(0)
+        breaker.record_failure(0)
+
+        breaker.record_success()
+        breaker.record_failure(0)
+
+        assert breaker.retry_at <= 30
+
+
+class TestFleetScheduler:
+    """Test spreading the polls of a hub's devices."""
+
+    def test_phases_spread_evenly(self):
+        """Test devices get evenly spaced offsets within the interval."""
+        fleet = FleetScheduler(4)
+
+        assert [fleet.phase(index, 60) for index in range(4)] == [0, 15, 30, 45]
+
+    def test_next_tick_on_phase(self):
+        """Test each device ticks on its own phase of the interval grid."""
+        fleet = FleetScheduler(4)
+
+        assert fleet.next_tick(0, 60, 100) == 120
+        assert fleet.next_tick(1, 60, 100) == 135
+        assert fleet.next_tick(2, 60, 100) == 150
+        assert fleet.next_tick(3, 60, 100) == 105
+
+    def test_next_tick_is_after_now(self):
+        """Test a device exactly on its phase ticks an interval later."""
+        fleet = FleetScheduler(2)
+
+        assert fleet.next_tick(1, 10, 15) == 25
+
+    def test_phase_follows_interval(self):
+        """Test a faster interval keeps the same relative spread."""
+        fleet = FleetScheduler(2)
+
+        assert fleet.next_tick(1, 5, 100) == 102.5
@@ -1,9 +1,12 @@
 """Tests for MarstekBaseSensor and sensor setup."""
 import os
 import sys
+from datetime import datetime, timezone
 from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.entity import DeviceInfo
 from pytest_homeassistant_custom_component.common import MockConfigEntry
 
@@ -12,11 +15,17 @@ project_root = os.path.dirname(os.path.dirname(__file__))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from custom_components.marstek_local_api.api import CacheSnapshot
 from custom_components.marstek_local_api.const import (
     CONF_DEVICE_NAME,
     CONF_DOMAINS,
     DOMAIN,
     OPTIONS,
+    SIGNAL_METHODS_CHANGED,
+)
+from custom_components.marstek_local_api.coordinator import MarstekCoordinator
+from custom_components.marstek_local_api.descriptions import (
+    MarstekSensorEntityDescription,
 )
 from custom_components.marstek_local_api.sensor import (
     MarstekBaseSensor,
@@ -25,65 +34,92 @@ from custom_components.marstek_local_api.sensor import (
 )
 
 
+def _description(method, key, name, unit=None, transform=None, deadband=None):
+    """Build a sensor description the way the descriptor table does."""
+    return MarstekSensorEntityDescription(
+        method=method,
+        key=key,
+        name=name,
+        native_unit_of_measurement=unit,
+        transform=transform,
+        deadband=deadband,
+    )
+
+
 class TestMarstekBaseSensor:
     """Test MarstekBaseSensor entity."""
 
-    def test_sensor_initialization(self, mock_device):
+    def _coordinator_update(self, sensor, data, written=True):
+        """Push data to the sensor as the coordinator would."""
+        sensor.coordinator.data = data
+        sensor.coordinator.changed_methods = set(data or {})
+        sensor.async_write_ha_state = Mock()
+        sensor._handle_coordinator_update()
+        assert sensor.async_write_ha_state.called == written
+
+    def test_sensor_initialization(self, mock_coordinator, mock_device):
         """Test sensor is properly initialized."""
         sensor = MarstekBaseSensor(
-            device=mock_device,
-            method="Bat.GetStatus",
-            key="soc",
-            name="Battery SOC",
-            unit="%",
-            transform=None
+            coordinator=mock_coordinator,
+            description=_description(
+                method="Bat.GetStatus",
+                key="soc",
+                name="Battery SOC",
+                unit="%",
+                transform=None,
+            ),
         )
 
+        assert sensor.coordinator == mock_coordinator
+        assert sensor.coordinator_context == "Bat.GetStatus"
         assert sensor._device == mock_device
         assert sensor._method == "Bat.GetStatus"
         assert sensor._key == "soc"
-        assert sensor._unit == "%"
+        assert sensor.native_unit_of_measurement == "%"
         assert sensor._state is None
         assert sensor._transform is None
+        assert sensor.should_poll is False
         assert sensor._attr_unique_id == "marstek_local_test_marstek_battery_bat.getstatus_soc"
 
-    def test_sensor_initialization_with_transform(self, mock_device):
+    def test_sensor_initialization_with_transform(self, mock_coordinator):
         """Test sensor initialization with transform function."""
         transform_func = lambda x: x / 10
         
         sensor = MarstekBaseSensor(
-            device=mock_device,
-            method="Bat.GetStatus",
-            key="bat_temp",
-            name="Battery Temperature",
-            unit="°C",
-            transform=transform_func
+            coordinator=mock_coordinator,
+            description=_description(
+                method="Bat.GetStatus",
+                key="bat_temp",
+                name="Battery Temperature",
+                unit="°C",
+                transform=transform_func,
+            ),
         )
 
         assert sensor._transform == transform_func
 
-    def test_native_value_property(self, mock_device):
+    def test_native_value_property(self, mock_coordinator):
         """Test native_value property returns current state."""
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "soc", "Battery SOC")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
         sensor._state = 85
 
         assert sensor.native_value == 85
 
-    def test_native_unit_of_measurement_property(self, mock_device):
+    def test_native_unit_of_measurement_property(self, mock_coordinator):
         """Test native_unit_of_measurement property."""
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "soc", "Battery SOC", unit="%")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC", unit="%"))
 
         assert sensor.native_unit_of_measurement == "%"
 
-    def test_native_unit_of_measurement_none(self, mock_device):
+    def test_native_unit_of_measurement_none(self, mock_coordinator):
         """Test native_unit_of_measurement when no unit is provided."""
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "ssid", "WiFi SSID")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "ssid", "WiFi SSID"))
 
         assert sensor.native_unit_of_measurement is None
 
-    def test_device_info_property(self, mock_device):
+    def test_device_info_property(self, mock_coordinator):
         """Test device_info property returns correct DeviceInfo."""
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "soc", "Battery SOC")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
 
         device_info = sensor._attr_device_info
         # DeviceInfo is a TypedDict, so check its contents instead of type
@@ -94,132 +130,199 @@ class TestMarstekBaseSensor:
         assert device_info["name"] == "Battery status"  # From OPTIONS
         assert device_info["manufacturer"] == "Marstek"
 
-    def test_update_successful(self, mock_device):
+    def test_update_successful(self, mock_coordinator):
         """Test successful sensor update."""
-        mock_device.get_value.return_value = 85
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "soc", "Battery SOC")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
 
-        sensor.update()
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"soc": 85}})
 
-        mock_device.update.assert_called_once()
-        mock_device.get_value.assert_called_once_with("Bat.GetStatus", "soc")
         assert sensor._state == 85
 
-    def test_update_with_transform(self, mock_device):
+    def test_update_reads_only_own_method(self, mock_coordinator):
+        """Test sensor only reads the slice for its own method."""
+        sensor = MarstekBaseSensor(mock_coordinator, _description("ES.GetMode", "bat_soc", "Battery %"))
+
+        self._coordinator_update(
+            sensor, {"ES.GetStatus": {"bat_soc": 10}, "ES.GetMode": {"bat_soc": 90}}
+        )
+
+        assert sensor._state == 90
+
+    def test_update_with_transform(self, mock_coordinator):
         """Test sensor update with transform function."""
-        mock_device.get_value.return_value = 250  # Raw temperature value
         transform_func = lambda x: x / 10  # Convert to actual temperature
         
         sensor = MarstekBaseSensor(
-            mock_device, "Bat.GetStatus", "bat_temp", "Battery Temperature", 
-            unit="°C", transform=transform_func
+            mock_coordinator,
+            _description("Bat.GetStatus", "bat_temp", "Battery Temperature", unit="°C", transform=transform_func),
         )
 
-        sensor.update()
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"bat_temp": 250}})
 
         assert sensor._state == 25.0  # Transformed value
 
-    def test_update_with_transform_error(self, caplog):
+    def test_update_with_transform_error(self, mock_coordinator, caplog):
         """Test sensor update when transform function raises exception."""
-        # Create a specific mock device for this test
-        mock_device = Mock(spec=MarstekDevice)
-        mock_device._device_name = "Test Marstek Battery"
-        mock_device._host = "192.168.1.100"
-        mock_device.get_value = Mock(return_value="invalid")
-        mock_device.update = Mock()
-        
         transform_func = lambda x: x / 10  # Will fail with string input
         
         sensor = MarstekBaseSensor(
-            mock_device, "Bat.GetStatus", "bat_temp", "Battery Temperature",
-            transform=transform_func
+            mock_coordinator,
+            _description("Bat.GetStatus", "bat_temp", "Battery Temperature", transform=transform_func),
         )
         sensor._state = 20.0  # Previous state
 
         with caplog.at_level("ERROR"):
-            sensor.update()
+            self._coordinator_update(sensor, {"Bat.GetStatus": {"bat_temp": "invalid"}})
 
         assert "Transform failed" in caplog.text
         assert sensor._state == "invalid"  # Should store the raw value when transform fails
 
-    def test_update_no_value_available(self, caplog):
+    def test_update_no_value_available(self, mock_coordinator, caplog):
         """Test sensor update when no value is available from device."""
-        # Create a specific mock device for this test
-        mock_device = Mock(spec=MarstekDevice)
-        mock_device._device_name = "Test Marstek Battery"
-        mock_device._host = "192.168.1.100"
-        mock_device.get_value = Mock(return_value=None)
-        mock_device.update = Mock()
-        
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "soc", "Battery SOC")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
         sensor._state = 80  # Previous state
 
         with caplog.at_level("DEBUG"):
-            sensor.update()
+            self._coordinator_update(sensor, {"Bat.GetStatus": {}}, written=False)
 
         assert sensor._state == 80  # Should keep previous state
         assert "has no new value" in caplog.text
 
-    def test_update_first_time_no_value(self):
+    def test_update_first_time_no_value(self, mock_coordinator):
         """Test sensor update when no value is available and no previous state."""
-        # Create a specific mock device for this test
-        mock_device = Mock(spec=MarstekDevice)
-        mock_device._device_name = "Test Marstek Battery"
-        mock_device._host = "192.168.1.100"
-        mock_device.get_value = Mock(return_value=None)
-        mock_device.update = Mock()
-        
-        sensor = MarstekBaseSensor(mock_device, "Bat.GetStatus", "soc", "Battery SOC")
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
 
-        sensor.update()
+        self._coordinator_update(sensor, None, written=False)
 
         assert sensor._state is None
 
-    def test_boolean_transform(self, mock_device):
+    def test_unchanged_value_not_written(self, mock_coordinator):
+        """Test an identical value does not write state again."""
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"soc": 85}})
+
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"soc": 85}}, written=False)
+
+    def test_unchanged_method_skipped(self, mock_coordinator):
+        """Test sensors of methods that did not change are left alone."""
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
+        sensor._state = 80
+        mock_coordinator.data = {"Bat.GetStatus": {"soc": 85}}
+        mock_coordinator.changed_methods = {"ES.GetStatus"}
+        sensor.async_write_ha_state = Mock()
+
+        sensor._handle_coordinator_update()
+
+        sensor.async_write_ha_state.assert_not_called()
+        assert sensor._state == 80
+
+    def test_availability_change_written(self, mock_coordinator):
+        """Test losing the device writes state even without new values."""
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
+        mock_coordinator.last_update_success = False
+
+        self._coordinator_update(sensor, {})
+
+        assert not sensor.available
+
+    def test_stale_values_unavailable(self, mock_coordinator):
+        """Test the sensor turns unavailable once its method's values are stale."""
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"soc": 85}})
+        assert sensor.available
+
+        mock_coordinator.is_stale.return_value = True
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"soc": 85}})
+
+        assert not sensor.available
+        mock_coordinator.is_stale.assert_called_with("Bat.GetStatus")
+
+    def test_last_updated_at(self, mock_coordinator):
+        """Test the reception time of the shown reading is exposed."""
+        sensor = MarstekBaseSensor(mock_coordinator, _description("Bat.GetStatus", "soc", "Battery SOC"))
+        assert sensor.extra_state_attributes is None
+
+        mock_coordinator.snapshot = CacheSnapshot(
+            updated_at={"Bat.GetStatus": 1700000000.0}
+        )
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"soc": 85}})
+
+        assert sensor.extra_state_attributes == {
+            "last_updated_at": datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)
+        }
+
+    def test_absolute_deadband(self, mock_coordinator):
+        """Test small moves within the absolute deadband are not written."""
+        sensor = MarstekBaseSensor(
+            mock_coordinator,
+            _description("PV.GetStatus", "pv_power", "PV Power", deadband=(5, 0)),
+        )
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_power": 200}})
+
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_power": 204}}, written=False)
+        assert sensor._state == 200
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_power": 206}})
+        assert sensor._state == 206
+
+    def test_relative_deadband(self, mock_coordinator):
+        """Test the relative deadband scales with the current value."""
+        sensor = MarstekBaseSensor(
+            mock_coordinator,
+            _description("PV.GetStatus", "pv_voltage", "PV Voltage", deadband=(0, 0.01)),
+        )
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_voltage": 400}})
+
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_voltage": 403}}, written=False)
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_voltage": 405}})
+
+    def test_deadband_always_writes_zero(self, mock_coordinator):
+        """Test dropping to zero is never held back by the deadband."""
+        sensor = MarstekBaseSensor(
+            mock_coordinator,
+            _description("PV.GetStatus", "pv_power", "PV Power", deadband=(5, 0)),
+        )
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_power": 3}})
+
+        self._coordinator_update(sensor, {"PV.GetStatus": {"pv_power": 0}})
+
+        assert sensor._state == 0
+
+    def test_boolean_transform(self, mock_coordinator):
         """Test boolean transform function."""
-        mock_device.get_value.return_value = 1
         transform_func = lambda v: bool(v) if v is not None else False
         
         sensor = MarstekBaseSensor(
-            mock_device, "Bat.GetStatus", "charg_flag", "Charging Flag",
-            transform=transform_func
+            mock_coordinator,
+            _description("Bat.GetStatus", "charg_flag", "Charging Flag", transform=transform_func),
         )
 
-        sensor.update()
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"charg_flag": 1}})
 
         assert sensor._state is True
 
-    def test_boolean_transform_zero(self, mock_device):
+    def test_boolean_transform_zero(self, mock_coordinator):
         """Test boolean transform with zero value."""
-        mock_device.get_value.return_value = 0
         transform_func = lambda v: bool(v) if v is not None else False
         
         sensor = MarstekBaseSensor(
-            mock_device, "Bat.GetStatus", "dischrg_flag", "Discharging Flag",
-            transform=transform_func
+            mock_coordinator,
+            _description("Bat.GetStatus", "dischrg_flag", "Discharging Flag", transform=transform_func),
         )
 
-        sensor.update()
+        self._coordinator_update(sensor, {"Bat.GetStatus": {"dischrg_flag": 0}})
 
         assert sensor._state is False
 
-    def test_float_transform(self):
+    def test_float_transform(self, mock_coordinator):
         """Test float transform function."""
-        # Create a specific mock device for this test
-        mock_device = Mock(spec=MarstekDevice)
-        mock_device._device_name = "Test Marstek Battery"
-        mock_device._host = "192.168.1.100"
-        mock_device.get_value = Mock(return_value="200.5")
-        mock_device.update = Mock()
-        
         transform_func = lambda v: float(v)
 
         sensor = MarstekBaseSensor(
-            mock_device, "ES.GetMode", "ongrid_power", "On Grid Power",
-            unit="W", transform=transform_func
+            mock_coordinator,
+            _description("ES.GetMode", "ongrid_power", "On Grid Power", unit="W", transform=transform_func),
         )
 
-        sensor.update()
+        self._coordinator_update(sensor, {"ES.GetMode": {"ongrid_power": "200.5"}})
 
         assert sensor._state == 200.5
         assert isinstance(sensor._state, float)
@@ -228,21 +331,33 @@ class TestMarstekBaseSensor:
 class TestAsyncSetupEntry:
     """Test async_setup_entry function."""
 
+    async def _async_setup_platform(self, hass, entry, add_entities):
+        """Store a coordinator as the integration setup does, then set up sensors."""
+        methods = entry.data.get(CONF_DOMAINS, list(OPTIONS.keys()))
+        device = MarstekDevice(entry.data["host"], entry.data["port"], methods)
+        coordinator = MarstekCoordinator(hass, device, 10)
+        hass.data.setdefault(DOMAIN, {})[entry.entry_id] = {
+            "coordinator": coordinator,
+            "coordinators": [coordinator],
+            "methods": list(methods),
+        }
+        await async_setup_entry(hass, entry, add_entities)
+
     @pytest.mark.asyncio
     async def test_async_setup_entry_basic(self, hass, mock_config_entry):
         """Test basic sensor setup from config entry."""
         mock_add_entities = AsyncMock()
 
-        await async_setup_entry(hass, mock_config_entry, mock_add_entities)
+        await self._async_setup_platform(hass, mock_config_entry, mock_add_entities)
 
         # Verify entities were added
         mock_add_entities.assert_called_once()
         call_args = mock_add_entities.call_args
         entities = call_args[0][0]
-        update_before_add = call_args[0][1]
 
         assert len(entities) > 0
-        assert update_before_add is True
+        # The coordinator already refreshed, entities must not poll on add
+        assert len(call_args[0]) == 1
 
         # Check that entities were created for configured domains
         configured_domains = mock_config_entry.data[CONF_DOMAINS]
@@ -252,6 +367,17 @@ class TestAsyncSetupEntry:
         for method in entity_methods:
             assert method in configured_domains
 
+    @pytest.mark.asyncio
+    async def test_async_setup_entry_plans_entity_methods(
+        self, hass, mock_config_entry
+    ):
+        """Test once entities were added only their methods are polled."""
+        await self._async_setup_platform(hass, mock_config_entry, Mock())
+        coordinator = hass.data[DOMAIN][mock_config_entry.entry_id]["coordinator"]
+
+        # No entity listens, as if all were disabled
+        assert coordinator.scheduler._intervals == {}
+
     @pytest.mark.asyncio
     async def test_async_setup_entry_all_domains(self, hass):
         """Test sensor setup with all available domains."""
@@ -267,7 +393,7 @@ class TestAsyncSetupEntry:
         )
         mock_add_entities = AsyncMock()
 
-        await async_setup_entry(hass, config_entry, mock_add_entities)
+        await self._async_setup_platform(hass, config_entry, mock_add_entities)
 
         entities = mock_add_entities.call_args[0][0]
         
@@ -293,7 +419,7 @@ class TestAsyncSetupEntry:
         )
         mock_add_entities = AsyncMock()
 
-        await async_setup_entry(hass, config_entry, mock_add_entities)
+        await self._async_setup_platform(hass, config_entry, mock_add_entities)
 
         entities = mock_add_entities.call_args[0][0]
         
@@ -308,7 +434,7 @@ class TestAsyncSetupEntry:
 
         # Check SOC sensor properties
         soc_sensor = soc_sensors[0]
-        assert soc_sensor._unit == "%"
+        assert soc_sensor.native_unit_of_measurement == "%"
         assert soc_sensor._transform is None
 
     @pytest.mark.asyncio
@@ -326,7 +452,7 @@ class TestAsyncSetupEntry:
         )
         mock_add_entities = AsyncMock()
 
-        await async_setup_entry(hass, config_entry, mock_add_entities)
+        await self._async_setup_platform(hass, config_entry, mock_add_entities)
 
         entities = mock_add_entities.call_args[0][0]
         
@@ -359,7 +485,7 @@ class TestAsyncSetupEntry:
         )
         mock_add_entities = AsyncMock()
 
-        await async_setup_entry(hass, config_entry, mock_add_entities)
+        await self._async_setup_platform(hass, config_entry, mock_add_entities)
 
         entities = mock_add_entities.call_args[0][0]
         assert len(entities) == 0
@@ -379,8 +505,43 @@ class TestAsyncSetupEntry:
         )
         mock_add_entities = AsyncMock()
 
-        await async_setup_entry(hass, config_entry, mock_add_entities)
+        await self._async_setup_platform(hass, config_entry, mock_add_entities)
 
         # Should still work, scan_interval will be None
         entities = mock_add_entities.call_args[0][0]
-        assert len(entities) > 0
\ No newline at end of file
+        assert len(entities) > 0
+
+    @pytest.mark.asyncio
+    async def test_methods_changed_adds_and_removes_sensors(
+        self, hass, mock_config_entry
+    ):
+        """Test changed options only touch the sensors of changed methods."""
+        mock_config_entry.add_to_hass(hass)
+        mock_add_entities = Mock()
+        await self._async_setup_platform(hass, mock_config_entry, mock_add_entities)
+        entity_registry = er.async_get(hass)
+        wifi = entity_registry.async_get_or_create(
+            "sensor",
+            DOMAIN,
+            "marstek_local_marstek_battery_wifi.getstatus_ssid",
+            config_entry=mock_config_entry,
+        )
+        battery = entity_registry.async_get_or_create(
+            "sensor",
+            DOMAIN,
+            "marstek_local_marstek_battery_bat.getstatus_soc",
+            config_entry=mock_config_entry,
+        )
+        mock_add_entities.reset_mock()
+
+        async_dispatcher_send(
+            hass,
+            SIGNAL_METHODS_CHANGED.format(mock_config_entry.entry_id),
+            ["PV.GetStatus"],
+            ["Wifi.GetStatus"],
+        )
+
+        added = mock_add_entities.call_args[0][0]
+        assert {entity._method for entity in added} == {"PV.GetStatus"}
+        assert entity_registry.async_get(wifi.entity_id) is None
+        assert entity_registry.async_get(battery.entity_id) is not None